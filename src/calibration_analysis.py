@@ -6,7 +6,6 @@ from matched_peaks_analysis import (
     plot_calibration_analysis,
     plot_peak_stability_across_providers
 )
-from IPython.display import display
 import matplotlib.pyplot as plt
 from utils import (
     toc, toc_anchor, toc_entry, toc_link, toc_heading, toc_collapsible,
@@ -2,6 +2,7 @@ import os
 import pandas as pd
 from IPython.display import display
 import matplotlib.pyplot as plt
+import render
 from ramanchada2.protocols.calibration.calibration_model import CalibrationModel
 from ramanchada2.protocols.calibration.xcalibration import match_peaks4analysis
 from utils import (find_peaks, plot_si_peak, load_config, unicode_unit,
@@ -17,6 +18,7 @@ from utils import (
     )
 import glob
 from pathlib import Path
+from spectrastore import SpectraStore
 
 
 
@@ -36,6 +38,7 @@ interpolator = None
 
 logger = init_logging(Path(product["nb"]).parent , f"calibration_verify_{mode}.log")
 _config = load_config(os.path.join(config_root, config_templates))
+render.configure_from(_config, product["nb"])
 warnings.filterwarnings('ignore')
 
 
@@ -56,7 +59,7 @@ def get_profile(tag):
     return "Pearson4" if tag in ["Si", "S0B", "S0N"] else "Gaussian"
 
 def plot_model(calmodel, entry, laser_wl, optical_path, spe_sils=None, spe_units=None):
-    fig, (ax, ax1, ax2) = plt.subplots(1, 3, figsize=(15, 3))
+    fig, (ax, ax1, ax2) = render.subplots(1, 3, figsize=(15, 3))
     logger.debug(f"{modelfile} {tags}")
     calmodel.components[0].model.plot(ax=ax)
     fig.suptitle(f"[{entry}] {laser_wl}nm {optical_path}")
@@ -98,6 +101,8 @@ def average_spe(df, tag):
 
 
 def plot_distances(pairwise_distances, identifiers):
+    if not render.enabled():
+        return
     plt.figure(figsize=(8, 6))
     plt.imshow(pairwise_distances, cmap='YlGnBu', interpolation='nearest')
     plt.colorbar(label='Cosine similarity')
@@ -106,7 +111,7 @@ def plot_distances(pairwise_distances, identifiers):
     plt.title('Cosine Distance Heatmap')
     plt.xlabel('Spectra')
     plt.ylabel('Spectra')
-    plt.show()
+    render.show()
 
 
 toc_heading(f"Comparison of {mode} calibrated spectra","h1")
@@ -128,8 +133,8 @@ for key in upstream["spectracal_*"].keys():
     key_frame = key.replace("spectracal","spectraframe")
     
     data_file = upstream["spectraframe_*"][key_frame]["h5"]
-    spectra_frame = pd.read_hdf(data_file, key="templates_read")
-    df_bkg_substracted = spectra_frame.loc[spectra_frame["background"] == "BACKGROUND_SUBTRACTED"]
+    # spectra are read per optical path below and not kept, so memory follows one group
+    store = SpectraStore(data_file, key="templates_read", keep=False)
     folder_path = upstream["spectracal_*"][key]["calmodels"]
     folder_path_ycal = upstream["spectracaly_*"][f"spectracaly_{entry}"]["ycalmodels"]
     pkl_files = [file for file in os.listdir(folder_path) if file.endswith(".pkl")]
@@ -153,7 +158,7 @@ for key in upstream["spectracal_*"].keys():
         else:
             ycalmodels = None
 
-        op_data = df_bkg_substracted.loc[df_bkg_substracted["optical_path"] == optical_path]
+        op_data = store.query(background="BACKGROUND_SUBTRACTED", optical_path=optical_path)
         spe_sum = None
         spe_sil = average_spe(op_data, si_tag)
         if spe_sil is None:
@@ -163,7 +168,7 @@ for key in upstream["spectracal_*"].keys():
             spe_sil = spe_sil.trim_axes(method='x-axis', boundaries=(520.45-50, 520.45+50))
 
         plot_model(calmodel, entry, laser_wl, optical_path, [spe_sil],spe_units=si_units )
-        fig, (ax, ax1, ax2, ax3) = plt.subplots(1, 4, figsize=(15, 3))
+        fig, (ax, ax1, ax2, ax3) = render.subplots(1, 4, figsize=(15, 3))
         _id = f"[{entry}] {laser_wl}nm {optical_path}"
         fig.suptitle(_id)
         axes = {pst_tag: ax, validation_tag: ax1, calcite_tag: ax2,
@@ -269,6 +274,7 @@ for key in upstream["spectracal_*"].keys():
             except Exception:
                 traceback.print_exc()
             axis.grid()
+    store.close()
 
 matched_peaks.to_csv(product["matched_peaks"], index=False)
 
@@ -331,7 +337,7 @@ for tag in original:
 
     if len(id_calibrated) > 1:
         # make a 3x2 grid; bottom row spans both columns
-        fig = plt.figure(figsize=(16, 14))
+        fig = render.figure(figsize=(16, 14))
         gs = fig.add_gridspec(2, 2, height_ratios=[1, 1])
         ax_hist1 = fig.add_subplot(gs[0, 0])
         ax_biclust1 = fig.add_subplot(gs[0, 1])
@@ -386,7 +392,7 @@ for tag in original:
         ncols = min(n_spectra, 4)  # up to 6 spectra per row
         nrows = int(np.ceil(n_spectra / ncols))
 
-        fig_spec, axes = plt.subplots(nrows, ncols, figsize=(4*ncols, 3*nrows), sharex=True, sharey=True)
+        fig_spec, axes = render.subplots(nrows, ncols, figsize=(4*ncols, 3*nrows), sharex=True, sharey=True)
         axes = np.atleast_1d(axes).flatten()
 
         for i in range(n_spectra):
@@ -413,7 +419,7 @@ for tag in original:
         fig_spec.suptitle(f"{tag}", fontsize=14)
         fig_spec.tight_layout(rect=[0, 0, 1, 0.9])
 
-        plt.show()
+        render.show()
 
     except Exception as e:
         logger.error(f"Failed to plot spectra for {tag}: {e}")
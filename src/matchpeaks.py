@@ -1,4 +1,5 @@
 import numpy as np
+from scipy import sparse
 from scipy.interpolate import PchipInterpolator, RBFInterpolator
 
 def model_fit(x, ref, model_name="rbf", extrapolate=False):
@@ -15,25 +16,270 @@ def model_predict(model, x, model_name="rbf", extrapolate=False):
     return result
 
 
-def match_peaks_1to1_skip(measured_pixels, ref_wavelengths,
-                          measured_intensities=None, ref_intensities=None,
-                          gap_penalty=None, k=0.75, tolerance=0.3,
-                          alpha=1.0, beta=1.0):
+# predecessor of a DP cell; ties are resolved in this order
+MATCH, SKIP_MEASURED, SKIP_REF = 1, 2, 3
+
+
+def _skip_terms(skip_measured):
     """
-    One-to-one monotonic alignment with optional skipping.
+    The terms of a measured-skip cost: a tuple of terms is added to the cell one
+    after the other, in order, as ``(prev + t0) + t1``; a single array is one term.
+    """
+    return skip_measured if isinstance(skip_measured, tuple) else (skip_measured,)
 
-    Match cost = Euclidean distance in (position, intensity) space:
-        sqrt( (Δpos)^2 + (Δint)^2 )
 
-    Intensity normalization is automatically handled.
-    Strength parameters:
-        alpha : scales match cost
-        beta  : inflates skip penalties for strong peaks
+def _add_terms(values, terms, at):
+    """``values`` plus every term sliced with ``at``, added in order (in place)."""
+    for term in terms:
+        values += term[at]
+    return values
+
+
+def _dp_align(cost, skip_measured, skip_ref):
     """
+    Fill the (n+1)x(m+1) table of a monotonic one-to-one alignment.
+
+    DP[i,j] = min(DP[i-1,j] + skip_measured[i-1], DP[i,j-1] + skip_ref[j-1],
+                  DP[i-1,j-1] + cost[i-1,j-1])
+
+    Cells of an anti-diagonal (i+j constant) only depend on the previous two, so
+    the table is swept one anti-diagonal at a time with array operations; in the
+    padded flat table the cells of an anti-diagonal are a strided slice. Every
+    cell adds and compares the same floats as a cell-by-cell loop.
+
+    A (b, n, m) ``cost`` with (b, n) ``skip_measured`` and (b, m) or (m,)
+    ``skip_ref`` fills b tables in the same sweep. ``skip_measured`` may be a
+    tuple of terms (see ``_skip_terms``).
+
+    Returns the table(s) and the uint8 predecessor of every cell.
+    """
+    cost = np.asarray(cost, dtype=float)
+    batch = cost.ndim == 3
+    b, n, m = cost.shape if batch else (1,) + cost.shape
+    cost = cost.reshape(b, n, m)
+    w = m + 2
+    # guard row and column of inf around the table
+    table = np.full((b, n + 2, w), np.inf)
+    table[:, 1, 1] = 0.0
+    flat = table.reshape(b, -1)
+    cpad = np.zeros((b, n + 1, m + 1))
+    cpad[:, 1:, 1:] = cost
+    cflat = cpad.reshape(b, -1)
+    guard = np.full((b, 1), np.inf)
+    gaps_i = [np.concatenate((guard, np.broadcast_to(np.asarray(term, dtype=float), (b, n))), axis=1)
+              for term in _skip_terms(skip_measured)]
+    # skip_ref by m - j, so that it runs along an anti-diagonal in increasing i
+    gap_j = np.concatenate((guard, np.broadcast_to(np.asarray(skip_ref, dtype=float), (b, m))), axis=1)[:, ::-1]
+    step = max(m, 1)
+
+    for d in range(1, n + m + 1):
+        lo, hi = max(0, d - m), min(n, d)
+        # (i, j) is table[i+1, j+1]
+        start = lo * (m + 1) + w + d + 1
+        stop = hi * (m + 1) + w + d + 2
+        best = _add_terms(flat[:, start - w:stop - w:m + 1].copy(), gaps_i, np.s_[:, lo:hi + 1])
+        np.minimum(best, flat[:, start - 1:stop - 1:m + 1] + gap_j[:, m - d + lo:m - d + hi + 1], out=best)
+        np.minimum(best, flat[:, start - w - 1:stop - w - 1:m + 1] + cflat[:, lo * m + d:hi * m + d + 1:step],
+                   out=best)
+        flat[:, start:stop:m + 1] = best
+
+    DP = table[:, 1:, 1:]
+    # predecessors, from the same sums as above
+    pred = np.full((b, n + 1, m + 1), SKIP_REF, dtype=np.uint8)
+    up = _add_terms(table[:, 1:-1, 1:].copy(), gaps_i, np.s_[:, 1:, None])
+    pred[:, 1:, :][DP[:, 1:, :] == up] = SKIP_MEASURED
+    pred[:, 1:, 1:][DP[:, 1:, 1:] == table[:, 1:-1, 1:-1] + cost] = MATCH
+    pred[:, 0, 1:] = SKIP_REF
+    pred[:, 1:, 0] = SKIP_MEASURED
+    return (DP, pred) if batch else (DP[0], pred[0])
+
+
+def _band(pos_measured, pos_ref, tolerance, corridor):
+    """
+    DP columns [lo[i], hi[i]] evaluated in row i by the banded mode.
+
+    The columns of the references within ``tolerance`` of measured peak i-1,
+    and the diagonal predecessors of the next row's, widened by ``corridor``
+    columns; lo and hi are made non-decreasing and consecutive rows overlap,
+    so any monotonic path between two cells of the band can pass through the
+    band by skips.
+    """
+    if tolerance is None:
+        raise ValueError("banded alignment needs a tolerance")
+    if np.any(np.diff(pos_measured) < 0) or np.any(np.diff(pos_ref) < 0):
+        raise ValueError("banded alignment needs sorted peak positions")
+    m = len(pos_ref)
+    hi = np.searchsorted(pos_ref, pos_measured + tolerance, side="right")
+    # no reference within tolerance: the column between the references
+    lo = np.minimum(np.searchsorted(pos_ref, pos_measured - tolerance, side="left") + 1, hi)
+    lo, hi = np.concatenate(([0], lo)), np.concatenate(([0], hi))
+    # the match predecessors (i-1, j-1) of the band cells
+    lo[:-1] = np.minimum(lo[:-1], lo[1:] - 1)
+    hi[:-1] = np.maximum(hi[:-1], hi[1:] - 1)
+    lo = np.clip(lo - corridor, 0, m)
+    hi = np.clip(hi + corridor, 0, m)
+    hi[-1] = m
+    hi = np.maximum.accumulate(hi)
+    lo = np.minimum.accumulate(lo[::-1])[::-1]
+    lo[0] = 0
+    lo[1:] = np.minimum(lo[1:], hi[:-1])
+    return lo, hi
+
+
+def _dp_align_banded(cost_fn, skip_measured, skip_ref, lo, hi):
+    """
+    ``_dp_align`` restricted to the cells of row i in columns lo[i]..hi[i].
+
+    Cells outside the band count as inf. The band is stored row by row, cell
+    (i, j) at band[i, j - lo[i]], so memory and time are O((n+m) * band width).
+    ``cost_fn(i, j)`` is the match cost of measured i and reference j (index
+    arrays), evaluated in the band only.
+
+    Returns the table as a sparse matrix of the band cells, the predecessors
+    (band layout) and ``lo``.
+    """
+    terms = _skip_terms(skip_measured)
+    n, m = len(terms[0]), len(skip_ref)
+    width = hi - lo + 1
+    w = int(width.max())
+    band = np.full((n + 1, w), np.inf)
+    band[0, 0] = 0.0
+    flat = band.reshape(-1)
+    pred = np.full((n + 1, w), SKIP_REF, dtype=np.uint8)
+    pflat = pred.reshape(-1)
+    gaps_i = [np.concatenate(([np.inf], np.broadcast_to(np.asarray(term, dtype=float), n))) for term in terms]
+    gap_j = np.concatenate(([np.inf], np.asarray(skip_ref, dtype=float)))
+    rows = np.arange(n + 1)
+    # rows of anti-diagonal d (lo[i] <= d-i <= hi[i]) are a range, lo and hi being non-decreasing
+    diagonals = np.arange(n + m + 1)
+    first = np.searchsorted(rows + hi, diagonals, side="left")
+    last = np.searchsorted(rows + lo, diagonals, side="right") - 1
+
+    for d in range(1, n + m + 1):
+        i = rows[first[d]:last[d] + 1]
+        j = d - i
+        at = i * w + j - lo[i]
+        prev = np.maximum(i - 1, 0)
+        lo_p, hi_p = lo[prev], hi[prev]
+        has_up = (i > 0) & (j >= lo_p) & (j <= hi_p)
+        has_left = j - 1 >= lo[i]
+        has_diag = (i > 0) & (j - 1 >= lo_p) & (j - 1 <= hi_p)
+        up = np.where(has_up, _add_terms(flat[np.where(has_up, prev * w + j - lo_p, 0)], gaps_i, i), np.inf)
+        left = np.where(has_left, flat[np.where(has_left, at - 1, 0)] + gap_j[j], np.inf)
+        diag = np.full(len(i), np.inf)
+        if has_diag.any():
+            ii, jj = i[has_diag] - 1, j[has_diag] - 1
+            diag[has_diag] = flat[ii * w + jj - lo[ii]] + cost_fn(ii, jj)
+        best = np.minimum(np.minimum(up, left), diag)
+        flat[at] = best
+        step = np.where(diag == best, MATCH, np.where(up == best, SKIP_MEASURED, SKIP_REF))
+        step[i == 0] = SKIP_REF
+        step[j == 0] = SKIP_MEASURED
+        pflat[at] = step
+
+    cols = np.arange(w)
+    inside = cols[None, :] < width[:, None]
+    table = sparse.csr_matrix(
+        (band[inside], (lo[:, None] + cols[None, :])[inside], np.concatenate(([0], np.cumsum(width)))),
+        shape=(n + 1, m + 1))
+    return table, pred, lo
+
+
+def _dp_pred(cost_fn, skip_measured, skip_ref):
+    """
+    Predecessors of ``_dp_align`` without the table.
+
+    The anti-diagonals are swept as in ``_dp_align``, but only the last two are
+    kept (cell (i, d-i) at index i+1 of a rolling buffer) and the match costs
+    are evaluated one anti-diagonal at a time with ``cost_fn``; the only n x m
+    array is the uint8 predecessor matrix. Every cell adds and compares the
+    same floats as ``_dp_align``.
+    """
+    terms = _skip_terms(skip_measured)
+    n, m = len(terms[0]), len(skip_ref)
+    pred = np.full((n + 1, m + 1), SKIP_REF, dtype=np.uint8)
+    pflat = pred.reshape(-1)
+    gaps_i = [np.concatenate(([np.inf], np.broadcast_to(np.asarray(term, dtype=float), n))) for term in terms]
+    gap_j = np.concatenate(([np.inf], np.asarray(skip_ref, dtype=float)))[::-1]
+    prev2 = np.full(n + 2, np.inf)
+    prev1 = np.full(n + 2, np.inf)
+    prev1[1] = 0.0
+    cur = np.empty(n + 2)
+    step = max(m, 1)
+
+    for d in range(1, n + m + 1):
+        lo, hi = max(0, d - m), min(n, d)
+        up = _add_terms(prev1[lo:hi + 1].copy(), gaps_i, np.s_[lo:hi + 1])
+        best = np.minimum(up, prev1[lo + 1:hi + 2] + gap_j[m - d + lo:m - d + hi + 1])
+        # match needs i > 0 and j = d - i > 0
+        i = np.arange(max(lo, 1), min(hi, d - 1) + 1)
+        diag = np.full(hi - lo + 1, np.inf)
+        diag[i - lo] = prev2[i] + cost_fn(i - 1, d - i - 1)
+        np.minimum(best, diag, out=best)
+        pflat[lo * m + d:hi * m + d + 1:step] = np.where(
+            diag == best, MATCH, np.where(up == best, SKIP_MEASURED, SKIP_REF))
+        cur.fill(np.inf)
+        cur[lo + 1:hi + 2] = best
+        prev2, prev1, cur = prev1, cur, prev2
+
+    pred[0, 1:] = SKIP_REF
+    pred[1:, 0] = SKIP_MEASURED
+    return pred
+
+
+def _backtrack(pred, lo=None, m=None, with_path=True):
+    """Matched cells and the full path from (0,0) to (n,m), following ``pred`` (band layout with ``lo``)."""
+    i, j = pred.shape[0] - 1, (pred.shape[1] - 1 if lo is None else m)
+    matched = []
+    path = [(i, j)]
+    while i > 0 or j > 0:
+        step = pred[i, j] if lo is None else pred[i, j - lo[i]]
+        if step == MATCH:
+            matched.append((i, j))
+            i -= 1
+            j -= 1
+        elif step == SKIP_MEASURED:
+            i -= 1
+        else:
+            j -= 1
+        if with_path:
+            path.append((i, j))
+    return matched[::-1], (path[::-1] if with_path else None)
 
-    mp = np.array(measured_pixels, dtype=float)
-    rw = np.array(ref_wavelengths, dtype=float)
 
+def _align(cost_fn, skip_measured, skip_ref, band=None, diagnostics=True):
+    """
+    DP table, matched cells and path of the alignment.
+
+    ``cost_fn(i, j)`` is the match cost of measured i and reference j (index
+    arrays, broadcast); ``band`` is the ``(lo, hi)`` of ``_band`` for the
+    banded mode, where the table is a sparse matrix of the band cells.
+    Without ``diagnostics`` the table and the path are not built (``None``).
+    ``skip_measured`` may be a tuple of terms (see ``_skip_terms``).
+    """
+    n, m = len(_skip_terms(skip_measured)[0]), len(skip_ref)
+    if band is not None:
+        DP, pred, lo = _dp_align_banded(cost_fn, skip_measured, skip_ref, *band)
+        matched, path = _backtrack(pred, lo, m, with_path=diagnostics)
+    elif diagnostics:
+        DP, pred = _dp_align(cost_fn(np.arange(n)[:, None], np.arange(m)[None, :]), skip_measured, skip_ref)
+        matched, path = _backtrack(pred)
+    else:
+        DP, pred = None, _dp_pred(cost_fn, skip_measured, skip_ref)
+        matched, path = _backtrack(pred, with_path=False)
+    return (DP if diagnostics else None), matched, path
+
+
+def _result(mp, rw, DP, matched, path, extra=()):
+    """The aligners' return tuple: matched measured and reference peaks, pairs, DP, path, extra."""
+    pairs = [(mp[i-1], rw[j-1]) for i, j in matched]
+    mp_out, rw_out = zip(*pairs) if pairs else ([], [])
+    return (np.array(mp_out), np.array(rw_out), pairs, DP, path) + tuple(extra)
+
+
+def _costs_1to1_skip(mp, rw, measured_intensities=None, ref_intensities=None,
+                     gap_penalty=None, k=0.75, tolerance=0.3, alpha=1.0, beta=1.0):
+    """Match cost function, skip costs, band inputs and extra outputs of ``match_peaks_1to1_skip``."""
     n, m = len(mp), len(rw)
 
     # ---- position normalization ----
@@ -54,198 +300,176 @@ def match_peaks_1to1_skip(measured_pixels, ref_wavelengths,
     if gap_penalty is None:
         gap_penalty = k * np.median(np.abs(np.diff(rw_norm))) if m > 1 else k
 
-    # ---- DP table ----
-    DP = np.full((n+1, m+1), np.inf)
-    DP[0,0] = 0.0
-
-    # ========================= DP LOOP =========================
-    for i in range(n+1):
-        for j in range(m+1):
+    # ---- match and skip costs ----
+    def cost(i, j):
+        # Δ position
+        dpos = mp_norm[i] - rw_norm[j]
+        # Δ intensity if available, else position-only metric
+        if mi_norm is not None and ri_norm is not None:
+            dint = mi_norm[i] - ri_norm[j]
+        else:
+            dint = np.zeros_like(dpos)
+        # Euclidean cost, hard tolerance on position mismatches, scaled match cost
+        c = np.sqrt(dpos*dpos + dint*dint)
+        return np.where(np.abs(dpos) > tolerance, 1.0, c) * (1.0 / (1 + alpha))
 
-            # ----- skip measured -----
-            if i > 0:
-                gp = gap_penalty
-                if mi_norm is not None:
-                    gp *= (1 + beta * mi_norm[i-1])
-                DP[i,j] = min(DP[i,j], DP[i-1,j] + gp)
+    skip_measured = np.full(n, gap_penalty) if mi_norm is None else gap_penalty * (1 + beta * mi_norm)
+    skip_ref = np.full(m, gap_penalty) if ri_norm is None else gap_penalty * (1 + beta * ri_norm)
+    return cost, skip_measured, skip_ref, (mp_norm, rw_norm, tolerance), ()
 
-            # ----- skip reference -----
-            if j > 0:
-                gp = gap_penalty
-                if ri_norm is not None:
-                    gp *= (1 + beta * ri_norm[j-1])
-                DP[i,j] = min(DP[i,j], DP[i,j-1] + gp)
 
-            # ----- match (i,j) -----
-            if i > 0 and j > 0:
+def match_peaks_1to1_skip(measured_pixels, ref_wavelengths,
+                          measured_intensities=None, ref_intensities=None,
+                          gap_penalty=None, k=0.75, tolerance=0.3,
+                          alpha=1.0, beta=1.0, banded=False, corridor=2,
+                          return_diagnostics=True):
+    """
+    One-to-one monotonic alignment with optional skipping.
 
-                # Δ position
-                dp = mp_norm[i-1] - rw_norm[j-1]
+    Match cost = Euclidean distance in (position, intensity) space:
+        sqrt( (Δpos)^2 + (Δint)^2 )
 
-                # Δ intensity if available
-                if mi_norm is not None and ri_norm is not None:
-                    di = mi_norm[i-1] - ri_norm[j-1]
-                else:
-                    # fallback to position-only metric
-                    di = 0.0
+    Intensity normalization is automatically handled.
+    Strength parameters:
+        alpha : scales match cost
+        beta  : inflates skip penalties for strong peaks
 
-                # Euclidean cost
-                cost = np.sqrt(dp*dp + di*di)
+    banded=True only evaluates the matches within tolerance (plus ``corridor``
+    cells to either side): O((n+m)*band) instead of O(n*m), the out-of-tolerance
+    matches are not considered and DP is a sparse matrix of the evaluated cells.
+    Positions must be sorted.
 
-                # hard tolerance on position mismatches
-                if abs(dp) > tolerance:
-                    cost = 1.0
+    return_diagnostics=False returns None for DP and path: only the last two
+    anti-diagonals of costs and a uint8 predecessor matrix are kept.
+    """
 
-                # scale match cost
-                cost *= 1.0 / (1 + alpha)
+    mp = np.array(measured_pixels, dtype=float)
+    rw = np.array(ref_wavelengths, dtype=float)
 
-                DP[i,j] = min(DP[i,j], DP[i-1,j-1] + cost)
+    cost, skip_measured, skip_ref, band_on, _ = _costs_1to1_skip(
+        mp, rw, measured_intensities, ref_intensities, gap_penalty, k, tolerance, alpha, beta)
+    band = _band(*band_on, corridor) if banded else None
+    DP, matched, _ = _align(cost, skip_measured, skip_ref, band, return_diagnostics)
+    return _result(mp, rw, DP, matched, [(0, 0)] + matched if return_diagnostics else None)
 
-    # ========================= BACKTRACK =========================
-    i, j = n, m
-    pairs = []
-    path = []
 
-    while i > 0 or j > 0:
+def _costs_position_intensity(mp, rw, measured_intensities=None, k=1.0, alpha=1.0, tolerance=None):
+    """Match cost function, skip costs, band inputs and extra outputs of ``match_peaks_position_intensity``."""
+    n, m = len(mp), len(rw)
 
-        # attempt match
-        if i > 0 and j > 0:
-            dp = mp_norm[i-1] - rw_norm[j-1]
-
-            if mi_norm is not None and ri_norm is not None:
-                di = mi_norm[i-1] - ri_norm[j-1]
-            else:
-                di = 0.0
-
-            cost = np.sqrt(dp*dp + di*di)
-            if abs(dp) > tolerance:
-                cost = 1.0
-            cost *= 1.0 / (1 + alpha)
-
-            if DP[i,j] == DP[i-1,j-1] + cost:
-                pairs.append((mp[i-1], rw[j-1]))
-                path.append((i,j))
-                i -= 1
-                j -= 1
-                continue
-
-        # skip measured
-        if i > 0:
-            gp = gap_penalty
-            if mi_norm is not None:
-                gp *= (1 + beta * mi_norm[i-1])
-            if DP[i,j] == DP[i-1,j] + gp:
-                i -= 1
-                continue
-
-        # skip reference
-        if j > 0:
-            gp = gap_penalty
-            if ri_norm is not None:
-                gp *= (1 + beta * ri_norm[j-1])
-            if DP[i,j] == DP[i,j-1] + gp:
-                j -= 1
-                continue
-
-    path.append((0,0))
-    path = path[::-1]
-    pairs.reverse()
+    # normalize measured intensity
+    if measured_intensities is not None:
+        mp_i = np.array(measured_intensities, dtype=float)
+        mp_i = mp_i / (mp_i.max() + 1e-12)
+    else:
+        mp_i = np.ones(n)
 
-    mp_out, rw_out = zip(*pairs) if pairs else ([], [])
+    def cost(i, j):
+        pos_diff = np.abs(mp[i] - rw[j])
+        if tolerance is None:
+            return pos_diff / (1 + alpha * mp_i[i])
+        return np.where(pos_diff <= tolerance, pos_diff / (1 + alpha * mp_i[i]), np.inf)
 
-    return np.array(mp_out), np.array(rw_out), pairs, DP, path
+    # skip measured: k * intensity, skip reference: free
+    return cost, k * mp_i, np.zeros(m), (mp, rw, tolerance), ()
 
 
 def match_peaks_position_intensity(measured_pixels, ref_wavelengths,
                                    measured_intensities=None,
-                                   k=1.0, alpha=1.0, tolerance=None):
+                                   k=1.0, alpha=1.0, tolerance=None,
+                                   banded=False, corridor=2, return_diagnostics=True):
     """
     Match measured peaks to reference peaks:
     - Match cost based on position, slightly favoring strong measured peaks
     - Skip cost depends only on measured intensity
+
+    banded=True (needs a tolerance and sorted positions) only evaluates the
+    matches within tolerance, plus ``corridor`` cells to either side; DP is
+    then a sparse matrix of the evaluated cells.
+
+    return_diagnostics=False returns None for DP and path: only the last two
+    anti-diagonals of costs and a uint8 predecessor matrix are kept.
     """
     mp = np.array(measured_pixels, dtype=float)
     rw = np.array(ref_wavelengths, dtype=float)
+    cost, skip_measured, skip_ref, band_on, _ = _costs_position_intensity(
+        mp, rw, measured_intensities, k, alpha, tolerance)
+    band = _band(*band_on, corridor) if banded else None
+    DP, matched, path = _align(cost, skip_measured, skip_ref, band, return_diagnostics)
+    return _result(mp, rw, DP, matched, path)
+
+
+def _costs_auto_k(mp, rw, measured_intensities=None, alpha=1.0, tolerance=None):
+    """Match cost function, skip costs, band inputs and extra outputs (k) of ``match_peaks_auto_k``."""
     n, m = len(mp), len(rw)
 
-    # normalize measured intensity
+    # Normalize positions to [0,1]
+    mp_p = (mp - mp.min()) / (mp.max() - mp.min()) if n > 1 else np.zeros_like(mp)
+    rw_p = (rw - rw.min()) / (rw.max() - rw.min()) if m > 1 else np.zeros_like(rw)
+
+    # Normalize measured intensity
     if measured_intensities is not None:
         mp_i = np.array(measured_intensities, dtype=float)
         mp_i = mp_i / (mp_i.max() + 1e-12)
     else:
         mp_i = np.ones(n)
 
-    DP = np.full((n+1, m+1), np.inf)
-    DP[0,0] = 0.0
-
-    # Fill DP table
-    for i in range(n+1):
-        for j in range(m+1):
-            # Skip measured
-            if i > 0:
-                DP[i,j] = min(DP[i,j], DP[i-1,j] + k * mp_i[i-1])
-            # Skip reference
-            if j > 0:
-                DP[i,j] = min(DP[i,j], DP[i,j-1])
-            # Match
-            if i > 0 and j > 0:
-                pos_diff = abs(mp[i-1] - rw[j-1])
-                if tolerance is None or pos_diff <= tolerance:
-                    cost = pos_diff / (1 + alpha * mp_i[i-1])
-                else:
-                    cost = np.inf
-                DP[i,j] = min(DP[i,j], DP[i-1,j-1] + cost)
-
-    # Backtrack
-    i, j = n, m
-    pairs = []
-    path = [(i,j)]
-    while i > 0 or j > 0:
-        if i > 0 and j > 0:
-            pos_diff = abs(mp[i-1] - rw[j-1])
-            if tolerance is None or pos_diff <= tolerance:
-                cost = pos_diff / (1 + alpha * mp_i[i-1])
-            else:
-                cost = np.inf
-            if DP[i,j] == DP[i-1,j-1] + cost:
-                pairs.append((mp[i-1], rw[j-1]))
-                i -= 1
-                j -= 1
-                path.append((i,j))
-                continue
-        if i > 0 and DP[i,j] == DP[i-1,j] + k * mp_i[i-1]:
-            i -= 1
-            path.append((i,j))
-            continue
-        if j > 0 and DP[i,j] == DP[i,j-1]:
-            j -= 1
-            path.append((i,j))
-            continue
+    # Automatic skip weight based on typical normalized step
+    if m > 1:
+        delta_pos = np.median(np.diff(np.sort(rw_p)))
+    else:
+        delta_pos = 1.0
+    k = delta_pos / 0.5
 
-    pairs.reverse()
-    path = path[::-1]
-    mp_out, rw_out = zip(*pairs) if pairs else ([], [])
-    return np.array(mp_out), np.array(rw_out), pairs, DP, path
+    # Large cost for out-of-tolerance matches
+    large_penalty = 10 * delta_pos
+
+    def cost(i, j):
+        pos_diff = np.abs(mp_p[i] - rw_p[j])
+        if tolerance is None:
+            return pos_diff / (1 + alpha * mp_i[i])
+        return np.where(pos_diff <= tolerance, pos_diff / (1 + alpha * mp_i[i]), large_penalty)
+
+    # skip measured: k * intensity, skip reference: free
+    return cost, k * mp_i, np.zeros(m), (mp_p, rw_p, tolerance), (k,)
 
 
 def match_peaks_auto_k(measured_pixels, ref_wavelengths,
                                   measured_intensities=None,
-                                  alpha=1.0, tolerance=None):
+                                  alpha=1.0, tolerance=None,
+                                  banded=False, corridor=2, return_diagnostics=True):
     """
     Monotonic one-to-one peak alignment with:
     - Match cost based on normalized position, slightly favoring strong measured peaks
     - Skip cost depends only on measured intensity
     - Automatic skip weight k
     - Proper tolerance handling
+    - banded=True (needs a tolerance and sorted positions): only the matches
+      within tolerance, plus ``corridor`` cells to either side, are evaluated;
+      DP is then a sparse matrix of the evaluated cells
+    - return_diagnostics=False returns None for DP and path: only the last two
+      anti-diagonals of costs and a uint8 predecessor matrix are kept
     """
     mp = np.array(measured_pixels, dtype=float)
     rw = np.array(ref_wavelengths, dtype=float)
+    cost, skip_measured, skip_ref, band_on, extra = _costs_auto_k(mp, rw, measured_intensities, alpha, tolerance)
+    band = _band(*band_on, corridor) if banded else None
+    DP, matched, path = _align(cost, skip_measured, skip_ref, band, return_diagnostics)
+    return _result(mp, rw, DP, matched, path, extra)
+
+
+def _costs_ready(mp, rw, measured_intensities=None, alpha=1.0, gamma=2.0,
+                 skip_baseline=0.02, tolerance=None, normalize=False):
+    """Match cost function, skip costs, band inputs and extra outputs (k) of ``match_peaks_ready``."""
     n, m = len(mp), len(rw)
 
     # Normalize positions to [0,1]
-    mp_p = (mp - mp.min()) / (mp.max() - mp.min()) if n > 1 else np.zeros_like(mp)
-    rw_p = (rw - rw.min()) / (rw.max() - rw.min()) if m > 1 else np.zeros_like(rw)
-
+    if normalize:
+        mp_p = (mp - mp.min()) / (mp.max() - mp.min()) if n > 1 else np.zeros_like(mp)
+        rw_p = (rw - rw.min()) / (rw.max() - rw.min()) if m > 1 else np.zeros_like(rw)
+    else:
+        mp_p = mp
+        rw_p = rw
     # Normalize measured intensity
     if measured_intensities is not None:
         mp_i = np.array(measured_intensities, dtype=float)
@@ -253,75 +477,36 @@ def match_peaks_auto_k(measured_pixels, ref_wavelengths,
     else:
         mp_i = np.ones(n)
 
-    # Automatic skip weight based on typical normalized step
+    # Automatic skip weight based on reference median step
     if m > 1:
         delta_pos = np.median(np.diff(np.sort(rw_p)))
     else:
         delta_pos = 1.0
     k = delta_pos / 0.5
 
-    # Large cost for out-of-tolerance matches
+    # Set default tolerance if not provided
+    if tolerance is None and m > 1:
+        tolerance = delta_pos
+
+    # Large penalty for out-of-tolerance matches
     large_penalty = 10 * delta_pos
 
-    # DP table
-    DP = np.full((n+1, m+1), np.inf)
-    DP[0,0] = 0.0
-
-    # Fill DP table
-    for i in range(n+1):
-        for j in range(m+1):
-            # Skip measured
-            if i > 0:
-                DP[i,j] = min(DP[i,j], DP[i-1,j] + k * mp_i[i-1])
-            # Skip reference (free)
-            if j > 0:
-                DP[i,j] = min(DP[i,j], DP[i,j-1])
-            # Match
-            if i > 0 and j > 0:
-                pos_diff = abs(mp_p[i-1] - rw_p[j-1])
-                if tolerance is None or pos_diff <= tolerance:
-                    cost = pos_diff / (1 + alpha * mp_i[i-1])
-                else:
-                    cost = large_penalty
-                DP[i,j] = min(DP[i,j], DP[i-1,j-1] + cost)
-
-    # Backtrack
-    i, j = n, m
-    pairs = []
-    path = [(i,j)]
-    while i > 0 or j > 0:
-        if i > 0 and j > 0:
-            pos_diff = abs(mp_p[i-1] - rw_p[j-1])
-            if tolerance is None or pos_diff <= tolerance:
-                cost = pos_diff / (1 + alpha * mp_i[i-1])
-            else:
-                cost = large_penalty
-            if DP[i,j] == DP[i-1,j-1] + cost:
-                pairs.append((mp[i-1], rw[j-1]))
-                i -= 1
-                j -= 1
-                path.append((i,j))
-                continue
-        if i > 0 and DP[i,j] == DP[i-1,j] + k * mp_i[i-1]:
-            i -= 1
-            path.append((i,j))
-            continue
-        if j > 0 and DP[i,j] == DP[i,j-1]:
-            j -= 1
-            path.append((i,j))
-            continue
+    def cost(i, j):
+        pos_diff = np.abs(mp_p[i] - rw_p[j])
+        if tolerance is None:
+            return pos_diff / (1 + alpha * mp_i[i])**gamma
+        return np.where(pos_diff <= tolerance, pos_diff / (1 + alpha * mp_i[i])**gamma, large_penalty)
 
-    pairs.reverse()
-    path = path[::-1]
-    mp_out, rw_out = zip(*pairs) if pairs else ([], [])
-    return np.array(mp_out), np.array(rw_out), pairs, DP, path, k
+    # skip measured: intensity, then baseline (two terms, added in this order); skip reference: free
+    return cost, (k * mp_i, skip_baseline), np.zeros(m), (mp_p, rw_p, tolerance), (k,)
 
 
 def match_peaks_ready(measured_pixels, ref_wavelengths,
                       measured_intensities=None,
                       alpha=1.0, gamma=2.0,
                       skip_baseline=0.02, tolerance=None,
-                      normalize=False):
+                      normalize=False, banded=False, corridor=2,
+                      return_diagnostics=True):
     """
     Monotonic one-to-one peak alignment using dynamic programming.
 
@@ -352,6 +537,16 @@ def match_peaks_ready(measured_pixels, ref_wavelengths,
     normalize : bool, optional
         If True, positions are normalized to [0,1] for scale-independent computation. 
         Default is False.
+    banded : bool, optional
+        If True, only the matches within tolerance (plus ``corridor`` cells to either
+        side) are evaluated: O((n+m)*band) time and memory instead of O(n*m).
+        Out-of-tolerance matches are not considered. Positions must be sorted.
+        Default is False.
+    corridor : int, optional
+        Extra reference columns evaluated on either side of the tolerance band. Default is 2.
+    return_diagnostics : bool, optional
+        If False, DP and path are returned as None and not built: only the last two
+        anti-diagonals of costs and a uint8 predecessor matrix are kept. Default is True.
 
     Returns
     -------
@@ -362,9 +557,11 @@ def match_peaks_ready(measured_pixels, ref_wavelengths,
     pairs : list of tuples
         List of matched pairs as (measured_peak, reference_peak).
     DP : ndarray
-        Dynamic programming table of cumulative costs.
+        Dynamic programming table of cumulative costs (a scipy.sparse matrix of the
+        evaluated cells with banded=True, None with return_diagnostics=False).
     path : list of tuples
-        Backtracked path through the DP table showing the sequence of matches and skips.
+        Backtracked path through the DP table showing the sequence of matches and skips
+        (None with return_diagnostics=False).
     k : float
         Automatically computed skip weight based on reference spacing.
 
@@ -378,85 +575,77 @@ def match_peaks_ready(measured_pixels, ref_wavelengths,
     """
     mp = np.array(measured_pixels, dtype=float)
     rw = np.array(ref_wavelengths, dtype=float)
-    n, m = len(mp), len(rw)
+    cost, skip_measured, skip_ref, band_on, extra = _costs_ready(
+        mp, rw, measured_intensities, alpha, gamma, skip_baseline, tolerance, normalize)
+    band = _band(*band_on, corridor) if banded else None
+    DP, matched, path = _align(cost, skip_measured, skip_ref, band, return_diagnostics)
+    return _result(mp, rw, DP, matched, path, extra)
 
-    # Normalize positions to [0,1]
-    if normalize:
-        mp_p = (mp - mp.min()) / (mp.max() - mp.min()) if n > 1 else np.zeros_like(mp)
-        rw_p = (rw - rw.min()) / (rw.max() - rw.min()) if m > 1 else np.zeros_like(rw)
-    else:
-        mp_p = mp
-        rw_p = rw
-    # Normalize measured intensity
-    if measured_intensities is not None:
-        mp_i = np.array(measured_intensities, dtype=float)
-        mp_i = mp_i / (mp_i.max() + 1e-12)
-    else:
-        mp_i = np.ones(n)
 
-    # Automatic skip weight based on reference median step
-    if m > 1:
-        delta_pos = np.median(np.diff(np.sort(rw_p)))
-    else:
-        delta_pos = 1.0
-    k = delta_pos / 0.5
+_COSTS = {
+    "1to1_skip": _costs_1to1_skip,
+    "position_intensity": _costs_position_intensity,
+    "auto_k": _costs_auto_k,
+    "ready": _costs_ready,
+}
 
-    # Set default tolerance if not provided
-    if tolerance is None and m > 1:
-        tolerance = delta_pos
 
-    # Large penalty for out-of-tolerance matches
-    large_penalty = 10 * delta_pos
+def match_peaks_batch(measured_pixels, ref_wavelengths, measured_intensities=None,
+                      method="ready", **kwargs):
+    """
+    Align several measured peak lists to the same reference peaks in one DP sweep.
 
-    # DP table
-    DP = np.full((n+1, m+1), np.inf)
-    DP[0,0] = 0.0
-
-    # Fill DP table
-    for i in range(n+1):
-        for j in range(m+1):
-            # Skip measured
-            if i > 0:
-                DP[i,j] = min(DP[i,j], DP[i-1,j] + k * mp_i[i-1] + skip_baseline)
-            # Skip reference (free)
-            if j > 0:
-                DP[i,j] = min(DP[i,j], DP[i,j-1])
-            # Match
-            if i > 0 and j > 0:
-                pos_diff = abs(mp_p[i-1] - rw_p[j-1])
-                if tolerance is None or pos_diff <= tolerance:
-                    cost = pos_diff / (1 + alpha * mp_i[i-1])**gamma
-                else:
-                    cost = large_penalty
-                DP[i,j] = min(DP[i,j], DP[i-1,j-1] + cost)
-
-    # Backtrack to get matched pairs
-    i, j = n, m
-    pairs = []
-    path = [(i,j)]
-    while i > 0 or j > 0:
-        if i > 0 and j > 0:
-            pos_diff = abs(mp_p[i-1] - rw_p[j-1])
-            if tolerance is None or pos_diff <= tolerance:
-                cost = pos_diff / (1 + alpha * mp_i[i-1])**gamma
-            else:
-                cost = large_penalty
-            if DP[i,j] == DP[i-1,j-1] + cost:
-                pairs.append((mp[i-1], rw[j-1]))
-                i -= 1
-                j -= 1
-                path.append((i,j))
-                continue
-        if i > 0 and DP[i,j] == DP[i-1,j] + k * mp_i[i-1] + skip_baseline:
-            i -= 1
-            path.append((i,j))
-            continue
-        if j > 0 and DP[i,j] == DP[i,j-1]:
-            j -= 1
-            path.append((i,j))
-            continue
+    Parameters
+    ----------
+    measured_pixels : list of array_like
+        Measured peak positions, one array per spectrum.
+    ref_wavelengths : array_like
+        Reference peak positions, shared by all spectra.
+    measured_intensities : list of array_like or None, optional
+        Measured peak intensities per spectrum (entries may be None).
+    method : str, optional
+        Aligner, one of "1to1_skip", "position_intensity", "auto_k", "ready":
+        ``kwargs`` are the parameters of ``match_peaks_<method>`` (without banded).
 
-    pairs.reverse()
-    path = path[::-1]
-    mp_out, rw_out = zip(*pairs) if pairs else ([], [])
-    return np.array(mp_out), np.array(rw_out), pairs, DP, path, k
+    Returns
+    -------
+    list of tuples
+        Per spectrum, what ``match_peaks_<method>`` returns for it.
+
+    Notes
+    -----
+    The cost matrices are stacked into a (spectra, max peaks, reference peaks)
+    tensor, the rows beyond a spectrum's peaks being padding, and all tables
+    are filled by the same anti-diagonal sweep; the results equal those of the
+    single-spectrum aligner. Memory grows with spectra x max peaks x reference peaks.
+    """
+    if method not in _COSTS:
+        raise ValueError(f"Unknown method {method}, expected one of {list(_COSTS)}")
+    rw = np.array(ref_wavelengths, dtype=float)
+    m = len(rw)
+    mps = [np.array(mp, dtype=float) for mp in measured_pixels]
+    if measured_intensities is None:
+        measured_intensities = [None] * len(mps)
+    if not mps:
+        return []
+    setups = [_COSTS[method](mp, rw, mi, **kwargs) for mp, mi in zip(mps, measured_intensities)]
+
+    n = max(len(mp) for mp in mps)
+    # padding rows: no match, free skip
+    cost = np.full((len(mps), n, m), np.inf)
+    skip_measured = tuple(np.zeros((len(mps), n)) for _ in _skip_terms(setups[0][1]))
+    skip_ref = np.empty((len(mps), m))
+    for b, (mp, (cost_fn, skip_i, skip_j, _, _)) in enumerate(zip(mps, setups)):
+        cost[b, :len(mp)] = cost_fn(np.arange(len(mp))[:, None], np.arange(m)[None, :])
+        for term, values in zip(skip_measured, _skip_terms(skip_i)):
+            term[b, :len(mp)] = values
+        skip_ref[b] = skip_j
+    DP, pred = _dp_align(cost, skip_measured, skip_ref)
+
+    results = []
+    for b, (mp, (_, _, _, _, extra)) in enumerate(zip(mps, setups)):
+        matched, path = _backtrack(pred[b, :len(mp) + 1])
+        if method == "1to1_skip":
+            path = [(0, 0)] + matched
+        results.append(_result(mp, rw, DP[b, :len(mp) + 1], matched, path, extra))
+    return results
@@ -8,10 +8,11 @@ import json
 from utils import (
     toc, toc_anchor, toc_entry, toc_link, toc_heading, toc_collapsible
     )
-from utils import read_template, get_config_excludecols, parse_numeric_value
+from utils import read_template, get_config_excludecols, parse_numeric_value, get_config_template_cache, get_config_workers
 import traceback
 import pandas as pd
-from ramanchada2.spectrum import Spectrum
+import spectracache
+from spectraprobe import probe_spectra
 
 
 # + tags=["parameters"]
@@ -34,6 +35,7 @@ warnings.filterwarnings(
 
 _config_path = os.path.join(config_root, config_templates)
 _config = load_config(_config_path)
+spectracache.configure_from(_config, config_root)
 
 Path(os.path.dirname(product["nb"])).mkdir(parents=True, exist_ok=True)
 
@@ -59,7 +61,8 @@ for index, (_entry, data) in enumerate(templates.items()):
     _path_excel = os.path.join(config_root, data["template"])
     df = read_template(_path_excel,
                        path_spectra=os.path.join(config_root, data["path"]),
-                       subfolders=data.get("subfolders", {}), cleanup=False)
+                       subfolders=data.get("subfolders", {}), cleanup=False,
+                       cache_dir=get_config_template_cache(_config, config_root))
     toc_heading(f"Metadata table shape: rows {df.shape[0]} columns {df.shape[1]}", "h4")
     # show only cols used for grouping / identifying background
     exclude_cols = get_config_excludecols(_config, _entry)
@@ -153,17 +156,19 @@ for index, (_entry, data) in enumerate(templates.items()):
     display(HTML('<p><a href="#top">Back to top</a></p>'))
 
 all_df = pd.concat(all_dfs, ignore_index=True)
-for idx, row in all_df.iterrows():
-    try:
-        if resolution and not row["sample"].startswith("T"):
-            spe = Spectrum.from_local_file(row["file_name"])
+if resolution:
+    # header probe of the spectrum files, in parallel if configured
+    probed = ~all_df["sample"].astype(str).str.startswith("T")
+    results = probe_spectra(all_df.loc[probed, "file_name"], workers=get_config_workers(_config))
+    for idx, (info, err) in zip(all_df.index[probed], results):
+        if err is None:
             all_df.at[idx, "status"] = "OK"
-            all_df.at[idx, "resolution"] = len(spe.x)
-            all_df.at[idx, "x_min"] = min(spe.x)
-            all_df.at[idx, "x_max"] = max(spe.x)
-    except Exception as err:
-        all_df.at[idx, "status"] = "error"
-        all_df.at[idx, "error"] = err
+            all_df.at[idx, "resolution"] = info["points"]
+            all_df.at[idx, "x_min"] = info["x_min"]
+            all_df.at[idx, "x_max"] = info["x_max"]
+        else:
+            all_df.at[idx, "status"] = "error"
+            all_df.at[idx, "error"] = err
 
 summary_counts = (
     all_df
@@ -1,23 +1,18 @@
 from pathlib import Path
-import pandas as pd
 import numpy as np
-from ramanchada2.protocols.calibration.calibration_model import CalibrationModel
 import ramanchada2.misc.constants as rc2const
 from ramanchada2.spectrum import Spectrum
-from ramanchada2.misc.utils.ramanshift_to_wavelength import (
-    shift_cm_1_to_abs_nm, filter_ref_lines_for_raman
-)
+from ramanchada2.misc.utils.ramanshift_to_wavelength import filter_ref_lines_for_raman
 import matplotlib.pyplot as plt
 import traceback
 from utils import (find_peaks, plot_si_peak, get_config_units, 
                    load_config, get_config_findkw, init_logging)
+from spectrastore import read_spectraframe
 import os.path
 from ramanchada2.protocols.calibration.qmatch import (
     universal_dispersion_calibration, diagnose_matching
     )
 
-from ramanchada2.spectrum import Spectrum
-
 # + tags=["parameters"]
 upstream = None
 product = None
@@ -245,7 +240,8 @@ elif mode == "demo":
 else:
     #Path(product["calmodels"]).mkdir(parents=True, exist_ok=True)
     try:
-        df = pd.read_hdf(upstream["spectraframe_*"][f"spectraframe_{key}"]["h5"], key="templates_read")
+        df = read_spectraframe(upstream["spectraframe_*"][f"spectraframe_{key}"]["h5"], key="templates_read",
+                               background="BACKGROUND_SUBTRACTED")
         _config = load_config(os.path.join(config_root, config_templates))
         _ne_units = get_config_units(_config, key, tag="neon")
         _si_units = get_config_units(_config, key, tag="si")
@@ -37,7 +37,7 @@ def make_release(
     if exclude_folders is None:
         exclude_folders = []
 
-    allowed_ext = {'.html', '.ipynb', '.pkl', '.xls', '.xlsx', '.xlsm'}
+    allowed_ext = {'.html', '.ipynb', '.pkl', '.xls', '.xlsx', '.xlsm', '.parquet', '.feather'}
     records = []
 
     for root, dirs, files in os.walk(input_folder):
@@ -82,7 +82,7 @@ def make_release(
             # Determine description based on filename prefix
             description = ""
             if file.startswith("spectraframe_"):
-                description = "metadata" if file.endswith("xlsx") else "dataset load"
+                description = "metadata" if file.endswith(("xlsx", "parquet", "feather")) else "dataset load"
             elif file.startswith("spectracal-"):
                 description = "x calibration"
             elif file.startswith("spectracaly-"):
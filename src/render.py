@@ -0,0 +1,411 @@
+"""Figure output of the pipeline tasks: ``full``, ``lazy`` or ``none``.
+
+The mode is set by ``processing.render`` in config_pipeline.json (default
+``full``) and can be overridden with the ``P6_RENDER`` environment variable,
+e.g. for nightly batch runs nobody reads the reports of.
+
+- ``full``: figures are drawn and shown in the report, as before.
+- ``lazy``: figures are built but not rendered; the plotted data of each shown
+  figure (arrays, labels, axis settings, see ``record``) is saved to a sidecar
+  file next to the report (``<report>.figures.pkl``, plain dicts and numpy
+  arrays, no matplotlib objects) and the report only gets a placeholder.
+  ``replay(sidecar)`` plots them again when needed. The plotting code still
+  runs as in ``full`` mode; the rasterization is deferred.
+- ``none``: ``subplots``/``figure`` return placeholder objects that accept and
+  ignore all drawing calls, so no figure is built; only data products are written.
+
+Tasks call ``render.subplots``/``render.figure`` instead of the pyplot functions
+and ``render.show(fig)`` instead of ``display(fig)``/``plt.show()``.
+"""
+import logging
+import os
+import os.path
+import pickle
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib import ticker
+from matplotlib.cm import ScalarMappable
+from matplotlib.collections import LineCollection, PathCollection, PolyCollection
+from matplotlib.colors import Normalize, to_rgba
+from matplotlib.patches import Polygon
+from IPython.display import HTML, display
+
+
+logger = logging.getLogger(__name__)
+
+MODES = ("full", "lazy", "none")
+
+_mode = "full"
+_sidecar = None
+_count = 0
+
+
+class _Skipped:
+    """Stand-in for a figure or axes in ``none`` mode; every call is ignored."""
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return self
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __getitem__(self, key):
+        return self
+
+    def __iter__(self):
+        return iter(())
+
+    def get_legend_handles_labels(self, *args, **kwargs):
+        return [], []
+
+
+SKIPPED = _Skipped()
+
+
+def configure(mode="full", report=None):
+    """Set the render mode; ``report`` is the path of the task's report (for the sidecar)."""
+    global _mode, _sidecar, _count
+    mode = os.environ.get("P6_RENDER", mode)
+    if mode not in MODES:
+        raise ValueError(f"render mode should be one of {MODES}, got {mode!r}")
+    _mode = mode
+    _count = 0
+    _sidecar = None
+    if mode == "lazy" and report is not None:
+        _sidecar = os.path.splitext(report)[0] + ".figures.pkl"
+        if os.path.exists(_sidecar):
+            os.remove(_sidecar)
+    if mode != "full":
+        # figures are not drawn by the notebook backend at the end of a cell
+        plt.switch_backend("agg")
+
+
+def configure_from(_config, report=None):
+    configure(_config.get("processing", {}).get("render", "full"), report=report)
+
+
+def get_mode():
+    return _mode
+
+
+def enabled():
+    """False if figures are not built at all."""
+    return _mode != "none"
+
+
+def subplots(nrows=1, ncols=1, squeeze=True, **kwargs):
+    """``plt.subplots``; placeholders with the same shape in ``none`` mode."""
+    if enabled():
+        return plt.subplots(nrows, ncols, squeeze=squeeze, **kwargs)
+    axes = np.empty((nrows, ncols), dtype=object)
+    axes.fill(SKIPPED)
+    if squeeze:
+        axes = SKIPPED if axes.size == 1 else axes.squeeze()
+    return SKIPPED, axes
+
+
+def figure(*args, **kwargs):
+    """``plt.figure``; a placeholder in ``none`` mode."""
+    return plt.figure(*args, **kwargs) if enabled() else SKIPPED
+
+
+def show(fig=None):
+    """Output a figure (all open figures if ``fig`` is None) according to the mode."""
+    if fig is SKIPPED:
+        return
+    if _mode == "full":
+        if fig is None:
+            plt.show()
+        else:
+            display(fig)
+            plt.close(fig)
+        return
+    for _fig in ([fig] if fig is not None else [plt.figure(n) for n in plt.get_fignums()]):
+        if _mode == "lazy":
+            _save(_fig)
+        plt.close(_fig)
+
+
+def close(fig):
+    """``plt.close`` for figures that are not shown."""
+    if fig is not SKIPPED:
+        plt.close(fig)
+
+
+def _save(fig):
+    global _count
+    if _sidecar is None:
+        return
+    try:
+        data = pickle.dumps(record(fig))
+    except Exception as err:
+        logger.warning(f"figure not saved: {err}")
+        return
+    with open(_sidecar, "ab") as f:
+        f.write(data)
+    display(HTML(f"<p><i>Figure {_count} saved to {os.path.basename(_sidecar)}"
+                 f" (<code>render.replay(path, {_count})</code>)</i></p>"))
+    _count += 1
+
+
+def _rgba(color):
+    try:
+        return tuple(float(c) for c in to_rgba(color))
+    except (TypeError, ValueError):
+        return None
+
+
+def _coords(transform, ax):
+    """Name of the coordinates ``transform`` maps from (None if not an axes' own)."""
+    for name, ref in (("data", ax.transData), ("axes", ax.transAxes),
+                      ("xaxis", ax.get_xaxis_transform()), ("yaxis", ax.get_yaxis_transform())):
+        if transform == ref:
+            return name
+    return None
+
+
+def _transform(coords, ax):
+    return {"data": ax.transData, "axes": ax.transAxes,
+            "xaxis": ax.get_xaxis_transform(), "yaxis": ax.get_yaxis_transform()}[coords]
+
+
+def _record_axis(axis, labels):
+    out = {"params": axis.get_tick_params(), "label_position": axis.get_label_position(),
+           "visible": axis.get_visible()}
+    formatter = axis.get_major_formatter()
+    # tick labels set by the task (set_xticklabels, categories): fixed
+    if not isinstance(formatter, (ticker.ScalarFormatter, ticker.LogFormatter)):
+        ticks = axis.get_majorticklocs()
+        out["ticks"] = np.asarray(ticks, dtype=float)
+        out["ticklabels"] = list(formatter.format_ticks(ticks))
+        out["rotation"] = labels[0].get_rotation() if labels else 0.0
+    return out
+
+
+def _record_artists(ax):
+    """Lines, collections, patches, images and texts of ``ax`` as dicts."""
+    # errorbar, stem and bar labels are on the container: give them to its first artist
+    labels = {}
+    for container in ax.containers:
+        children, label = container.get_children(), container.get_label()
+        if children and label and not label.startswith("_"):
+            labels[id(children[0])] = label
+
+    def _label(artist):
+        return labels.get(id(artist), str(artist.get_label()))
+
+    def line(artist):
+        coords = _coords(artist.get_transform(), ax)
+        if coords is None:
+            return None
+        marker = artist.get_marker()
+        return dict(
+            kind="line", coords=coords, label=_label(artist), zorder=artist.get_zorder(),
+            x=np.asarray(artist.get_xdata(orig=False), dtype=float),
+            y=np.asarray(artist.get_ydata(orig=False), dtype=float),
+            color=_rgba(artist.get_color()), linestyle=artist.get_linestyle(), linewidth=artist.get_linewidth(),
+            marker=marker if isinstance(marker, str) else "o", markersize=artist.get_markersize(),
+            markerfacecolor=_rgba(artist.get_markerfacecolor()), markeredgecolor=_rgba(artist.get_markeredgecolor()),
+            alpha=artist.get_alpha(), visible=artist.get_visible())
+
+    def collection(artist):
+        # colors of mapped values (scatter c=...) are set when drawn
+        artist.update_scalarmappable()
+        common = dict(label=_label(artist), zorder=artist.get_zorder(), alpha=artist.get_alpha(),
+                      facecolors=np.asarray(artist.get_facecolor(), dtype=float),
+                      edgecolors=np.asarray(artist.get_edgecolor(), dtype=float),
+                      linewidths=np.asarray(artist.get_linewidth(), dtype=float))
+        if isinstance(artist, PathCollection):
+            coords = _coords(artist.get_offset_transform(), ax)
+            return None if coords is None else dict(
+                kind="scatter", coords=coords, sizes=np.asarray(artist.get_sizes(), dtype=float),
+                offsets=np.asarray(artist.get_offsets(), dtype=float), **common)
+        coords = _coords(artist.get_transform(), ax)
+        if coords is None:
+            return None
+        if isinstance(artist, LineCollection):
+            return dict(kind="segments", coords=coords,
+                        segments=[np.asarray(s, dtype=float) for s in artist.get_segments()], **common)
+        if isinstance(artist, PolyCollection):
+            return dict(kind="polygons", coords=coords,
+                        verts=[np.asarray(p.vertices, dtype=float) for p in artist.get_paths()], **common)
+        logger.debug(f"{type(artist).__name__} not recorded")
+        return None
+
+    def patch(artist):
+        coords = _coords(artist.get_data_transform(), ax)
+        return None if coords is None else dict(
+            kind="patch", coords=coords, label=_label(artist), zorder=artist.get_zorder(), alpha=artist.get_alpha(),
+            verts=np.asarray(artist.get_patch_transform().transform(artist.get_path().vertices), dtype=float),
+            facecolor=_rgba(artist.get_facecolor()), edgecolor=_rgba(artist.get_edgecolor()),
+            linewidth=artist.get_linewidth(), fill=artist.get_fill())
+
+    def image(artist):
+        return dict(kind="image", array=np.ma.filled(np.asarray(artist.get_array(), dtype=float), np.nan),
+                    extent=tuple(artist.get_extent()), cmap=artist.get_cmap().name, clim=artist.get_clim(),
+                    origin=artist.origin, label=_label(artist), zorder=artist.get_zorder())
+
+    def text(artist):
+        coords = _coords(artist.get_transform(), ax)
+        return None if coords is None else dict(
+            kind="text", coords=coords, xy=tuple(artist.get_position()), text=artist.get_text(),
+            color=_rgba(artist.get_color()), fontsize=artist.get_fontsize(), ha=artist.get_horizontalalignment(),
+            va=artist.get_verticalalignment(), rotation=artist.get_rotation(), zorder=artist.get_zorder())
+
+    recorders = {id(a): fn for fn, group in ((line, ax.lines), (collection, ax.collections), (patch, ax.patches),
+                                             (image, ax.images), (text, ax.texts)) for a in group}
+    # in the order they were added, which decides the drawing order at equal zorder
+    artists = (recorders[id(a)](a) for a in ax.get_children() if id(a) in recorders)
+    return [rec for rec in artists if rec is not None]
+
+
+def _legend(legend):
+    if legend is None:
+        return None
+    return {"labels": [t.get_text() for t in legend.get_texts()], "title": legend.get_title().get_text()}
+
+
+def record(fig):
+    """
+    The plotted data of ``fig``: per axes the arrays of its lines, scatters,
+    segments, polygons, patches, images and texts, their labels and styles, and
+    the axis settings (position, limits, scales, labels, ticks, legend); the
+    figure size, suptitle, colorbars and legends. Plain dicts and numpy arrays;
+    ``rebuild`` plots them again. Other artists are left out.
+    """
+    colorbars = []
+    for ax in fig.axes:
+        for mappable in [*ax.collections, *ax.images]:
+            cbar = getattr(mappable, "colorbar", None)
+            if cbar is not None:
+                long_axis = cbar.ax.yaxis if cbar.orientation == "vertical" else cbar.ax.xaxis
+                colorbars.append(dict(cax=cbar.ax, box_aspect=cbar.ax.get_box_aspect(), anchor=cbar.ax.get_anchor(),
+                                      cmap=mappable.get_cmap().name, clim=mappable.get_clim(),
+                                      orientation=cbar.orientation, label=long_axis.get_label_text()))
+    caxes = [c["cax"] for c in colorbars]
+    axes = []
+    for ax in fig.axes:
+        if ax in caxes:
+            continue
+        axes.append(dict(
+            position=tuple(ax.get_position(original=True).bounds), visible=ax.get_visible(),
+            frame=ax.patch.get_visible(), facecolor=_rgba(ax.get_facecolor()),
+            title=ax.get_title(), xlabel=ax.get_xlabel(), ylabel=ax.get_ylabel(),
+            xlim=ax.get_xlim(), ylim=ax.get_ylim(), xscale=ax.get_xscale(), yscale=ax.get_yscale(),
+            aspect=ax.get_aspect(), xaxis=_record_axis(ax.xaxis, ax.get_xticklabels()),
+            yaxis=_record_axis(ax.yaxis, ax.get_yticklabels()),
+            artists=_record_artists(ax), legend=_legend(ax.get_legend())))
+    for c in colorbars:
+        c["cax"] = tuple(c["cax"].get_position(original=True).bounds)
+    return dict(size=tuple(fig.get_size_inches()), dpi=fig.get_dpi(), suptitle=fig.get_suptitle(),
+                axes=axes, colorbars=colorbars, legends=[_legend(legend) for legend in fig.legends])
+
+
+def _style(ax, rec):
+    return dict(transform=_transform(rec["coords"], ax), label=rec["label"], zorder=rec["zorder"],
+                alpha=rec["alpha"])
+
+
+def _rebuild_artists(ax, artists):
+    for rec in artists:
+        kind = rec["kind"]
+        if kind == "line":
+            ax.plot(rec["x"], rec["y"], color=rec["color"], linestyle=rec["linestyle"],
+                    linewidth=rec["linewidth"], marker=rec["marker"], markersize=rec["markersize"],
+                    markerfacecolor=rec["markerfacecolor"], markeredgecolor=rec["markeredgecolor"],
+                    visible=rec["visible"], scalex=False, scaley=False, **_style(ax, rec))
+        elif kind == "scatter":
+            offsets = rec["offsets"].reshape(-1, 2)
+            ax.scatter(offsets[:, 0], offsets[:, 1], s=rec["sizes"], c=rec["facecolors"] if len(rec["facecolors"]) else "none",
+                       edgecolors=rec["edgecolors"], linewidths=rec["linewidths"], plotnonfinite=True,
+                       **_style(ax, rec))
+        elif kind in ("segments", "polygons"):
+            cls, data = (LineCollection, rec["segments"]) if kind == "segments" else (PolyCollection, rec["verts"])
+            ax.add_collection(cls(data, facecolors=rec["facecolors"], edgecolors=rec["edgecolors"],
+                                  linewidths=rec["linewidths"], **_style(ax, rec)), autolim=False)
+        elif kind == "patch":
+            ax.add_patch(Polygon(rec["verts"], closed=True, facecolor=rec["facecolor"], edgecolor=rec["edgecolor"],
+                                 linewidth=rec["linewidth"], fill=rec["fill"], **_style(ax, rec)))
+        elif kind == "image":
+            ax.imshow(rec["array"], extent=rec["extent"], cmap=rec["cmap"], vmin=rec["clim"][0],
+                      vmax=rec["clim"][1], origin=rec["origin"], label=rec["label"], zorder=rec["zorder"])
+        elif kind == "text":
+            ax.text(*rec["xy"], rec["text"], transform=_transform(rec["coords"], ax), color=rec["color"],
+                    fontsize=rec["fontsize"], ha=rec["ha"], va=rec["va"], rotation=rec["rotation"],
+                    zorder=rec["zorder"])
+
+
+def _rebuild_axis(axis, rec):
+    axis.set_tick_params(**rec["params"])
+    axis.set_label_position(rec["label_position"])
+    axis.set_visible(rec["visible"])
+    if "ticks" in rec:
+        axis.set_ticks(rec["ticks"], rec["ticklabels"], rotation=rec["rotation"])
+
+
+def _handles(axes, legend):
+    """Legend handles and labels of the rebuilt artists with the recorded legend entries."""
+    artists = {}
+    for ax in axes:
+        for artist in [*ax.get_lines(), *ax.collections, *ax.patches, *ax.images]:
+            artists.setdefault(artist.get_label(), artist)
+    found = [label for label in legend["labels"] if label in artists]
+    return [artists[label] for label in found], found
+
+
+def rebuild(data):
+    """A matplotlib figure plotted from the ``record`` of a figure."""
+    fig = plt.figure(figsize=data["size"], dpi=data["dpi"])
+    axes = []
+    for rec in data["axes"]:
+        ax = fig.add_axes(rec["position"])
+        _rebuild_artists(ax, rec["artists"])
+        ax.set_xscale(rec["xscale"])
+        ax.set_yscale(rec["yscale"])
+        ax.set_xlim(rec["xlim"])
+        ax.set_ylim(rec["ylim"])
+        ax.set_aspect(rec["aspect"])
+        ax.set_title(rec["title"])
+        ax.set_xlabel(rec["xlabel"])
+        ax.set_ylabel(rec["ylabel"])
+        _rebuild_axis(ax.xaxis, rec["xaxis"])
+        _rebuild_axis(ax.yaxis, rec["yaxis"])
+        ax.patch.set_visible(rec["frame"])
+        ax.set_facecolor(rec["facecolor"])
+        ax.set_visible(rec["visible"])
+        if rec["legend"] is not None:
+            ax.legend(*_handles([ax], rec["legend"]), title=rec["legend"]["title"] or None)
+        axes.append(ax)
+    for rec in data["colorbars"]:
+        mappable = ScalarMappable(Normalize(*rec["clim"]), rec["cmap"])
+        cax = fig.add_axes(rec["cax"])
+        fig.colorbar(mappable, cax=cax, orientation=rec["orientation"], label=rec["label"])
+        cax.set_box_aspect(rec["box_aspect"])
+        cax.set_anchor(rec["anchor"])
+    for legend in data["legends"]:
+        fig.legend(*_handles(axes, legend), title=legend["title"] or None)
+    if data["suptitle"]:
+        fig.suptitle(data["suptitle"])
+    return fig
+
+
+def load_figures(path):
+    """Figures saved by a ``lazy`` run, in the order they were shown, plotted again."""
+    figures = []
+    with open(path, "rb") as f:
+        while True:
+            try:
+                figures.append(rebuild(pickle.load(f)))
+            except EOFError:
+                return figures
+
+
+def replay(path, index=None):
+    """Display the figures saved in a sidecar file (or only the one at ``index``)."""
+    figures = load_figures(path)
+    for fig in (figures if index is None else [figures[index]]):
+        display(fig)
+    return figures
@@ -0,0 +1,255 @@
+"""Caches of parsed spectra.
+
+Every ``Spectrum.from_local_file`` call of a task goes through ``load_spectrum``,
+so a file is parsed once per task even if it is needed by several processing
+steps. Entries of the in-process cache are keyed by the absolute path together
+with the file's mtime and size (an edited file is parsed again) and evicted
+least-recently-used once the cached arrays exceed the memory cap.
+
+Optionally a persistent on-disk cache sits below it: parsed spectra are stored
+as ramanchada2 ``.cha`` (HDF5) files named by the hash of the raw file content,
+so unchanged files are not parsed again by the next ``ploomber build``, even if
+they were copied or touched.
+"""
+import copy
+import hashlib
+import logging
+import os
+import os.path
+from collections import OrderedDict
+
+from ramanchada2.spectrum import Spectrum
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_MB = 512
+DEFAULT_DISK_MAX_MB = 2048
+# bump when the parsed representation changes, so that stale entries are not used
+DISK_CACHE_VERSION = "1"
+
+
+def _file_key(fname):
+    st = os.stat(fname)
+    return os.path.abspath(fname), st.st_mtime_ns, st.st_size
+
+
+def _spectrum_nbytes(spe):
+    return spe.x.nbytes + spe.y.nbytes
+
+
+class SpectrumCache:
+    """LRU cache of parsed spectra with a cap on the memory held by x/y arrays."""
+
+    def __init__(self, max_mb=DEFAULT_MAX_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, fname):
+        """Cached spectrum for ``fname`` or ``None``; the caller gets its own copy."""
+        key = _file_key(fname)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(entry[0])
+
+    def put(self, fname, spe):
+        key = _file_key(fname)
+        nbytes = _spectrum_nbytes(spe)
+        if nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self._nbytes -= self._entries.pop(key)[1]
+        self._entries[key] = (spe, nbytes)
+        self._nbytes += nbytes
+        self._evict()
+
+    def resize(self, max_mb):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._evict()
+
+    def _evict(self):
+        while self._nbytes > self.max_bytes and self._entries:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._nbytes -= evicted
+
+    def clear(self):
+        self._entries.clear()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+def file_hash(fname, chunk_size=1 << 20):
+    """Content hash of a file (hex digest)."""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(DISK_CACHE_VERSION.encode())
+    # the parser is picked by the extension
+    h.update(os.path.splitext(fname)[1].lower().encode())
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DiskSpectrumCache:
+    """Content-addressed persistent cache of parsed spectra.
+
+    Entries live in ``<path>/<hash[:2]>/<hash>.cha``. A hit refreshes the entry's
+    mtime; once the folder grows beyond ``max_mb`` the entries with the oldest
+    mtime are removed.
+    """
+
+    def __init__(self, path, max_mb=DEFAULT_DISK_MAX_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        # running estimate of the folder size; the folder is only scanned when it
+        # may exceed the limit
+        self._nbytes = None
+
+    def _entry(self, digest):
+        return os.path.join(self.path, digest[:2], f"{digest}.cha")
+
+    def get(self, digest):
+        entry = self._entry(digest)
+        if not os.path.isfile(entry):
+            return None
+        try:
+            spe = Spectrum.from_chada(entry, dataset="/raw")
+        except Exception as err:
+            logger.warning(f"Dropping unreadable cache entry {entry}: {err}")
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+            return None
+        os.utime(entry)
+        return spe
+
+    def put(self, digest, spe):
+        entry = self._entry(digest)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # write next to the target and rename, concurrent tasks may share the folder
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        try:
+            spe.write_cha(tmp, dataset="/raw")
+            os.replace(tmp, entry)
+        except Exception as err:
+            logger.warning(f"Could not write cache entry {entry}: {err}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        if self._nbytes is None:
+            self._nbytes = sum(size for _, size, _ in self.entries())
+        else:
+            self._nbytes += os.path.getsize(entry)
+        if self._nbytes > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """``(mtime, size, path)`` of all cache entries."""
+        result = []
+        if not os.path.isdir(self.path):
+            return result
+        for shard in os.scandir(self.path):
+            if not shard.is_dir():
+                continue
+            for item in os.scandir(shard.path):
+                if item.name.endswith(".cha"):
+                    st = item.stat()
+                    result.append((st.st_mtime, st.st_size, item.path))
+        return result
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._nbytes = total
+
+
+_cache = SpectrumCache()
+_disk_cache = None
+_settings = {}
+
+
+def get_cache():
+    return _cache
+
+
+def get_disk_cache():
+    return _disk_cache
+
+
+def get_settings():
+    """Keyword arguments of the last ``configure`` call, e.g. to set up worker processes."""
+    return dict(_settings)
+
+
+def configure(max_mb=DEFAULT_MAX_MB, disk_path=None, disk_max_mb=DEFAULT_DISK_MAX_MB):
+    """Set up the shared caches.
+
+    Args:
+        max_mb (float): memory cap of the in-process cache (``0`` disables it).
+        disk_path (str): folder of the persistent cache; ``None`` disables it.
+        disk_max_mb (float): size limit of the persistent cache.
+    """
+    global _disk_cache
+    _settings.update(max_mb=max_mb, disk_path=disk_path, disk_max_mb=disk_max_mb)
+    _cache.resize(max_mb)
+    _disk_cache = None if disk_path is None else DiskSpectrumCache(disk_path, disk_max_mb)
+
+
+def configure_from(_config, config_root):
+    """Configure the caches from the ``processing`` section of config_pipeline.json.
+
+    A relative ``disk_cache.path`` is resolved against ``config_root``.
+    """
+    processing = _config.get("processing", {})
+    disk = processing.get("disk_cache", {})
+    disk_path = disk.get("path")
+    if disk_path is not None:
+        disk_path = os.path.join(config_root, disk_path)
+    configure(max_mb=processing.get("memory_cache_mb", DEFAULT_MAX_MB),
+              disk_path=disk_path,
+              disk_max_mb=disk.get("max_mb", DEFAULT_DISK_MAX_MB))
+
+
+def _parse(fname):
+    if _disk_cache is None:
+        return Spectrum.from_local_file(fname)
+    digest = file_hash(fname)
+    spe = _disk_cache.get(digest)
+    if spe is None:
+        spe = Spectrum.from_local_file(fname)
+        _disk_cache.put(digest, spe)
+    return spe
+
+
+def load_spectrum(fname):
+    """Drop-in replacement for ``Spectrum.from_local_file`` backed by the shared caches."""
+    spe = _cache.get(fname)
+    if spe is not None:
+        return spe
+    spe = _parse(fname)
+    _cache.put(fname, spe)
+    return copy.deepcopy(spe)
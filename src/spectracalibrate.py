@@ -0,0 +1,309 @@
+"""X calibration of one (laser_wl, optical_path) group, as run by spectraframe_calibrate.
+
+``calibrate_group`` does the fitting work of a group: Neon calibration curve,
+peak matching of the calibrated Neon, Si laser zeroing, saving the model and
+the Si peak check. It takes the group's spectra (not the spectraframe) and
+returns a ``GroupResult`` holding the model, the matched peaks and the few
+spectra the task plots, so groups can run in worker processes while the task
+draws all figures in the parent, in group order.
+
+lmfit fit results do not pickle (and calibration components drop them when
+pickled), so results coming from a worker carry them as ``FitPeaksResult.dumps``
+and get them back in the parent. Worker processes use the parent's peak fits
+cache (``spectrafitcache``), if configured.
+"""
+import logging
+import os.path
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+import ramanchada2.misc.constants as rc2const
+from ramanchada2.misc.types.fit_peaks_result import FitPeaksResult
+from ramanchada2.misc.utils.ramanshift_to_wavelength import shift_cm_1_to_abs_nm
+from ramanchada2.protocols.calibration.calibration_model import CalibrationModel
+from ramanchada2.protocols.calibration.serialization import export_cwa_x
+from ramanchada2.protocols.calibration.xcalibration import fit_peaks, match_peaks
+from ramanchada2.spectrum import Spectrum
+
+import spectrafitcache
+from utils import find_peaks
+
+
+logger = logging.getLogger(__name__)
+
+SI_PEAK = 520.45
+
+
+@dataclass
+class GroupJob:
+    """Input of ``calibrate_group``: the spectra of one group and the task settings.
+
+    The model is saved to the ``calmodels`` folder, unless it is ``None``. The
+    "2.Ne_clbr" check maps the fitted Neon peaks through the curve, or fits the
+    calibrated Neon spectrum again with ``refit_ne_peaks``.
+    """
+    laser_wl: int
+    optical_path: str
+    spe_neon: object
+    spe_sil: object
+    ne_units: str
+    si_units: str
+    find_kw_ne: dict
+    find_kw_si: dict
+    fit_neon_peaks: bool
+    match_mode: str
+    interpolator: str
+    calmodels: str
+    key: str
+    refit_ne_peaks: bool = False
+
+
+@dataclass
+class GroupResult:
+    """Output of ``calibrate_group``; ``stage`` is the last stage that completed."""
+    laser_wl: int
+    optical_path: str
+    stage: str = "none"
+    calmodel: object = None
+    matched_peaks: list = field(default_factory=list)
+    spe_sil_ne_calib: object = None
+    ne_calib_range: tuple = None
+    spe_sil: object = None
+    spe_si_check: object = None
+    si_fitres: object = None
+    fit_res: list = None
+    errors: list = field(default_factory=list)
+
+
+def clip_nm_window(spe, win_lo_nm, win_hi_nm):
+    # normalize window
+    win_lo, win_hi = sorted([win_lo_nm, win_hi_nm])
+
+    x = spe.x
+    x_lo, x_hi = min(x), max(x)
+
+    # intersection
+    clip_lo = max(win_lo-10, x_lo)
+    clip_hi = min(win_hi+10, x_hi)
+
+    # detect no-overlap
+    if clip_lo >= clip_hi:
+        return spe
+    return spe.trim_axes(method='x-axis',  boundaries=(clip_lo, clip_hi))
+
+
+def _tag_peaks(df, optical_path, laser_wl, stage):
+    df["sample"] = "Ne"
+    df["optical_path"] = optical_path
+    df["laser_wl"] = laser_wl
+    df["before_after"] = stage
+    return df
+
+
+def calibrated_peaks(model_neon):
+    """Peaks the curve was derived from, mapped through it (model units).
+
+    Same positions as fitting the calibrated spectrum again, up to the small
+    shift of a peak under the (locally linear) curve.
+    """
+    pos = np.array(sorted(model_neon.spe_pos_dict), dtype=float)
+    amp = np.array([model_neon.spe_pos_dict[p] for p in pos], dtype=float)
+    # positions are in the units the peaks were fitted in (ref units, pixel axes are not converted)
+    pos_units = "pixel" if model_neon.spe_units == "pixel" else model_neon.ref_units
+    spe = model_neon.process(Spectrum(x=pos, y=amp), spe_units=pos_units, convert_back=False)
+    return dict(zip(spe.x, spe.y))
+
+
+def calibrate_group(job):
+    """Calibrate one group; exceptions end the group and are kept in ``result.errors``."""
+    result = GroupResult(job.laser_wl, job.optical_path)
+    laser_wl = job.laser_wl
+
+    # a copy: the pedestal removal below must not change the caller's (plotted, stored) spectrum
+    spe_sil = job.spe_sil.__copy__()
+    if job.si_units == "cm-1":
+        spe_sil = spe_sil.trim_axes(method='x-axis', boundaries=(SI_PEAK-100, SI_PEAK+100))
+    # remove pedestal
+    spe_sil.y = spe_sil.y - np.min(spe_sil.y)
+    spe_sil = spe_sil.subtract_baseline_rc1_snip(niter=40)
+    result.spe_sil = spe_sil
+
+    neon_wl = rc2const.NEON_WL[laser_wl]
+    logger.debug(neon_wl)
+    # these are reference Ne peaks
+
+    try:
+        find_kw = dict(job.find_kw_ne)
+        logger.debug(find_kw)
+        # options for fitting peaks
+        fit_peaks_kw = {}
+
+        calmodel1 = CalibrationModel(laser_wl)
+        calmodel1.nonmonotonic = "drop"
+        # create CalibrationModel class. it does not derive a curve at this moment!
+        calmodel1.prominence_coeff = 3
+        find_kw["prominence"] = job.spe_neon.y_noise_MAD() * calmodel1.prominence_coeff
+
+        model_neon1 = calmodel1.derive_model_curve(
+            spe=job.spe_neon,
+            ref=neon_wl,
+            spe_units=job.ne_units,
+            ref_units="nm",
+            find_kw=find_kw,
+            fit_peaks_kw=fit_peaks_kw,
+            should_fit=job.fit_neon_peaks,
+            name="Neon calibration",
+            match_method="argmin2d" if job.match_mode is None else job.match_mode,
+            interpolator_method="pchip" if job.interpolator is None else job.interpolator,
+            extrapolate=True
+        )
+        # now derive_model_curve finds peaks, fits peaks, matches peaks and derives the calibration curve
+        # and model_neon.process() could be applied to Si or other spectra
+        logger.info(model_neon1.model)
+        result.calmodel = calmodel1
+        result.matched_peaks.append(
+            _tag_peaks(model_neon1.matched_peaks, job.optical_path, laser_wl, "1.original"))
+        result.stage = "neon"
+    except Exception:
+        result.errors.append(traceback.format_exc())
+        return result
+
+    # The second step of the X calibration - Laser zeroing
+    try:
+        find_kw = dict(job.find_kw_si)
+        logger.debug(find_kw)
+        fit_peaks_kw = {}
+
+        spe_sil_ne_calib = model_neon1.process(
+            spe_sil, spe_units=job.si_units, convert_back=False
+        )
+        result.spe_sil_ne_calib = spe_sil_ne_calib
+
+        ne_calib = model_neon1.process(
+            job.spe_neon, spe_units=job.ne_units, convert_back=False
+        )
+        result.ne_calib_range = (min(ne_calib.x), max(ne_calib.x))
+        if job.refit_ne_peaks:
+            logger.info("Find & match calibrated Ne peaks")
+            ne_fit_res, ne_spe_pos_dict = fit_peaks(
+                ne_calib, find_kw, fit_peaks_kw, profile="Gaussian", should_fit=job.fit_neon_peaks)
+        else:
+            logger.info("Match calibrated Ne peaks")
+            ne_spe_pos_dict = calibrated_peaks(model_neon1)
+        logger.info(ne_spe_pos_dict)
+        _x, _ref, _, _, df_ne_calib = match_peaks(
+            ne_spe_pos_dict, neon_wl, spe_units="nm", match_method=job.match_mode)
+        result.matched_peaks.append(_tag_peaks(df_ne_calib, job.optical_path, laser_wl, "2.Ne_clbr"))
+
+        calmodel1.prominence_coeff = 3
+        # in case there are nans from the calibration curve extrapolation
+        spe_sil_ne_calib = spe_sil_ne_calib.dropna()
+        find_kw["prominence"] = (
+            spe_sil_ne_calib.y_noise_MAD() * calmodel1.prominence_coeff
+        )
+
+        lo_nm = shift_cm_1_to_abs_nm(SI_PEAK-100, laser_wl)
+        hi_nm = shift_cm_1_to_abs_nm(SI_PEAK+100, laser_wl)
+        si_peak_nm_left, si_peak_nm_right = sorted([lo_nm, hi_nm])
+        spe_sil_ne_calib = clip_nm_window(spe_sil_ne_calib, si_peak_nm_left, si_peak_nm_right)
+
+        model_si = calmodel1.derive_model_zero(
+            spe=spe_sil_ne_calib,
+            ref={SI_PEAK: 1},
+            spe_units=model_neon1.model_units,
+            ref_units="cm-1",
+            find_kw=find_kw,
+            fit_peaks_kw=fit_peaks_kw,
+            should_fit=True,
+            name="Si calibration",
+            profile="Pearson4"
+        )
+        logger.info(model_si)
+        logger.debug(len(spe_sil_ne_calib.x))
+        result.stage = "si"
+    except Exception:
+        result.errors.append(traceback.format_exc())
+        return result
+
+    if job.calmodels is not None:
+        save_model(calmodel1, job, result)
+
+    # let's check the Si peak with Pearson4 profile
+    try:
+        spe_sil_calibrated = calmodel1.apply_calibration_x(spe_sil, spe_units=job.si_units)
+        _w = 50
+        spe_test = spe_sil_calibrated.dropna().trim_axes(method='x-axis', boundaries=(SI_PEAK-_w, SI_PEAK+_w))
+        fitres, cand = find_peaks(spe_test, profile="Pearson4", find_kw=dict(job.find_kw_si),
+                                  vary_baseline=False)
+        result.spe_si_check = spe_test
+        result.si_fitres = fitres
+    except Exception:
+        result.errors.append(traceback.format_exc())
+    return result
+
+
+def save_model(calmodel1, job, result):
+    """Write the model as pickle, JSON and CWA 18133 files to ``job.calmodels``."""
+    calmodel1.save(os.path.join(job.calmodels, f"calmodel_{job.laser_wl}_{job.optical_path}.pkl"))
+    # portable formats (CWA 18133 §8): full model as JSON + calibration curve as CSV
+    try:
+        _base = os.path.join(job.calmodels, f"calmodel_{job.laser_wl}_{job.optical_path}")
+        calmodel1.save(_base + ".json")
+        if job.ne_units == "cm-1":
+            _range = (float(np.min(job.spe_neon.x)), float(np.max(job.spe_neon.x)))
+        else:  # nm/pixel neon axis: use the CWA-typical Raman shift range
+            _range = (100.0, 3500.0)
+        export_cwa_x(calmodel1, _base + "_cwa", spectral_range=_range,
+                     metadata={"key": job.key, "optical_path": job.optical_path,
+                               "laser_wl": int(job.laser_wl),
+                               "match_method": job.match_mode,
+                               "interpolator": job.interpolator})
+    except Exception:
+        result.errors.append(traceback.format_exc())
+
+
+def _calibrate_group_packed(job):
+    """``calibrate_group`` in a worker: fit results are returned as ``dumps``."""
+    result = calibrate_group(job)
+    if result.calmodel is not None:
+        result.fit_res = [None if c.fit_res is None else c.fit_res.dumps()
+                          for c in result.calmodel.components]
+    if result.si_fitres is not None:
+        result.si_fitres = result.si_fitres.dumps()
+    return result
+
+
+def _unpack(result):
+    if result.fit_res is not None:
+        for component, dumped in zip(result.calmodel.components, result.fit_res):
+            component.fit_res = None if dumped is None else FitPeaksResult.loads(dumped)
+        result.fit_res = None
+    if result.si_fitres is not None:
+        result.si_fitres = FitPeaksResult.loads(result.si_fitres)
+    return result
+
+
+def calibrate_groups(jobs, workers=1):
+    """``calibrate_group`` of every job, in order; with ``workers > 1`` in a process pool.
+
+    Results are yielded as soon as the next group in order is done.
+    """
+    jobs = list(jobs)
+    if workers is None or workers <= 1 or len(jobs) < 2:
+        for job in jobs:
+            yield calibrate_group(job)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), initializer=spectrafitcache.configure,
+                             initargs=(spectrafitcache.get_settings()["path"],)) as pool:
+        # one group per task: groups take minutes, the pool stays busy
+        for result in pool.map(_calibrate_group_packed, jobs):
+            yield _unpack(result)
+
+
+def concat_matched_peaks(results):
+    """Matched peaks of all results, in group order (``None`` if there are none)."""
+    frames = [df for result in results for df in result.matched_peaks]
+    return pd.concat(frames) if frames else None
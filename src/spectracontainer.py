@@ -0,0 +1,162 @@
+"""Single HDF5 file holding many spectra, indexed by path.
+
+Converting a WITec map export to one ``.cha`` per spectrum leaves thousands of
+tiny HDF5 files; a container keeps them in one file instead:
+
+- ``/x``, ``/y``: the x/y values of all spectra appended to two chunked datasets;
+- ``/index/{key,start,length,metadata,mtime_ns,hash}``: one row per spectrum,
+  ``key`` being the path of the source file relative to the container's folder.
+
+Converting a spectrum again appends the new values and points its index row to
+them (the old values are left unused in the file).
+
+A spectrum in a container is referenced as ``<container.h5>::<key>``, e.g. in
+the ``file_name`` column of a template; ``utils.load_spectrum_df`` reads such
+rows from the container.
+"""
+import json
+import logging
+import os.path
+
+import h5py
+import numpy as np
+from ramanchada2.spectrum import Spectrum
+
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = "::"
+CHUNK = 1 << 14
+INDEX_FIELDS = {"key": h5py.string_dtype(), "start": np.int64, "length": np.int64,
+                "metadata": h5py.string_dtype(), "mtime_ns": np.int64, "hash": h5py.string_dtype()}
+
+
+def member_path(container, key):
+    return f"{container}{SEPARATOR}{key}"
+
+
+def split_member(fname):
+    """``(container, key)`` of a ``<container.h5>::<key>`` reference, else ``None``."""
+    if not isinstance(fname, str) or SEPARATOR not in fname:
+        return None
+    container, key = fname.split(SEPARATOR, 1)
+    return container, key.replace(os.sep, "/")
+
+
+class SpectraContainer:
+    """Reader and writer of a spectra container (``mode`` as in ``h5py.File``)."""
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self._h5 = h5py.File(path, mode)
+        if self._h5.mode != "r" and "x" not in self._h5:
+            for name in ("x", "y"):
+                self._h5.create_dataset(name, shape=(0,), maxshape=(None,), dtype=np.float64, chunks=(CHUNK,))
+            grp = self._h5.create_group("index")
+            for name, dtype in INDEX_FIELDS.items():
+                grp.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype, chunks=(1024,))
+        keys = self._h5["index/key"].asstr()[...]
+        self._rows = {key: row for row, key in enumerate(keys)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._h5 is not None:
+            self._h5.close()
+            self._h5 = None
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def keys(self):
+        return list(self._rows)
+
+    def stamp(self, key):
+        """``{"mtime_ns", "hash"}`` recorded with ``key``'s spectrum, ``None`` if absent."""
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        grp = self._h5["index"]
+        return {"mtime_ns": int(grp["mtime_ns"][row]), "hash": grp["hash"].asstr()[row]}
+
+    def read(self, key):
+        """Spectrum stored under ``key`` (``KeyError`` if absent)."""
+        row = self._rows[key]
+        grp = self._h5["index"]
+        start, length = int(grp["start"][row]), int(grp["length"][row])
+        meta = json.loads(grp["metadata"].asstr()[row] or "{}")
+        return Spectrum(x=self._h5["x"][start:start + length], y=self._h5["y"][start:start + length],
+                        metadata=meta if meta else None)
+
+    def write(self, key, x, y, metadata=None, mtime_ns=0, hash=""):
+        """Append a spectrum under ``key``, replacing a previous one."""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        start = self._h5["x"].shape[0]
+        for name, values in (("x", x), ("y", y)):
+            self._h5[name].resize((start + len(values),))
+            self._h5[name][start:] = values
+        values = {"key": key, "start": start, "length": len(x),
+                  "metadata": json.dumps(metadata or {}, default=str), "mtime_ns": mtime_ns, "hash": hash}
+        grp = self._h5["index"]
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self._rows)
+            for name in INDEX_FIELDS:
+                grp[name].resize((row + 1,))
+            self._rows[key] = row
+        for name, value in values.items():
+            grp[name][row] = value
+
+
+_readers = {}
+
+
+def _reader(container):
+    """Open (read-only) container, reopened if the file changed since."""
+    path = os.path.abspath(container)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _readers.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+    reader = SpectraContainer(path)
+    _readers[path] = (stamp, reader)
+    return reader
+
+
+def spectrum_exists(fname):
+    """``os.path.isfile`` that also accepts ``<container.h5>::<key>`` references."""
+    member = split_member(fname)
+    if member is None:
+        return isinstance(fname, str) and os.path.isfile(fname)
+    container, key = member
+    return os.path.isfile(container) and key in _reader(container)
+
+
+def read_member(fname):
+    """Spectrum of a ``<container.h5>::<key>`` reference; ``None`` if the container or key is missing."""
+    container, key = split_member(fname)
+    if not os.path.isfile(container):
+        return None
+    reader = _reader(container)
+    if key not in reader:
+        return None
+    return reader.read(key)
+
+
+def member_stamp(fname):
+    """``stamp`` of a ``<container.h5>::<key>`` reference; ``None`` if the container or key is missing."""
+    container, key = split_member(fname)
+    if not os.path.isfile(container):
+        return None
+    return _reader(container).stamp(key)
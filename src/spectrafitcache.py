@@ -0,0 +1,134 @@
+"""Persistent cache of peak fits, shared by the processing variants.
+
+The calibration tasks run once per ``fit_ne_peaks``/``match_mode``/``interpolator``
+variant, and every variant fits the same Neon and Si peaks again although only
+the matching or the interpolation differ. Once ``configure`` is called with a
+folder, every ``Spectrum.fit_peak_multimodel`` call of the process goes through
+this cache: ramanchada2's ``CalibrationModel.derive_model_curve`` (via
+``xcalibration.fit_peaks``) and ``derive_model_zero``, as well as
+``utils.find_peaks``.
+
+Entries are keyed by the hash of the spectrum's x/y values, the peak candidates
+(which follow from the find_kw), the profile and the fit options, and stored as
+``<path>/<hash[:2]>/<hash>.json`` holding ``FitPeaksResult.dumps()``. Calls with
+``no_fit=True`` are cheap and not cached.
+"""
+import hashlib
+import json
+import logging
+import os
+import os.path
+
+import numpy as np
+from ramanchada2.misc.types.fit_peaks_result import FitPeaksResult
+from ramanchada2.spectrum import Spectrum
+
+
+logger = logging.getLogger(__name__)
+
+# bump when the stored representation changes
+FIT_CACHE_VERSION = "1"
+
+_fit_peak_multimodel = Spectrum.fit_peak_multimodel
+_cache = None
+_settings = {"path": None}
+
+
+def _library_version():
+    try:
+        from importlib.metadata import version
+        return version("ramanchada2")
+    except Exception:
+        return ""
+
+
+class FitCache:
+    """Folder of fit results named by the hash of their inputs."""
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._version = f"{FIT_CACHE_VERSION}|{_library_version()}"
+
+    def key(self, spe, profile, candidates, options):
+        """Hash of a fit's inputs; ``None`` if they cannot be hashed."""
+        dump = getattr(candidates, "model_dump_json", None)
+        if dump is None:
+            return None
+        h = hashlib.blake2b(digest_size=20)
+        h.update(self._version.encode())
+        h.update(np.ascontiguousarray(spe.x, dtype=np.float64).tobytes())
+        h.update(np.ascontiguousarray(spe.y, dtype=np.float64).tobytes())
+        h.update(json.dumps(profile).encode())
+        h.update(dump().encode())
+        h.update(json.dumps(options, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def _entry(self, digest):
+        return os.path.join(self.path, digest[:2], f"{digest}.json")
+
+    def get(self, digest):
+        entry = self._entry(digest)
+        if not os.path.isfile(entry):
+            self.misses += 1
+            return None
+        try:
+            with open(entry, "r", encoding="utf-8") as f:
+                fit_res = FitPeaksResult.loads(json.load(f))
+        except Exception as err:
+            logger.warning(f"Dropping unreadable fit cache entry {entry}: {err}")
+            os.remove(entry)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return fit_res
+
+    def put(self, digest, fit_res):
+        entry = self._entry(digest)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # write next to the target and rename, variants may run concurrently
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(fit_res.dumps(), f)
+            os.replace(tmp, entry)
+        except Exception as err:
+            logger.warning(f"Could not write fit cache entry {entry}: {err}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+def _cached_fit_peak_multimodel(spe, /, *args, profile=None, candidates=None, **kwargs):
+    """``Spectrum.fit_peak_multimodel`` backed by the fit cache."""
+    if _cache is None or args or kwargs.get("no_fit", False):
+        return _fit_peak_multimodel(spe, *args, profile=profile, candidates=candidates, **kwargs)
+    options = {k: v for k, v in kwargs.items() if k != "should_break"}
+    digest = _cache.key(spe, profile, candidates, options)
+    fit_res = None if digest is None else _cache.get(digest)
+    if fit_res is None:
+        fit_res = _fit_peak_multimodel(spe, profile=profile, candidates=candidates, **kwargs)
+        if digest is not None:
+            _cache.put(digest, fit_res)
+    return fit_res
+
+
+def get_cache():
+    return _cache
+
+
+def get_settings():
+    """Keyword arguments of the last ``configure`` call, e.g. to set up worker processes."""
+    return dict(_settings)
+
+
+def configure(path=None):
+    """Cache the peak fits of this process in ``path``; ``None`` disables the cache."""
+    global _cache
+    _settings.update(path=path)
+    if path is None:
+        _cache = None
+        Spectrum.fit_peak_multimodel = _fit_peak_multimodel
+    else:
+        _cache = FitCache(path)
+        Spectrum.fit_peak_multimodel = _cached_fit_peak_multimodel
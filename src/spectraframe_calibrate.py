@@ -1,14 +1,13 @@
 from pathlib import Path
 import pandas as pd
-from ramanchada2.protocols.calibration.calibration_model import CalibrationModel
-from ramanchada2.protocols.calibration.serialization import export_cwa_x
-from ramanchada2.protocols.calibration.xcalibration import match_peaks, fit_peaks
-import ramanchada2.misc.constants as rc2const
-from ramanchada2.misc.utils.ramanshift_to_wavelength import shift_cm_1_to_abs_nm
-import matplotlib.pyplot as plt
+import render
+import sys
 import traceback
-from utils import (find_peaks, plot_si_peak, get_config_units, 
+from utils import (plot_si_peak, get_config_units, get_config_workers, get_config_fit_cache,
                    load_config, get_config_findkw, init_logging)
+import spectrafitcache
+from spectracalibrate import GroupJob, calibrate_groups, concat_matched_peaks
+from spectrastore import read_spectraframe
 from matched_peaks_analysis import (
     analyze_peak_matching_quality,
     compare_before_after_calibration,
@@ -34,6 +33,9 @@ fit_neon_peaks = None
 match_mode = None
 interpolator = None
 test_offset = 0
+# fit the Ne calibrated spectrum again for the "2.Ne_clbr" check, instead of
+# mapping the fitted Ne peaks through the calibration curve
+refit_ne_peaks = False
 # -
 
 
@@ -83,292 +85,145 @@ def test_shift(spe):
         return spe_shifted
 
 
-def clip_nm_window(spe, win_lo_nm, win_hi_nm):
-    # normalize window
-    win_lo, win_hi = sorted([win_lo_nm, win_hi_nm])
+def select_spectra(op_data):
+    """Neon (the HDR merge if there is one) and Si spectra of a group."""
+    # Check if a row with "sample" == "Neon" and "overexposed" == "HDR_MERGE" exists
+    matching_row = op_data.loc[(op_data["sample"] == neon_tag) & (op_data["overexposed"] == "HDR_MERGE")]
+    if not matching_row.empty:
+        logger.info("Using HDR merge")
+        spe_neon = matching_row["spectrum"].iloc[0]
+    else:
+        spe_neon = op_data.loc[op_data["sample"] == neon_tag]["spectrum"].iloc[0]
+    spe_sil = op_data.loc[op_data["sample"] == si_tag]["spectrum"].iloc[0]
+    return test_shift(spe_neon), test_shift(spe_sil)
+
+
+def plot_group(result, op_data, spe_neon, spe_sil, _ne_units, _si_units):
+    """Figures of a calibrated group (see spectracalibrate.GroupResult)."""
+    laser_wl, optical_path = result.laser_wl, result.optical_path
+    fig, (ax1, ax2, ax3) = render.subplots(1, 3, figsize=(15, 3))
+    ax1.set_title(f"{key} {laser_wl}nm {optical_path}")
+    spe_sil.plot(ax=ax2, label=si_tag)
+    ax2.set_xlabel(_si_units)
+    spe_neon.plot(ax=ax1, label=neon_tag)
+    ax1.set_xlabel(_ne_units)
+    if result.calmodel is not None:
+        model_neon1 = result.calmodel.components[0]
+        model_neon1.model.plot(ax=ax3)
+        ax1.grid()
+        ax2.grid()
+    for err in result.errors:
+        print(err, file=sys.stderr)
+    render.show(fig)
+    if result.stage == "neon":
+        for df_peaks in result.matched_peaks[1:]:
+            display(df_peaks)
+    if result.stage != "si":
+        return
+
+    # The second step of the X calibration - Laser zeroing
+    fig, (ax, ax1) = render.subplots(1, 2, figsize=(15, 3))
+    spe_sil_ne_calib = result.spe_sil_ne_calib
+    spe_sil_ne_calib.plot(ax=ax, label="Si [Ne calibrated only] len={}".
+                        format(len(spe_sil_ne_calib.x)), fmt='+-')
+    ax.set_xlabel("Wavelength/nm")
+    ax.grid()
+    display(result.matched_peaks[-1])
+    plot_calibration(model_neon1, *result.ne_calib_range, ax=ax1)
+    model_si = result.calmodel.components[-1]
+    ax.axvline(x=model_si.model, color='black', linestyle='--', linewidth=2, label="Peak found {:.3f} nm".format(model_si.model))
+    model_si.fit_res.plot(ax=ax, label="fitres",  linestyle='--')
+    display(model_si.peaks)
+    render.show(fig)
+
+    calmodel1 = result.calmodel
+    if render.enabled():
+        calmodel1.plot()
+    if render.enabled() and result.si_fitres is not None and len(result.si_fitres) > 0:
+        fig, ax = render.subplots(1, 1, figsize=(15, 3))
+        plot_si_peak(result.spe_sil, result.spe_si_check, result.si_fitres, ax=ax)
+        render.show(fig)
+
+    tags = [neon_tag, si_tag, pst_tag, apap_tag, calcite_tag]
+
+
+    # Calculate subplot grid dimensions
+    n_plots = len(tags)
+    n_cols = min(3, n_plots)  # Maximum 3 columns
+    n_rows = int(np.ceil(n_plots / n_cols))
+
+    fig, axes = render.subplots(n_rows, n_cols, figsize=(6*n_cols, 4*n_rows))
+
+    # Flatten axes array for easy iteration
+    axes = np.array(axes).flatten()
+
+    for idx, (ax, tag) in enumerate(zip(axes[:n_plots], tags)):
+        try:
+            spe_match = op_data.loc[op_data["sample"] == tag, "spectrum"]
+            if spe_match.empty:
+                continue
+            spe = spe_match.iloc[0]
+            spe = test_shift(spe)
+            spe.y = spe.y - np.min(spe.y)
+            spe_units=get_config_units(_config, key, 
+                                                tag="si" if tag in ["S0B","S0N"] else "ne" if tag in ["Neon"] else tag.lower())
+            spe_cal = calmodel1.apply_calibration_x(
+                spe, spe_units=spe_units)
+            if spe_units == "pixel":
+                spe.plot(label=f"{tag} [{spe_units}]", ax=ax.twinx())
+            else:
+                spe.plot(label=tag, ax=ax)
+            spe_cal.plot(label=f"calibrated {tag}", ax=ax, linestyle='--', color="orange")
+            ax.grid()
+            ax.legend()
+            ax.set_title(tag)
+        except Exception as err:
+            traceback.print_exc()
+            logger.error(f"Error processing {tag}: {err}")
 
-    x = spe.x
-    x_lo, x_hi = min(x), max(x)
+    # Hide any unused subplots
+    for idx in range(n_plots, len(axes)):
+        axes[idx].set_visible(False)
 
-    # intersection
-    clip_lo = max(win_lo-10, x_lo)
-    clip_hi = min(win_hi+10, x_hi)
+    fig.tight_layout()
+    render.show(fig)
 
-    # detect no-overlap
-    if clip_lo >= clip_hi:
-        return spe 
-    return spe.trim_axes(method='x-axis',  boundaries=(clip_lo, clip_hi))
 
 def main(df, _config, _ne_units, _si_units, test_offset=0):
     # now try calibration 
     df_bkg_substracted = df.loc[df["background"] == "BACKGROUND_SUBTRACTED"]
-    #print(df_bkg_substracted.shape)
     grouped_df = df_bkg_substracted.groupby(["laser_wl", "optical_path"], dropna=False)
-    matched_peaks = None
+
+    # groups are fitted in worker processes, only their spectra are sent
+    groups = []
+    jobs = []
     for group_keys, op_data in grouped_df:
-        _success = False
-        fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(15, 3)) 
         laser_wl = int(group_keys[0])
         optical_path = group_keys[1]
-
-        ax1.set_title(f"{key} {laser_wl}nm {optical_path}")
-        
-        # Check if a row with "sample" == "Neon" and "overexposed" == "HDR_MERGE" exists
-        matching_row = op_data.loc[(op_data["sample"] == neon_tag) & (op_data["overexposed"] == "HDR_MERGE")]
-        if not matching_row.empty:
-            logger.info("Using HDR merge")
-            spe_neon = matching_row["spectrum"].iloc[0]
-        else:
-            spe_neon = op_data.loc[op_data["sample"] == neon_tag]["spectrum"].iloc[0]
-
-        spe_neon = test_shift(spe_neon)
-
         try:
-            spe_sil = op_data.loc[op_data["sample"] == si_tag]["spectrum"].iloc[0]
+            spe_neon, spe_sil = select_spectra(op_data)
         except Exception as err:
             logger.warning(err)
             continue
-        spe_sil = test_shift(spe_sil)
-
-        spe_sil.plot(ax=ax2, label=si_tag)
-        ax2.set_xlabel(_si_units)
-
-        if _si_units == "cm-1":
-            spe_sil = spe_sil.trim_axes(method='x-axis', boundaries=(520.45-100, 520.45+100))
-           
-
-        # remove pedestal
-        spe_sil.y = spe_sil.y - np.min(spe_sil.y)
-        spe_sil = spe_sil.subtract_baseline_rc1_snip(niter=40)
-        #spe_sil.plot(label="Si")
-             
-        spe_neon.plot(ax=ax1, label=neon_tag)
-        ax1.set_xlabel(_ne_units)
-        #spe_sil.plot(ax=ax2, label=si_tag)
-
-        # False should be used for testing only . Fitting may take a while .
-
-        neon_wl = rc2const.NEON_WL[laser_wl]
-        logger.debug(neon_wl)
-        # these are reference Ne peaks
-
-        try:
-            #find_kw = {"wlen": 200, "width": 1}
-            find_kw = get_config_findkw(_config, key, "ne")
-            logger.debug(find_kw)
-            # options for finding peaks    
-            fit_peaks_kw = {}
-            # options for fitting peaks
-
-            calmodel1 = CalibrationModel(laser_wl)
-            calmodel1.nonmonotonic = "drop"
-            # create CalibrationModel class. it does not derive a curve at this moment!
-            calmodel1.prominence_coeff = 3
-            find_kw["prominence"] = spe_neon.y_noise_MAD() * calmodel1.prominence_coeff
-
-            model_neon1 = calmodel1.derive_model_curve(
-                spe=spe_neon,
-                ref=neon_wl,
-                spe_units=_ne_units,
-                ref_units="nm",
-                find_kw=find_kw,
-                fit_peaks_kw=fit_peaks_kw,
-                should_fit=fit_neon_peaks,
-                name="Neon calibration",
-                match_method="argmin2d" if match_mode is None else match_mode,
-                interpolator_method="pchip" if interpolator is None else interpolator,
-                extrapolate=True
-            )
-            # now derive_model_curve finds peaks, fits peaks, matches peaks and derives the calibration curve
-            # and model_neon.process() could be applied to Si or other spectra
-            logger.info(model_neon1.model)
-            model_neon1.model.plot(ax=ax3)
-            
-            model_neon1.matched_peaks["sample"] = "Ne"
-            model_neon1.matched_peaks["optical_path"] = optical_path
-            model_neon1.matched_peaks["laser_wl"] = laser_wl
-            model_neon1.matched_peaks["before_after"] = "1.original"
-            if matched_peaks is None:
-                matched_peaks = model_neon1.matched_peaks
-            else:
-                matched_peaks = pd.concat([matched_peaks, model_neon1.matched_peaks])
-            plt.show()
-            _success = True 
-        except Exception:
-            _success = False
-            traceback.print_exc()
-
-        if not _success:
-            continue
-        ax1.grid()
-        ax2.grid()
-
-        # The second step of the X calibration - Laser zeroing
-
-        try:
-            fig, (ax, ax1) = plt.subplots(1, 2, figsize=(15, 3))
-            find_kw = get_config_findkw(_config, key, "si")
-            logger.debug(find_kw)
-            # options for finding peaks    
-            fit_peaks_kw = {}
-            # options for fitting peaks       
-
-            spe_sil_resampled = spe_sil
-
-            spe_sil_ne_calib = model_neon1.process(
-                spe_sil_resampled, spe_units=_si_units, convert_back=False
-            )
-            spe_sil_ne_calib.plot(ax=ax, label="Si [Ne calibrated only] len={}".
-                                format(len(spe_sil_ne_calib.x)), fmt='+-')
-            ax.set_xlabel("Wavelength/nm")
-            ax.grid()
-            #ay = ax.twiny()
-            #ay.set_xlabel(_si_units)
-            #spe_sil_resampled.plot(ax = ay, label="original", color="red")
-
-            ne_calib = model_neon1.process(
-                spe_neon, spe_units=_ne_units, convert_back=False
-            )        
-            logger.info("Find & match calibrated Ne peaks")
-            ne_fit_res, ne_spe_pos_dict = fit_peaks(
-                ne_calib, find_kw, fit_peaks_kw, profile="Gaussian", should_fit=fit_neon_peaks)
-            logger.info(ne_spe_pos_dict)
-            _x, _ref, _, _, df_ne_calib = match_peaks(
-                ne_spe_pos_dict, neon_wl, spe_units ="nm", match_method=match_mode) 
-
-            df_ne_calib["sample"] = "Ne"
-            df_ne_calib["optical_path"] = optical_path
-            df_ne_calib["laser_wl"] = laser_wl
-            df_ne_calib["before_after"] = "2.Ne_clbr"
-            display(df_ne_calib)
-            if matched_peaks is None:
-                matched_peaks = df_ne_calib
-            else:
-                matched_peaks = pd.concat([matched_peaks, df_ne_calib])            
-            #elf.spe_pos_dict = spe_pos_dict
-            #self.fit_res = fit_res
-            #return self.fit_res.to_dataframe_peaks()
-
-
-            # ne_calib.plot(ax=ax1, label="Ne calib")
-            # spe_sil_ne_calib.plot(ax=ax1, label="Si")
-            plot_calibration(model_neon1, min(ne_calib.x), max(ne_calib.x), ax=ax1)
-
-
-            calmodel1.prominence_coeff = 3
-            # in case there are nans from the calibration curve extrapolation
-            spe_sil_ne_calib = spe_sil_ne_calib.dropna()
-            find_kw["prominence"] = (
-                spe_sil_ne_calib.y_noise_MAD() * calmodel1.prominence_coeff
-            )
-
-            lo_nm = shift_cm_1_to_abs_nm(520.45-100, laser_wl)
-            hi_nm = shift_cm_1_to_abs_nm(520.45+100, laser_wl)
-            si_peak_nm_left, si_peak_nm_right = sorted([lo_nm, hi_nm])
-            spe_sil_ne_calib = clip_nm_window(spe_sil_ne_calib, si_peak_nm_left, si_peak_nm_right )
-
-            model_si = calmodel1.derive_model_zero(
-                spe=spe_sil_ne_calib,
-                ref={520.45: 1},
-                spe_units=model_neon1.model_units,
-                ref_units="cm-1",
-                find_kw=find_kw,
-                fit_peaks_kw=fit_peaks_kw,
-                should_fit=True,
-                name="Si calibration",
-                profile="Pearson4"
-                # profile="Gaussian"
-            )
-            ax.axvline(x=model_si.model, color='black', linestyle='--', linewidth=2, label="Peak found {:.3f} nm".format(model_si.model))
-            logger.info(model_si)
-            model_si.fit_res.plot(ax=ax, label="fitres",  linestyle='--')
-            # print("fit_res", model_si.fit_res)
-            logger.debug(len(spe_sil_ne_calib.x))
-            display(model_si.peaks)
-        except Exception:
-            _success = False
-            traceback.print_exc()
-
-        if not _success:
-            continue
-        else:
-            calmodel1.save(os.path.join(product["calmodels"],
-                                    f"calmodel_{laser_wl}_{optical_path}.pkl"))
-            # portable formats (CWA 18133 §8): full model as JSON + calibration curve as CSV
-            try:
-                _base = os.path.join(product["calmodels"],
-                                     f"calmodel_{laser_wl}_{optical_path}")
-                calmodel1.save(_base + ".json")
-                if _ne_units == "cm-1":
-                    _range = (float(np.min(spe_neon.x)), float(np.max(spe_neon.x)))
-                else:  # nm/pixel neon axis: use the CWA-typical Raman shift range
-                    _range = (100.0, 3500.0)
-                export_cwa_x(calmodel1, _base + "_cwa", spectral_range=_range,
-                             metadata={"key": key, "optical_path": optical_path,
-                                       "laser_wl": int(laser_wl),
-                                       "match_method": match_mode,
-                                       "interpolator": interpolator})
-            except Exception:
-                traceback.print_exc()
-
-            calmodel1.plot()
-        # let's check the Si peak with Pearson4 profile
-        si_peak = 520.45
-        spe_sil_calibrated = calmodel1.apply_calibration_x(spe_sil, spe_units=_si_units)
-        #has_nan = np.any(np.isnan(spe_sil_calibrated.x))
-        _w = 50
-        spe_test = spe_sil_calibrated.dropna().trim_axes(method='x-axis', boundaries=(si_peak-_w, si_peak+_w))
-        # print(spe_test.x, spe_test.y)
-        fitres, cand = find_peaks(spe_test,
-                                profile="Pearson4",
-                                find_kw=get_config_findkw(_config, key, "si"),
-                                vary_baseline=False)
-        if len(fitres) > 0:
-            plot_si_peak(spe_sil, spe_test, fitres)
-
-        tags = [neon_tag, si_tag, pst_tag, apap_tag, calcite_tag]
-
-
-        # Calculate subplot grid dimensions
-        n_plots = len(tags)
-        n_cols = min(3, n_plots)  # Maximum 3 columns
-        n_rows = int(np.ceil(n_plots / n_cols))
-
-        fig, axes = plt.subplots(n_rows, n_cols, figsize=(6*n_cols, 4*n_rows))
-
-        # Flatten axes array for easy iteration
-        axes = np.array(axes).flatten()
-
-        for idx, (ax, tag) in enumerate(zip(axes[:n_plots], tags)):
-            try:
-                spe_match = op_data.loc[op_data["sample"] == tag, "spectrum"]
-                if spe_match.empty:
-                    continue
-                spe = spe_match.iloc[0]
-                spe = test_shift(spe)
-                spe.y = spe.y - np.min(spe.y)
-                spe_units=get_config_units(_config, key, 
-                                                    tag="si" if tag in ["S0B","S0N"] else "ne" if tag in ["Neon"] else tag.lower())
-                spe_cal = calmodel1.apply_calibration_x(
-                    spe, spe_units=spe_units)
-                if spe_units == "pixel":
-                    spe.plot(label=f"{tag} [{spe_units}]", ax=ax.twinx())
-                else:
-                    spe.plot(label=tag, ax=ax)
-                spe_cal.plot(label=f"calibrated {tag}", ax=ax, linestyle='--', color="orange")
-                ax.grid()
-                ax.legend()
-                ax.set_title(tag)
-            except Exception as err:
-                traceback.print_exc()
-                logger.error(f"Error processing {tag}: {err}")
-
-        # Hide any unused subplots
-        for idx in range(n_plots, len(axes)):
-            axes[idx].set_visible(False)
-
-        plt.tight_layout()
-        plt.show()
+        groups.append((op_data, spe_neon, spe_sil))
+        jobs.append(GroupJob(
+            laser_wl=laser_wl, optical_path=optical_path,
+            spe_neon=spe_neon, spe_sil=spe_sil,
+            ne_units=_ne_units, si_units=_si_units,
+            # copies: the fitting adds the prominence to find_kw
+            find_kw_ne=dict(get_config_findkw(_config, key, "ne")),
+            find_kw_si=dict(get_config_findkw(_config, key, "si")),
+            fit_neon_peaks=fit_neon_peaks, match_mode=match_mode, interpolator=interpolator,
+            calmodels=product["calmodels"], key=key, refit_ne_peaks=refit_ne_peaks))
+
+    results = []
+    # figures are drawn here, in group order, as the groups complete
+    for (op_data, spe_neon, spe_sil), result in zip(
+            groups, calibrate_groups(jobs, workers=get_config_workers(_config, key))):
+        results.append(result)
+        plot_group(result, op_data, spe_neon, spe_sil, _ne_units, _si_units)
+
+    matched_peaks = concat_matched_peaks(results)
     matched_peaks["key"] = key
     matched_peaks["match_mode"] = match_mode
 
@@ -378,8 +233,12 @@ def main(df, _config, _ne_units, _si_units, test_offset=0):
 Path(product["calmodels"]).mkdir(parents=True, exist_ok=True)
 
 try:
-    df = pd.read_hdf(upstream["spectraframe_*"][f"spectraframe_{key}"]["h5"], key="templates_read")
+    df = read_spectraframe(upstream["spectraframe_*"][f"spectraframe_{key}"]["h5"], key="templates_read",
+                           background="BACKGROUND_SUBTRACTED")
     _config = load_config(os.path.join(config_root, config_templates))
+    render.configure_from(_config, product["nb"])
+    # peak fits do not depend on match_mode/interpolator, the variants share them
+    spectrafitcache.configure(get_config_fit_cache(_config, config_root))
     _ne_units = get_config_units(_config, key, tag="neon")
     _si_units = get_config_units(_config, key, tag="si")
     main(df, _config, _ne_units, _si_units, test_offset)
@@ -400,6 +259,6 @@ try:
     fig = plot_calibration_analysis(
         matched_peaks,
         output_path=os.path.join(Path(product["nb"]).parent, 'calibration_analysis_comprehensive.png'))
-    plt.show()    
+    render.show()    
 except Exception as err:
     traceback.print_exc()
\ No newline at end of file
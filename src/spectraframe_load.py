@@ -1,19 +1,23 @@
-from ramanchada2.spectrum import Spectrum, hdr_from_multi_exposure
 from utils import (
     read_template, load_config, is_in_skip, 
     get_config_excludecols,
-    metadata_cleanup, load_spectrum_df,
+    metadata_cleanup, get_config_workers, get_config_template_cache,
+    get_config_hdr_samples, get_config_exports,
     unicode_unit, get_xunit
 )
-from IPython.display import display, HTML
+from spectraload import load_spectra, read_spectrum, load_backgrounds, subtract_background
+from spectramanifest import LoadManifest, config_digest, row_key
+from spectrastore import write_spectraframe, export_metadata
+from spectrahdr import hdr_from_exposures
+from spectracontainer import spectrum_exists
+import spectracache
+import render
 import os.path
 from pathlib import Path
-import matplotlib.pyplot as plt
 import pandas as pd
 from utils import (
     toc, toc_anchor, toc_entry, toc_link, toc_heading, toc_collapsible
     )
-import numpy as np
 
 
 # + tags=["parameters"]
@@ -33,6 +37,7 @@ warnings.filterwarnings(
 warnings.filterwarnings("ignore", category=pd.errors.PerformanceWarning)
 
 _config = load_config(os.path.join(config_root, config_templates))
+render.configure_from(_config, product["nb"])
 print(key, _config["templates"].keys())
 
 Path(os.path.dirname(product["h5"])).mkdir(parents=True, exist_ok=True)
@@ -43,7 +48,8 @@ toc_heading(key, "h1")
 entry
 
 _path_excel = os.path.join(config_root, entry["template"])
-df = read_template(_path_excel, path_spectra=os.path.join(config_root, entry["path"]), subfolders=entry.get("subfolders", {}))
+df = read_template(_path_excel, path_spectra=os.path.join(config_root, entry["path"]), subfolders=entry.get("subfolders", {}),
+                   cache_dir=get_config_template_cache(_config, config_root))
 df = metadata_cleanup(df)
 
 df["source"] = str(entry)
@@ -61,6 +67,28 @@ print(groupby_cols)
 
 df["background_file"] = None
 
+spectracache.configure_from(_config, config_root)
+# rows whose inputs did not change since the previous run are carried over from its product
+manifest = LoadManifest(product["h5"], config_digest(entry))
+changed = df["file_name"].map(manifest.changed)
+print(f"{changed.sum()} of {len(df)} files new or modified")
+
+# changed spectra are read once, in parallel if configured; failures are logged and left as None
+spectra = pd.Series(None, index=df.index, dtype=object)
+if changed.any():
+    spectra.loc[changed[changed].index] = load_spectra(df.loc[changed], workers=get_config_workers(_config, key))
+
+
+def spectrum_of(index):
+    """Spectrum of a row; unchanged files are only read when needed."""
+    if spectra.loc[index] is None and not changed.loc[index]:
+        spe, err = read_spectrum(df.loc[index, "file_name"])
+        if err is not None:
+            print(f"⚠️ {err}: {df.loc[index, 'file_name']}")
+        spectra.at[index] = spe
+    return spectra.loc[index]
+
+
 grouped_df = df.groupby(groupby_cols, dropna=False)
 
 # figure out background files
@@ -68,31 +96,29 @@ grouped_df = df.groupby(groupby_cols, dropna=False)
 for group_keys, sample_data in grouped_df:
     toc_collapsible(f"{sample_data.shape} {group_keys[0]} {group_keys[1]}", sample_data.to_html(index=False) + f"<p>{group_keys}</p>")    
 
-    try:
-        _spe = sample_data.apply(load_spectrum_df, axis=1)
-    except Exception as err:
-        print(err)
-        continue
-    fig, ax = plt.subplots(1, 1, figsize=(15, 3))
-    ax.title.set_text("{} {}".format(group_keys[0], group_keys[1]))
-    x_unit = get_xunit(sample_data["sample"].unique()[0], entry)
-    # .trim_axes(method='x-axis', boundaries=(100, 3400))
-    sample_data["spectrum"] = _spe
-    try:
-        sample_data.apply(lambda row: None if row["spectrum"] is None else row["spectrum"].plot(
-            ax=ax, label="{} {} {}".format(
-                os.path.basename(row["file_name"]), 
-                row["background"],
-                "" if row["overexposed"] == "NO" else "overexp")),
-            axis=1)
+    if not changed.loc[sample_data.index].any():
+        print("Unchanged since the previous run")
+    else:
+        _spe = spectra.loc[sample_data.index]
+        fig, ax = render.subplots(1, 1, figsize=(15, 3))
+        ax.title.set_text("{} {}".format(group_keys[0], group_keys[1]))
+        x_unit = get_xunit(sample_data["sample"].unique()[0], entry)
+        # .trim_axes(method='x-axis', boundaries=(100, 3400))
+        sample_data["spectrum"] = _spe
+        try:
+            sample_data.apply(lambda row: None if row["spectrum"] is None else row["spectrum"].plot(
+                ax=ax, label="{} {} {}".format(
+                    os.path.basename(row["file_name"]), 
+                    row["background"],
+                    "" if row["overexposed"] == "NO" else "overexp")),
+                axis=1)
         
-        ax.set_xlabel(f"{unicode_unit(x_unit)}")
-        ax.set_ylabel(f"Intensity (a.u.)")        
-        #plt.xlabel(f"Wavenumber ({unicode_unit(unit)})")
-    except Exception as err:
-        print(err)
-    display(fig)   # Forces Jupyter to render figure immediately
-    plt.close(fig) # optional cleanup        
+            ax.set_xlabel(f"{unicode_unit(x_unit)}")
+            ax.set_ylabel(f"Intensity (a.u.)")        
+            #plt.xlabel(f"Wavenumber ({unicode_unit(unit)})")
+        except Exception as err:
+            print(err)
+        render.show(fig)
     if sample_data.shape[0] < 2:
         continue
     background_only_file = sample_data.loc[sample_data["background"] == "BACKGROUND_ONLY", "file_name"]
@@ -111,12 +137,12 @@ for group_keys, sample_data in grouped_df:
     else:
         print("No rows found with 'BACKGROUND_ONLY'.")
 
-df.to_hdf(product["h5"], key='templates_read', mode='w')
-df.to_excel(product["xlsx"], sheet_name='templates_read', index=False)    
-
+df["spectrum"] = None
 df_bkg_subtracted = df.loc[df["background"] == "BACKGROUND_SUBTRACTED"]
 for index, row in df_bkg_subtracted.iterrows():
-    spe = Spectrum.from_local_file(row["file_name"])
+    spe = manifest.carry(row_key(row), [row["file_name"]])
+    if spe is None:
+        spe = spectrum_of(index)
     df.loc[df["file_name"] == row["file_name"], "spectrum"] = spe
 
 df_bkg_notsubtracted = df.loc[df["background"] == "BACKGROUND_NOT_SUBTRACTED"]
@@ -125,118 +151,128 @@ toc_heading("Load, plot , substract background", "h2")
 toc_heading("Each row is assigned a background file","p")
 
 root = Path(config_root)
-new_rows = []
-for index, row in df_bkg_notsubtracted.iterrows():
-    if row["background_file"] is None:
+# the background subtracted rows are filled in a copy of their source rows and appended at once
+derived = df_bkg_notsubtracted.loc[df_bkg_notsubtracted["background_file"].notna()].copy()
+derived["background"] = "BACKGROUND_SUBTRACTED"
+skip_background = derived["background_file"].map(
+    lambda fname: is_in_skip(_config, key, filename=os.path.basename(fname)))
+todo = []
+for index, row in derived.iterrows():
+    carried = manifest.carry(row_key(row), [row["file_name"], row["background_file"]],
+                             skip_background=skip_background.loc[index])
+    if carried is None:
+        todo.append(index)
+    else:
+        derived.at[index, "spectrum"] = carried
+
+# each distinct background is read and despiked once
+backgrounds = load_backgrounds(derived.loc[todo, "background_file"], workers=get_config_workers(_config, key))
+
+# subtraction and pedestal removal of all rows
+for index in todo:
+    if not spectrum_exists(derived.loc[index, "file_name"]):
+        continue
+    spe = spectrum_of(index)
+    if spe is None:
         continue
+    bkg = backgrounds.get(derived.loc[index, "background_file"])
+    derived.at[index, "spectrum"] = subtract_background(
+        spe, None if skip_background.loc[index] or bkg is None else bkg[1])
+
+for index, row in derived.iterrows():
     toc_collapsible(f"{row['sample']} ({row['optical_path']}) : {Path(row['file_name']).relative_to(root)}",
                     Path(row["background_file"]).relative_to(root))
-    fig, (ax, tax) = plt.subplots(2, 1, figsize=(15, 4))
+    if index not in todo:
+        print("Unchanged since the previous run")
+        continue
+    fig, (ax, tax) = render.subplots(2, 1, figsize=(15, 4))
     ax.title.set_text(os.path.basename(row["file_name"])) 
 
-    new_row = row.copy()
-    if os.path.isfile(row["background_file"]):
-        spe_bkg = Spectrum.from_local_file(row["background_file"])
+    bkg = backgrounds.get(row["background_file"])
+    if bkg is not None:
+        spe_bkg, spe_bkg_nospikes = bkg
         spe_bkg.plot(label="BACKGROUND_ONLY", ax=tax, linestyle='-', color='red')
-        spe_bkg_nospikes = spe_bkg.recover_spikes()
         spe_bkg_nospikes.plot(label="Background_only_nospikes", ax=tax, linestyle='--', color='gray')
-    else:
-        spe_bkg_nospikes = None
-    if not os.path.isfile(row["file_name"]):
+    if not spectrum_exists(row["file_name"]):
         print("⚠️ File not found: {}".format(row["file_name"]))
         ax.title.set_text("⚠️ File not found: {}".format(os.path.basename(row["file_name"]))) 
+        render.close(fig)
+        continue
+    spe = spectra.loc[index]
+    if spe is None:
+        render.close(fig)
         continue
-    spe = Spectrum.from_local_file(row["file_name"])
     spe.plot(label="BACKGROUND_NOT_SUBTRACTED {} ({})".format(row["sample"], row["optical_path"]), ax=ax)    
+    row["spectrum"].plot(label="Background_Substracted {} ({})".format(row["sample"], 
+                                         row["optical_path"]), ax=ax.twinx(), linestyle='--', color='orange')
+    render.show(fig)
 
-    new_spe = spe if is_in_skip(_config, key, filename=os.path.basename(row["background_file"])) or spe_bkg_nospikes is None else spe - spe_bkg_nospikes
-    
-    # new_spe.y[new_spe.y < 0] = 0
-    # remove pedestal
-    if min(new_spe.y)>0:
-        # remove pedestal
-        new_spe.y = new_spe.y - np.min(new_spe.y)
-
-    # new_spe = new_spe.recover_spikes()
-
-    new_row["spectrum"] = new_spe
-    new_spe.plot(label="Background_Substracted {} ({})".format(row["sample"], 
-                                    row["optical_path"]), ax=ax.twinx(), linestyle='--', color='orange')
-    new_row["background"] = "BACKGROUND_SUBTRACTED"
-    new_rows.append(new_row)
-    display(fig)
-    plt.close(fig)
-
-if new_rows:  # Only concatenate if there are new rows to add
-    new_df = pd.DataFrame(new_rows)  # Convert list of rows to DataFrame
-    df = pd.concat([df, new_df], ignore_index=True)  # Append all at once
-
-df.to_hdf(product["h5"], key='templates_read', mode='w')
-df.to_excel(product["xlsx"], sheet_name='templates_read', index=False)    
+# rows whose spectrum could not be read are not added
+derived = derived.loc[derived["spectrum"].notna()]
+if not derived.empty:
+    df = pd.concat([df, derived], ignore_index=True)
 
 hdr_added = False
-df_ne = df.loc[(df["background"] == "BACKGROUND_SUBTRACTED") & (df["sample"] == "Neon")]
-grouped_df = df_ne.groupby(["laser_wl", "optical_path"], dropna=False)
+hdr_samples = get_config_hdr_samples(_config, key)
+df_hdr = df.loc[(df["background"] == "BACKGROUND_SUBTRACTED") & df["integration_time_ms"].notna()]
+if hdr_samples is not None:
+    df_hdr = df_hdr.loc[df_hdr["sample"].isin(hdr_samples)]
+grouped_df = df_hdr.groupby(["sample", "laser_wl", "optical_path"], dropna=False)
 
 toc_heading("HDR merge", "h2")
 toc_heading("HDR merge on all groups that have integration time - not only Ne","p")
 
-
+hdr_rows = []
 for group_keys, op_data in grouped_df:
-    if 'integration_time_ms' not in op_data.columns or op_data['integration_time_ms'].dropna().empty:
-        # Skip this group if integration_time_ms is missing or empty
+    op_data = op_data.loc[op_data["spectrum"].notna()]
+    if op_data["integration_time_ms"].nunique() < 2:
+        # nothing to merge without at least two integration times
         continue
-    if len(op_data) > 1:
-        fig, (axes) = plt.subplots(len(op_data)+2, 1, figsize=(15, 12)) 
-        laser_wl = group_keys[0]
-        optical_path = group_keys[1]
-        axes[0].set_title(f"{key} [{laser_wl}nm] {optical_path}")
-        axes[0].set_yscale("log")
-        max_row = op_data.loc[op_data["integration_time_ms"].idxmax()]
-        yaxis_max = 0.9 * max(max_row["spectrum"].y)
-        spe_ne = []
-        ix = 2
-        spe_ne_len = []
-        min_x = None
-        max_x = None
-        for _, row in op_data.iterrows():
-            integration_time_ms = row["integration_time_ms"]
-            spe = Spectrum(row["spectrum"].x, row["spectrum"].y,
-                        metadata=dict(integration_time_ms=integration_time_ms,
-                                        yaxis_max=yaxis_max))
-            spe.plot(ax=axes[ix], fmt='--', label=f"{integration_time_ms} ms")
-            spe_ne.append(spe)
-            spe_ne_len.append(len(spe.x))
-            min_x = min(spe.x) if min_x is None or min_x > min(spe.x) else min_x
-            max_x = max(spe.x) if max_x is None or max_x < min(spe.x) else max_x
-            #plt.yscale('log')
-            #axes[ix].set_yscale("log")
-            ix = ix+1
-        if min(spe_ne_len) != max(spe_ne_len):
-            # resample - check if this can be improved
-            for i, _spe in enumerate(spe_ne):
-                spe_ne[i] = _spe.resample_spline_filter(
-                    x_range=(min_x, max_x),
-                    xnew_bins=max(spe_ne_len), spline="akima")
-
-        hdr = hdr_from_multi_exposure(spe_ne,
-                                    meta_exposure_time='integration_time_ms',
-                                    meta_ymax='yaxis_max')
-        twax = axes[0].twinx()
-        twax.set_yscale("log")
-        max_row["spectrum"].plot(ax=twax, label=max_row["integration_time_ms"])
-        max_row["spectrum"].plot(ax=axes[1].twinx(), label=max_row["integration_time_ms"])        
-        hdr.plot(ax=axes[0], fmt='--', color='red', label='HDR')
-        hdr.plot(ax=axes[1], fmt='--', color='red', label='HDR')
-
-        hdr_row = max_row.copy()
+    sample, laser_wl, optical_path = group_keys
+    max_row = op_data.loc[op_data["integration_time_ms"].idxmax()]
+    hdr_row = max_row.copy()
+    hdr_row["overexposed"] = "HDR_MERGE"
+    hdr = manifest.carry(row_key(hdr_row),
+                         op_data["file_name"].tolist() + op_data["background_file"].dropna().tolist(),
+                         integration_time_ms=op_data["integration_time_ms"].tolist())
+    if hdr is not None:
+        print(f"HDR {group_keys} unchanged since the previous run")
         hdr_row["spectrum"] = hdr
-        hdr_row["overexposed"] = "HDR_MERGE"
-        df = pd.concat([df, pd.DataFrame([hdr_row])], ignore_index=True)
-        hdr_added = True
-        #plt.yscale('log')
+        hdr_rows.append(hdr_row)
+        continue
+    yaxis_max = 0.9 * max(max_row["spectrum"].y)
+    try:
+        hdr = hdr_from_exposures(op_data["spectrum"].tolist(), op_data["integration_time_ms"].tolist(),
+                                 yaxis_max=yaxis_max)
+    except Exception as err:
+        print(f"⚠️ HDR {group_keys}: {err}")
+        continue
+
+    fig, (axes) = render.subplots(len(op_data)+2, 1, figsize=(15, 12)) 
+    axes[0].set_title(f"{key} {sample} [{laser_wl}nm] {optical_path}")
+    axes[0].set_yscale("log")
+    for ix, (_, row) in enumerate(op_data.iterrows(), start=2):
+        row["spectrum"].plot(ax=axes[ix], fmt='--', label=f"{row['integration_time_ms']} ms")
+    twax = axes[0].twinx()
+    twax.set_yscale("log")
+    max_row["spectrum"].plot(ax=twax, label=max_row["integration_time_ms"])
+    max_row["spectrum"].plot(ax=axes[1].twinx(), label=max_row["integration_time_ms"])        
+    hdr.plot(ax=axes[0], fmt='--', color='red', label='HDR')
+    hdr.plot(ax=axes[1], fmt='--', color='red', label='HDR')
+    render.show(fig)
+
+    hdr_row["spectrum"] = hdr
+    hdr_rows.append(hdr_row)
+
+if hdr_rows:
+    df = pd.concat([df, pd.DataFrame(hdr_rows)], ignore_index=True)
+    hdr_added = True
 
 if hdr_added:
-    print("HDR merged Ne added")
-    df.to_hdf(product["h5"], key='templates_read', mode='w')
-    df.to_excel(product["xlsx"], sheet_name='templates_read', index=False)
\ No newline at end of file
+    print(f"{len(hdr_rows)} HDR merged spectra added")
+
+# the products are written once, at the end
+write_spectraframe(df, product["h5"], key='templates_read')
+for exported in export_metadata(df, product["h5"], get_config_exports(_config)):
+    print(f"Exported {exported}")
+manifest.save()
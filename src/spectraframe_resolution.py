@@ -17,7 +17,7 @@ import os.path
 import traceback
 from pathlib import Path
 
-import matplotlib.pyplot as plt
+import render
 import numpy as np
 import pandas as pd
 from IPython.display import HTML, display
@@ -28,6 +28,7 @@ from ramanchada2.protocols.calibration.resolution import (
 
 from utils import (get_config_findkw, get_config_units, init_logging,
                    load_calibration_model, load_config, toc_heading)
+from spectrastore import read_spectraframe
 
 # + tags=["parameters"]
 product = None
@@ -57,7 +58,7 @@ def select_spectrum(op_data, tag, prefer_hdr=False):
 def plot_group(entry_id, x_sped, sped, ne_peaks, pixel_res, spectral_res,
                sped_sres, calcite_peak, sres, uniform_grid=False,
                sres_plausible=None):
-    fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(15, 4))
+    fig, (ax1, ax2, ax3) = render.subplots(1, 3, figsize=(15, 4))
     fig.suptitle(entry_id)
 
     ax1.plot(x_sped, sped, color="blue")
@@ -94,8 +95,8 @@ def plot_group(entry_id, x_sped, sped, ne_peaks, pixel_res, spectral_res,
     ax3.set_ylabel("SpeD:SRes")
     ax3.set_title("SpeD:SRes curve")
     ax3.grid()
-    plt.tight_layout()
-    plt.show()
+    fig.tight_layout()
+    render.show(fig)
     note = (
         "Narrow dips at a handful of regularly-spaced points in the spectral "
         "distribution curve (left) mark detector segment-stitching seams "
@@ -244,8 +245,10 @@ toc_heading(f"Spectral distribution & resolution curves (CWA 18133 sections 3 &
 
 Path(product["nb"]).parent.mkdir(parents=True, exist_ok=True)
 try:
-    df = pd.read_hdf(upstream["spectraframe_*"][f"spectraframe_{key}"]["h5"], key="templates_read")
+    df = read_spectraframe(upstream["spectraframe_*"][f"spectraframe_{key}"]["h5"], key="templates_read",
+                           background="BACKGROUND_SUBTRACTED")
     _config = load_config(os.path.join(config_root, config_templates))
+    render.configure_from(_config, product["nb"])
     calmodel_path = upstream["spectracal_*"][f"spectracal_{key}"]["calmodels"]
     df_peaks, df_curves, df_summary = main(df, calmodel_path, _config)
     df_peaks.to_csv(product["peaks"], index=False)
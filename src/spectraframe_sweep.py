@@ -0,0 +1,88 @@
+from pathlib import Path
+import os.path
+import time
+import pandas as pd
+from IPython.display import display
+from utils import (get_config_units, get_config_workers, get_config_fit_cache,
+                   load_config, get_config_findkw, init_logging, toc_heading)
+import spectrafitcache
+from spectracalibrate import GroupJob
+from spectrasweep import variants, run_sweep
+from spectrastore import read_spectraframe
+
+
+# + tags=["parameters"]
+product = None
+config_templates = None
+config_root = None
+key = None
+spectraframe = None
+neon_tag = None
+si_tag = None
+pst_tag = None
+calcite_tag = None
+fit_ne_peaks = [True]
+match_modes = ["argmin2d"]
+interpolators = ["pchip"]
+# -
+
+
+logger = init_logging(Path(product["nb"]).parent, f"spectrasweep_{key}.log")
+
+
+def first_spectrum(op_data, tag):
+    """Spectrum of ``tag`` in the group (the HDR merge if there is one), ``None`` if absent."""
+    rows = op_data.loc[op_data["sample"] == tag]
+    hdr = rows.loc[rows["overexposed"] == "HDR_MERGE"]
+    rows = hdr if not hdr.empty else rows
+    return None if rows.empty else rows["spectrum"].iloc[0]
+
+
+def build_groups(df, _config):
+    groups = []
+    samples = []
+    _ne_units = get_config_units(_config, key, tag="neon")
+    _si_units = get_config_units(_config, key, tag="si")
+    for (laser_wl, optical_path), op_data in df.groupby(["laser_wl", "optical_path"], dropna=False):
+        spe_neon = first_spectrum(op_data, neon_tag)
+        spe_sil = op_data.loc[op_data["sample"] == si_tag, "spectrum"]
+        if spe_neon is None or spe_sil.empty:
+            logger.warning(f"{laser_wl} {optical_path}: no {neon_tag} or {si_tag} spectrum")
+            continue
+        groups.append(GroupJob(
+            laser_wl=int(laser_wl), optical_path=optical_path,
+            spe_neon=spe_neon, spe_sil=spe_sil.iloc[0],
+            ne_units=_ne_units, si_units=_si_units,
+            find_kw_ne=dict(get_config_findkw(_config, key, "ne")),
+            find_kw_si=dict(get_config_findkw(_config, key, "si")),
+            fit_neon_peaks=None, match_mode=None, interpolator=None, calmodels=None, key=key))
+        group_samples = {}
+        for role, tag in (("PST", pst_tag), ("CAL", calcite_tag)):
+            spe = first_spectrum(op_data, tag)
+            if spe is not None:
+                group_samples[role] = (spe, get_config_units(_config, key, tag=tag.lower()))
+        samples.append(group_samples)
+    return groups, samples
+
+
+_config = load_config(os.path.join(config_root, config_templates))
+spectrafitcache.configure(get_config_fit_cache(_config, config_root))
+df = read_spectraframe(spectraframe, key="templates_read", background="BACKGROUND_SUBTRACTED")
+groups, samples = build_groups(df, _config)
+
+variant_list = variants(match_modes, interpolators, fit_ne_peaks)
+toc_heading(f"{key}: {len(variant_list)} variants × {len(groups)} optical paths", "h2")
+t0 = time.perf_counter()
+results = run_sweep(groups, samples, variant_list, workers=get_config_workers(_config, key))
+logger.info(f"sweep of {len(results)} variants in {time.perf_counter() - t0:.1f} s")
+results.insert(0, "key", key)
+results.to_csv(product["results"], index=False)
+
+# +
+pd.set_option("display.width", 200)
+display(results)
+for metric in ("pst_rmse", "cal_rmse"):
+    if metric in results:
+        toc_heading(f"{metric} (cm-1), mean over the optical paths", "h3")
+        display(results.pivot_table(index=["fit_ne_peaks", "match_mode"], columns="interpolator",
+                                    values=metric, aggfunc="mean"))
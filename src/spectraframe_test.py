@@ -11,6 +11,7 @@ from IPython.display import display
 import os.path
 import json
 from utils import (get_config_units, load_config)
+from spectrastore import read_spectraframe
 from scipy.signal import savgol_filter
 from numpy.polynomial import Polynomial
 from matchpeaks import (
@@ -269,8 +270,9 @@ if enabled:
         for key in upstream["spectraframe_*"]:
             participant =key.replace("spectraframe_","")                    
             _ne_units = get_config_units(_config, participant, tag="neon")
-            df = pd.read_hdf(upstream["spectraframe_*"][key]["h5"], key="templates_read")
-            df_bkg_substracted = df.loc[df["background"] == "BACKGROUND_SUBTRACTED"]
+            df_bkg_substracted = read_spectraframe(
+                upstream["spectraframe_*"][key]["h5"], key="templates_read",
+                background="BACKGROUND_SUBTRACTED")
             grouped_df = df_bkg_substracted.groupby(["laser_wl", "optical_path"], dropna=False)
             for group_keys, op_data in grouped_df:
                 laser_wl = group_keys[0]
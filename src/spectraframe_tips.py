@@ -1,5 +1,5 @@
-import pandas as pd
 from IPython.display import display
+from spectrastore import SpectraStore
 
 
 # + tags=["parameters"]
@@ -20,10 +20,10 @@ try:
     cfg = upstream["spectraframe_*"]
     for key in cfg.keys():
         print(key)
-        df = pd.read_hdf(cfg[key]["h5"], key="templates_read")
-        _df_ps = process(df,tips_ps)
-        display(_df_ps)
-        _df_ti = process(df,tips_ti)
-        display(_df_ti)
+        with SpectraStore(cfg[key]["h5"], key="templates_read") as store:
+            _df_ps = store.read(process(store.frame, tips_ps).index)
+            display(_df_ps)
+            _df_ti = store.read(process(store.frame, tips_ti).index)
+            display(_df_ti)
 except Exception as err:
     print(err)
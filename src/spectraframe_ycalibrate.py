@@ -1,7 +1,7 @@
-import pandas as pd
 import os.path
 from pathlib import Path
 from utils import (load_config, load_calibration_model)
+from spectrastore import read_spectraframe
 from ramanchada2.protocols.calibration.serialization import export_cwa_y
 from ramanchada2.protocols.calibration.ycalibration import (
     YCalibrationComponent, CertificatesDict)
@@ -119,7 +119,8 @@ def main(df, calmodel_path, config):
 
 Path(product["ycalmodels"]).mkdir(parents=True, exist_ok=True)
 try:
-    df = pd.read_hdf(upstream["spectraframe_*"][f"spectraframe_{key}"]["h5"], key="templates_read")
+    df = read_spectraframe(upstream["spectraframe_*"][f"spectraframe_{key}"]["h5"], key="templates_read",
+                           background="BACKGROUND_SUBTRACTED")
     _config = load_config(os.path.join(config_root, config_templates))
     calmodel_path = upstream["spectracal_*"][f"spectracal_{key}"]["calmodels"]
     main(df, calmodel_path, _config)
@@ -0,0 +1,74 @@
+"""HDR merge of spectra of the same sample taken with different integration times.
+
+All exposures of a group are stacked into one 2D array on a shared x grid and
+merged with the rule of ``ramanchada2``'s ``hdr_from_multi_exposure``: every
+point is taken, in counts per ms, from the longest exposure that is not above
+``yaxis_max`` at that point (from the shortest exposure if all are).
+"""
+import numpy as np
+from ramanchada2.spectrum import Spectrum
+from scipy.interpolate import Akima1DInterpolator
+
+
+def common_grid(xs):
+    """Uniform grid over the union of the x ranges, with as many bins as the longest axis.
+
+    Same grid as ``resample_spline_filter(x_range=(min_x, max_x), xnew_bins=n)``.
+    """
+    min_x = min(np.min(x) for x in xs)
+    max_x = max(np.max(x) for x in xs)
+    return np.linspace(min_x, max_x, max(len(x) for x in xs), endpoint=False)
+
+
+def stack_exposures(xs, ys, spline="akima"):
+    """Stack the exposures into ``(x, Y)`` with ``Y`` of shape ``(n_exposures, n_points)``.
+
+    Exposures sharing the same x axis are stacked as they are. Otherwise all are
+    resampled on ``common_grid`` with one Akima interpolation per distinct x axis
+    (values outside an axis are set to 0, as ``resample_spline_filter`` does).
+    """
+    x0 = np.asarray(xs[0])
+    if all(len(x) == len(x0) and np.array_equal(x, x0) for x in xs[1:]):
+        return x0, np.vstack(ys).astype(float)
+    if spline != "akima":
+        raise ValueError(f"Unsupported spline {spline}")
+    grid = common_grid(xs)
+    stacked = np.empty((len(ys), len(grid)))
+    # exposures with the same x axis are interpolated in one call
+    axes = {}
+    for i, x in enumerate(xs):
+        axes.setdefault(np.asarray(x, dtype=float).tobytes(), []).append(i)
+    for rows in axes.values():
+        x = np.asarray(xs[rows[0]], dtype=float)
+        stacked[rows] = Akima1DInterpolator(x, np.vstack([ys[i] for i in rows]).T)(grid).T
+    stacked[np.isnan(stacked)] = 0
+    return grid, stacked
+
+
+def hdr_merge(x, Y, integration_times, yaxis_max):
+    """Merge the stacked exposures ``Y`` (one per row) into one spectrum.
+
+    Args:
+        x (np.ndarray): shared x axis.
+        Y (np.ndarray): exposures, shape ``(n_exposures, len(x))``.
+        integration_times (array-like): integration time of each exposure.
+        yaxis_max (float): values above it are considered saturated.
+
+    Returns:
+        Spectrum: merged spectrum in counts per unit of integration time.
+    """
+    times = np.asarray(integration_times, dtype=float)
+    order = np.argsort(times, kind="stable")
+    Y = np.asarray(Y, dtype=float)[order]
+    cps = Y / times[order][:, None]
+    usable = ~(Y > yaxis_max)
+    usable[0] = True
+    # last (longest) usable exposure at every point
+    pick = len(Y) - 1 - np.argmax(usable[::-1], axis=0)
+    return Spectrum(x=np.array(x, dtype=float), y=cps[pick, np.arange(Y.shape[1])])
+
+
+def hdr_from_exposures(spectra, integration_times, yaxis_max, spline="akima"):
+    """HDR spectrum of ``spectra`` taken with ``integration_times``."""
+    x, Y = stack_exposures([spe.x for spe in spectra], [spe.y for spe in spectra], spline=spline)
+    return hdr_merge(x, Y, integration_times, yaxis_max)
@@ -0,0 +1,125 @@
+"""Spectrum loading engine for the spectraframe tasks.
+
+Reads the spectra referenced by the ``file_name`` column of a template frame,
+optionally with a process pool. Results keep the row order (and index) of the
+frame; files that cannot be read are reported with ``logger.warning`` and come
+back as ``None``, the same way ``utils.load_spectrum_df`` handles missing files.
+
+Background files are prepared (read and despiked) once per distinct file by
+``load_backgrounds`` and subtracted with ``subtract_background``.
+"""
+import copy
+import logging
+import os.path
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from spectracache import configure, get_cache, get_settings, load_spectrum
+from spectracontainer import read_member, split_member
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_spectrum(fname):
+    """Parse one spectrum file.
+
+    Returns ``(spectrum, error)``; exceptions are turned into the error string so
+    that a single broken file does not abort the whole pool.
+    """
+    try:
+        if split_member(fname) is not None:
+            spe = read_member(fname)
+            return (spe, None) if spe is not None else (None, "Spectrum not found")
+        if not os.path.isfile(fname):
+            return None, "File not found"
+        return load_spectrum(fname), None
+    except Exception as err:
+        return None, f"Failed to read ({err})"
+
+
+def load_spectra(df, workers=1, column="file_name", chunksize=4):
+    """Load the spectra of all rows of ``df``.
+
+    Args:
+        df (pd.DataFrame): template frame, one spectrum file per row.
+        workers (int): number of worker processes; ``<= 1`` reads in-process.
+        column (str): column holding the file paths.
+        chunksize (int): number of files handed to a worker at once.
+
+    Returns:
+        pd.Series: ``Spectrum`` (or ``None``) per row, aligned to ``df.index``.
+    """
+    fnames = df[column].tolist()
+    # a file referenced by several rows is read once
+    unique_fnames = list(dict.fromkeys(fnames))
+    if workers is None or workers <= 1 or len(unique_fnames) < 2:
+        results = [read_spectrum(fname) for fname in unique_fnames]
+    else:
+        # workers use the same (disk) cache settings as this process
+        with ProcessPoolExecutor(max_workers=min(workers, len(unique_fnames)),
+                                 initializer=partial(configure, **get_settings())) as pool:
+            results = list(pool.map(read_spectrum, unique_fnames, chunksize=chunksize))
+        # parsed in the workers: keep them for the later steps of this task
+        cache = get_cache()
+        for fname, (spe, err) in zip(unique_fnames, results):
+            if spe is not None and split_member(fname) is None:
+                cache.put(fname, spe)
+    loaded = {}
+    for fname, (spe, err) in zip(unique_fnames, results):
+        if err is not None:
+            logger.warning(f"⚠️ {err}: {fname}")
+        loaded[fname] = spe
+    return pd.Series([loaded[fname] for fname in fnames], index=df.index, dtype=object)
+
+
+def prepare_background(fname):
+    """Read a background file and recover its spikes.
+
+    Returns ``(spectrum, spectrum_without_spikes, error)``.
+    """
+    spe, err = read_spectrum(fname)
+    if spe is None:
+        return None, None, err
+    try:
+        return spe, spe.recover_spikes(), None
+    except Exception as err:
+        return spe, None, f"Failed to recover spikes ({err})"
+
+
+def load_backgrounds(fnames, workers=1, chunksize=1):
+    """Prepare each distinct background file once.
+
+    Returns:
+        dict: file name -> ``(spectrum, spectrum_without_spikes)``; files that
+        cannot be read are left out.
+    """
+    unique_fnames = list(dict.fromkeys(f for f in fnames if isinstance(f, str)))
+    if workers is None or workers <= 1 or len(unique_fnames) < 2:
+        results = [prepare_background(fname) for fname in unique_fnames]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(unique_fnames)),
+                                 initializer=partial(configure, **get_settings())) as pool:
+            results = list(pool.map(prepare_background, unique_fnames, chunksize=chunksize))
+    backgrounds = {}
+    for fname, (spe, spe_nospikes, err) in zip(unique_fnames, results):
+        if err is not None:
+            logger.warning(f"⚠️ {err}: {fname}")
+        if spe_nospikes is not None:
+            backgrounds[fname] = (spe, spe_nospikes)
+    return backgrounds
+
+
+def subtract_background(spe, spe_bkg=None):
+    """``spe - spe_bkg`` with the pedestal removed; ``spe`` itself is not modified.
+
+    Without a background only the pedestal is removed.
+    """
+    new_spe = copy.deepcopy(spe) if spe_bkg is None else spe - spe_bkg
+    if min(new_spe.y) > 0:
+        # remove pedestal
+        new_spe.y = new_spe.y - np.min(new_spe.y)
+    return new_spe
@@ -0,0 +1,205 @@
+"""Manifest of the inputs of a spectraframe product, for incremental re-runs.
+
+Next to ``<product>.h5`` the load task writes ``<product>.manifest.json`` with
+the content hash of every input file and, for every derived row (loaded,
+background subtracted or HDR merged), the files and parameters it was computed
+from. On the next run a row whose inputs are unchanged is carried over from the
+previous product instead of being recomputed.
+
+The manifest is only trusted if the dataset's config entry and the processing
+code are the same as in the run that wrote it; otherwise everything is redone.
+"""
+import hashlib
+import json
+import logging
+import os
+import os.path
+
+import pandas as pd
+
+from spectracache import file_hash
+from spectracontainer import member_stamp, split_member
+from spectrastore import SpectraStore
+
+
+logger = logging.getLogger(__name__)
+
+# bump when the meaning of the manifest entries changes
+MANIFEST_VERSION = "1"
+# sources whose changes invalidate previously derived rows: the load task and the
+# modules its loading, background subtraction and HDR merge go through
+CODE_FILES = ["spectraframe_load.py", "spectraload.py", "spectrahdr.py", "spectramanifest.py",
+              "utils.py", "spectracache.py", "spectracontainer.py"]
+
+
+def manifest_path(h5):
+    return os.path.splitext(h5)[0] + ".manifest.json"
+
+
+def _cell(value):
+    if value is None or (not isinstance(value, (list, tuple)) and pd.isna(value)):
+        return ""
+    return str(value)
+
+
+def row_key(row):
+    """Identity of a spectraframe row across runs."""
+    return "|".join(_cell(row.get(col)) for col in
+                    ["background", "overexposed", "file_name", "background_file"])
+
+
+def code_digest():
+    """Hash of the processing code and the ramanchada2 version."""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(MANIFEST_VERSION.encode())
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for name in CODE_FILES:
+        path = os.path.join(folder, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                h.update(f.read())
+    try:
+        from importlib.metadata import version
+        h.update(version("ramanchada2").encode())
+    except Exception:
+        pass
+    return h.hexdigest()
+
+
+def config_digest(entry):
+    """Hash of a config entry together with the processing code."""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(json.dumps(entry, sort_keys=True, default=str).encode())
+    h.update(code_digest().encode())
+    return h.hexdigest()
+
+
+class LoadManifest:
+    """Input hashes and derived rows of one spectraframe product.
+
+    Creating the manifest moves the previous product aside (``<h5>.previous``) so
+    that the task can write the new one while rows are carried over; ``save``
+    writes the new manifest and removes the previous product.
+    """
+
+    def __init__(self, h5, digest, key="templates_read"):
+        self.h5 = h5
+        self.path = manifest_path(h5)
+        self.digest = digest
+        self.key = key
+        self.files = {}
+        self.rows = {}
+        self._previous = self._read()
+        self._store = None
+        self._labels = None
+        if self._previous is not None:
+            self._open_previous()
+
+    def _read(self):
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                previous = json.load(f)
+        except Exception as err:
+            logger.warning(f"Ignoring unreadable manifest {self.path}: {err}")
+            return None
+        if previous.get("version") != MANIFEST_VERSION or previous.get("digest") != self.digest:
+            logger.info(f"Config or code changed since {self.path} was written, reprocessing all rows")
+            return None
+        return previous
+
+    def _open_previous(self):
+        previous_h5 = f"{self.h5}.previous"
+        # a run that failed half-way leaves only the moved file
+        if os.path.isfile(self.h5):
+            os.replace(self.h5, previous_h5)
+        if not os.path.isfile(previous_h5):
+            self._previous = None
+            return
+        try:
+            self._store = SpectraStore(previous_h5, key=self.key, keep=False)
+            self._labels = {row_key(row): label for label, row in self._store.frame.iterrows()}
+        except Exception as err:
+            logger.warning(f"Previous product {previous_h5} not readable, reprocessing all rows: {err}")
+            self._store = None
+            self._previous = None
+
+    @property
+    def incremental(self):
+        """True if rows can be carried over from a previous run."""
+        return self._previous is not None
+
+    def file_hash(self, fname):
+        """Content hash of an input file, ``None`` if it does not exist.
+
+        The hash of the previous run is reused if mtime and size did not change.
+        A ``<container.h5>::<key>`` member is identified by the source mtime and
+        hash its container recorded (``SpectraContainer.stamp``).
+        """
+        if fname in self.files:
+            return self.files[fname]["hash"]
+        if split_member(fname) is not None:
+            stamp = member_stamp(fname)
+            if stamp is None:
+                return None
+            # the hash is empty if the conversion did not compute one
+            entry = {"mtime_ns": stamp["mtime_ns"], "hash": stamp["hash"] or f"mtime_ns:{stamp['mtime_ns']}"}
+            self.files[fname] = entry
+            return entry["hash"]
+        if not isinstance(fname, str) or not os.path.isfile(fname):
+            return None
+        st = os.stat(fname)
+        entry = {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+        previous = (self._previous or {}).get("files", {}).get(fname)
+        if previous is not None and all(previous.get(k) == v for k, v in entry.items()):
+            entry["hash"] = previous["hash"]
+        else:
+            entry["hash"] = file_hash(fname)
+        self.files[fname] = entry
+        return entry["hash"]
+
+    def changed(self, fname):
+        """True if ``fname`` is new, modified or missing since the previous run."""
+        digest = self.file_hash(fname)
+        if digest is None or self._previous is None:
+            return True
+        return self._previous.get("files", {}).get(fname, {}).get("hash") != digest
+
+    def carry(self, key, files, **params):
+        """Record the inputs of a derived row; its previous spectrum if they are unchanged.
+
+        Args:
+            key (str): ``row_key`` of the derived row.
+            files (list): input files the row is computed from.
+            params: other values the result depends on (e.g. integration times).
+
+        Returns:
+            Spectrum or None: ``None`` if the row has to be (re)computed.
+        """
+        inputs = {"files": [_cell(f) for f in files],
+                  "params": {k: _cell(v) for k, v in sorted(params.items())}}
+        self.rows[key] = inputs
+        # hashing records the files in this run's manifest
+        changed = [self.changed(f) for f in files]
+        if self._previous is None or self._previous.get("rows", {}).get(key) != inputs:
+            return None
+        if any(changed):
+            return None
+        label = self._labels.get(key)
+        if label is None:
+            return None
+        return self._store.spectrum(label)
+
+    def save(self):
+        """Write the manifest of this run and drop the previous product."""
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+        if os.path.isfile(f"{self.h5}.previous"):
+            os.remove(f"{self.h5}.previous")
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "digest": self.digest,
+                       "files": self.files, "rows": self.rows}, f, indent=1)
+        os.replace(tmp, self.path)
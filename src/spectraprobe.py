@@ -0,0 +1,120 @@
+"""Cheap probe of spectrum files: number of points and x range.
+
+Where the format allows it the values are taken from the file header or from a
+partial read of the x column:
+
+- ``.cha``: shape of the ``/raw`` dataset and its x row;
+- ``.spc``: ``fnpts``/``ffirst``/``flast`` of the main header (or the x array
+  that follows it);
+- plain two-column text (``.txt``, ``.tsv``, ...): the first column only.
+
+Other files (and files these readers do not understand) are parsed through the
+shared spectrum cache, see ``spectracache.load_spectrum``.
+"""
+import logging
+import os.path
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import h5py
+import numpy as np
+
+from spectracache import configure, get_settings, load_spectrum
+from spectracontainer import read_member, split_member
+
+
+logger = logging.getLogger(__name__)
+
+TEXT_EXTENSIONS = {".txt", ".txtr", ".prn", ".tsv", ".dpt"}
+# first lines of the text formats ramanchada2 reads with a dedicated parser
+TEXT_SPECIAL_PREFIXES = ("File Version;BW", "##", "DeviceSN\t")
+
+
+def _probe_cha(fname):
+    with h5py.File(fname, "r") as h5:
+        data = h5["/raw"]
+        x = data[0]
+    return len(x), float(np.min(x)), float(np.max(x))
+
+
+def _probe_spc(fname):
+    with open(fname, "rb") as f:
+        header = f.read(512)
+        ftflgs, fversn = header[0], header[1]
+        if fversn != 0x4B or ftflgs & 0x40:
+            # old format or per-subfile x values
+            return None
+        fnpts, ffirst, flast, fnsub = struct.unpack("<idd i", header[4:28])
+        if fnsub != 1:
+            return None
+        if ftflgs & 0x80:
+            # explicit x values follow the header
+            x = np.frombuffer(f.read(4 * fnpts), dtype="<f4")
+            if len(x) != fnpts:
+                return None
+            return fnpts, float(np.min(x)), float(np.max(x))
+    return fnpts, float(min(ffirst, flast)), float(max(ffirst, flast))
+
+
+def _probe_text(fname):
+    with open(fname, "r") as f:
+        first = f.readline()
+        if first.startswith(TEXT_SPECIAL_PREFIXES) or ("," in first and not first.split(",")[0].isdigit()):
+            return None
+        line = first
+        while line and (not line.strip() or line.startswith("#")):
+            line = f.readline()
+        # two numeric columns, as read by ramanchada2's two column parser
+        if len(line.split()) != 2:
+            return None
+    x = np.loadtxt(fname, usecols=0, ndmin=1, skiprows=1 if first.startswith("#") else 0)
+    return len(x), float(np.min(x)), float(np.max(x))
+
+
+PROBES = {".cha": _probe_cha, ".spc": _probe_spc}
+PROBES.update({ext: _probe_text for ext in TEXT_EXTENSIONS})
+
+
+def probe_spectrum(fname):
+    """Number of points and x range of a spectrum file.
+
+    Returns:
+        dict: ``points``, ``x_min``, ``x_max``.
+    """
+    probe = PROBES.get(os.path.splitext(fname)[1].lower())
+    result = None
+    if probe is not None:
+        try:
+            result = probe(fname)
+        except Exception as err:
+            logger.debug(f"header probe failed for {fname}: {err}")
+    if result is None:
+        spe = load_spectrum(fname)
+        result = len(spe.x), float(min(spe.x)), float(max(spe.x))
+    points, x_min, x_max = result
+    return {"points": points, "x_min": x_min, "x_max": x_max}
+
+
+def _probe(fname):
+    try:
+        if split_member(fname) is not None:
+            spe = read_member(fname)
+            if spe is None:
+                return None, "Spectrum not found"
+            return {"points": len(spe.x), "x_min": float(min(spe.x)), "x_max": float(max(spe.x))}, None
+        if not os.path.isfile(fname):
+            return None, "File not found"
+        return probe_spectrum(fname), None
+    except Exception as err:
+        return None, str(err)
+
+
+def probe_spectra(fnames, workers=1, chunksize=8):
+    """``(probe_spectrum result or None, error or None)`` for every file, in order."""
+    fnames = list(fnames)
+    if workers is None or workers <= 1 or len(fnames) < 2:
+        return [_probe(fname) for fname in fnames]
+    with ProcessPoolExecutor(max_workers=min(workers, len(fnames)),
+                             initializer=partial(configure, **get_settings())) as pool:
+        return list(pool.map(_probe, fnames, chunksize=chunksize))
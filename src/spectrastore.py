@@ -0,0 +1,266 @@
+"""Columnar HDF5 layout of the spectraframe product.
+
+``df.to_hdf`` pickles the ``spectrum`` column of Spectrum objects, so every reader
+had to unpickle all spectra of a dataset. Here the frame is split in two:
+
+- ``/<key>``: the metadata table (all columns except ``spectrum``), written by pandas;
+- ``/<key>_spectra``: the x/y values of all rows concatenated into two flat
+  datasets, with ``offsets`` (row ``i`` spans ``offsets[i]:offsets[i+1]``),
+  a ``present`` flag for rows without a spectrum and the per-row metadata as JSON.
+
+- ``/<key>_index``: the columns tasks filter on (``INDEX_COLS``) as a PyTables
+  table, so ``SpectraStore.query`` can select rows inside the store.
+
+``SpectraStore`` reads the metadata table and loads a spectrum only when it is
+first asked for, so a task reads just the rows it selects. Files written with
+the old pickled layout are still readable.
+"""
+import json
+import logging
+import os.path
+
+import h5py
+import numpy as np
+import pandas as pd
+from ramanchada2.spectrum import Spectrum
+
+
+logger = logging.getLogger(__name__)
+
+SPECTRUM_COL = "spectrum"
+# columns the downstream tasks select on
+INDEX_COLS = ["background", "laser_wl", "optical_path", "sample", "overexposed"]
+
+
+def _index_value(value):
+    """Query representation of a cell: 532, 532.0 and "532" all become "532"."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ""
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _where(filters):
+    clauses = []
+    for col, value in filters.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set, np.ndarray, pd.Index)):
+            clauses.append(f"{col} in {[_index_value(v) for v in value]!r}")
+        else:
+            clauses.append(f"{col} == {_index_value(value)!r}")
+    return " & ".join(clauses)
+
+
+def _is_spectrum(value):
+    return value is not None and hasattr(value, "x") and hasattr(value, "y")
+
+
+def _meta_dump(spe):
+    try:
+        return json.dumps(spe.meta.serialize(), default=str)
+    except Exception as err:
+        logger.debug(f"spectrum metadata not serialized: {err}")
+        return "{}"
+
+
+def write_spectraframe(df, path, key="templates_read"):
+    """Write ``df`` to ``path`` in the columnar layout (overwrites the file)."""
+    meta = df.drop(columns=[SPECTRUM_COL], errors="ignore")
+    meta.to_hdf(path, key=key, mode="w")
+    if len(df) > 0:
+        index = pd.DataFrame({col: df[col].map(_index_value).to_numpy()
+                              for col in INDEX_COLS if col in df.columns})
+        index["row"] = np.arange(len(df))
+        index.to_hdf(path, key=f"{key}_index", mode="a", format="table", data_columns=True)
+
+    spectra = df[SPECTRUM_COL] if SPECTRUM_COL in df.columns else pd.Series(None, index=df.index)
+    present = np.array([_is_spectrum(spe) for spe in spectra], dtype=bool)
+    lengths = np.array([len(spe.x) if ok else 0 for spe, ok in zip(spectra, present)], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    x = np.empty(offsets[-1], dtype=np.float64)
+    y = np.empty(offsets[-1], dtype=np.float64)
+    for i, (spe, ok) in enumerate(zip(spectra, present)):
+        if ok:
+            x[offsets[i]:offsets[i + 1]] = spe.x
+            y[offsets[i]:offsets[i + 1]] = spe.y
+    metadata = [_meta_dump(spe) if ok else "" for spe, ok in zip(spectra, present)]
+
+    with h5py.File(path, "a") as h5:
+        grp = h5.create_group(f"{key}_spectra")
+        chunks = True if offsets[-1] > 0 else None
+        grp.create_dataset("x", data=x, chunks=chunks)
+        grp.create_dataset("y", data=y, chunks=chunks)
+        grp.create_dataset("offsets", data=offsets)
+        grp.create_dataset("present", data=present)
+        grp.create_dataset("metadata", data=metadata, dtype=h5py.string_dtype())
+
+
+def _stringify_mixed(meta):
+    """Object columns as strings (missing values kept), for formats that need one type per column."""
+    meta = meta.copy()
+    for col in meta.columns[meta.dtypes == object]:
+        meta[col] = meta[col].map(lambda v: None if pd.isna(v) else str(v))
+    return meta
+
+
+def export_metadata(df, path, formats=()):
+    """Optional exports of the spectraframe next to ``path`` (``<stem>.<format>``).
+
+    ``parquet`` and ``feather`` hold the metadata table (no spectra); ``xlsx`` is the
+    frame as previously written by the task. Returns the written files.
+    """
+    stem = os.path.splitext(path)[0]
+    written = []
+    for fmt in formats:
+        out = f"{stem}.{fmt}"
+        if fmt == "xlsx":
+            df.to_excel(out, sheet_name="templates_read", index=False)
+        elif fmt in ("parquet", "feather"):
+            meta = df.drop(columns=[SPECTRUM_COL], errors="ignore").reset_index(drop=True)
+            writer = "to_parquet" if fmt == "parquet" else "to_feather"
+            try:
+                getattr(meta, writer)(out)
+            except ImportError:
+                # an export that is configured must be written
+                raise
+            except Exception:
+                # mixed-type columns (e.g. numbers and text in the same column)
+                getattr(_stringify_mixed(meta), writer)(out)
+        else:
+            raise ValueError(f"Unsupported export format {fmt}")
+        written.append(out)
+    return written
+
+
+class SpectraStore:
+    """Reader of a spectraframe HDF5 product with on-demand spectra.
+
+    ``frame`` is the metadata table; ``spectrum(label)`` loads the spectrum of
+    one row; ``read(rows)`` returns the selected rows with their ``spectrum``
+    column filled and ``query(**filters)`` does the same for the rows matching
+    the filters, evaluated in the store. With ``keep=False`` loaded spectra are
+    not kept by the store, so memory follows the rows currently in use.
+    """
+
+    def __init__(self, path, key="templates_read", keep=True):
+        self.path = path
+        self.key = key
+        self.keep = keep
+        self._h5 = None
+        self._frame = None
+        self._spectra = {}
+        self._legacy = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._h5 is not None:
+            self._h5.close()
+            self._h5 = None
+
+    @property
+    def legacy(self):
+        """True for files written by ``df.to_hdf`` with a pickled spectrum column."""
+        if self._legacy is None:
+            with h5py.File(self.path, "r") as h5:
+                self._legacy = f"{self.key}_spectra" not in h5
+        return self._legacy
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            frame = pd.read_hdf(self.path, key=self.key)
+            if self.legacy and SPECTRUM_COL in frame.columns:
+                self._spectra = frame[SPECTRUM_COL].to_dict()
+                frame = frame.drop(columns=[SPECTRUM_COL])
+            self._frame = frame
+        return self._frame
+
+    def _group(self):
+        if self._h5 is None:
+            self._h5 = h5py.File(self.path, "r")
+        return self._h5[f"{self.key}_spectra"]
+
+    def spectrum(self, label):
+        """Spectrum of the row with index ``label`` (``None`` if the row has none)."""
+        frame = self.frame
+        if label in self._spectra or self.legacy:
+            spe = self._spectra.get(label)
+            return spe if _is_spectrum(spe) else None
+        pos = frame.index.get_loc(label)
+        grp = self._group()
+        spe = None
+        if grp["present"][pos]:
+            start, end = grp["offsets"][pos:pos + 2]
+            meta = grp["metadata"][pos]
+            meta = json.loads(meta.decode() if isinstance(meta, bytes) else meta)
+            spe = Spectrum(x=grp["x"][start:end], y=grp["y"][start:end],
+                           metadata=meta if meta else None)
+        if self.keep:
+            self._spectra[label] = spe
+        return spe
+
+    def select(self, rows=None):
+        """Metadata rows selected by a boolean mask, a callable on the frame or index labels."""
+        frame = self.frame
+        if rows is None:
+            return frame
+        if callable(rows):
+            rows = rows(frame)
+        if isinstance(rows, (pd.Series, np.ndarray)) and rows.dtype == bool:
+            return frame.loc[rows]
+        return frame.loc[list(rows)]
+
+    def read(self, rows=None):
+        """Selected rows (see ``select``) with their spectra loaded."""
+        df = self.select(rows).copy()
+        df[SPECTRUM_COL] = pd.Series([self.spectrum(label) for label in df.index],
+                                     index=df.index, dtype=object)
+        return df
+
+    def positions(self, **filters):
+        """Row positions matching ``column=value`` (or ``column=[values]``) filters.
+
+        Filters on ``INDEX_COLS`` are evaluated by PyTables on the index table; ``None``
+        values are ignored.
+        """
+        where = _where(filters)
+        if not where or len(self.frame) == 0:
+            return np.arange(len(self.frame))
+        if self.legacy:
+            mask = np.ones(len(self.frame), dtype=bool)
+            for col, value in filters.items():
+                if value is None:
+                    continue
+                values = value if isinstance(value, (list, tuple, set, np.ndarray, pd.Index)) else [value]
+                cells = self.frame[col].map(_index_value)
+                mask &= cells.isin([_index_value(v) for v in values]).to_numpy()
+            return np.flatnonzero(mask)
+        index = pd.read_hdf(self.path, key=f"{self.key}_index", where=where, columns=["row"])
+        return index["row"].to_numpy()
+
+    def query(self, **filters):
+        """Rows matching the filters (see ``positions``) with their spectra loaded.
+
+        Example: ``store.query(background="BACKGROUND_SUBTRACTED", sample="Neon",
+        laser_wl=785, optical_path="OP2")``.
+        """
+        return self.read(self.frame.index[self.positions(**filters)])
+
+
+def read_spectraframe(path, key="templates_read", rows=None, **filters):
+    """Read a spectraframe product; only the spectra of the selected rows are loaded.
+
+    Rows are selected by ``rows`` (see ``SpectraStore.select``) or by column filters
+    evaluated in the store (see ``SpectraStore.positions``).
+    """
+    with SpectraStore(path, key=key) as store:
+        if filters:
+            return store.query(**filters)
+        return store.read(rows)
@@ -0,0 +1,199 @@
+"""Sweep of the X calibration variants (fit_ne_peaks × match_mode × interpolator).
+
+The pipeline builds one variant per run (``env.yaml``); comparing variants used
+to mean one full pipeline run each. ``run_sweep`` builds every requested
+variant of every (laser_wl, optical_path) group with ``spectracalibrate.calibrate_group``
+and scores it on the PST and CAL spectra of the group:
+
+- the sample peaks are fitted once per group, in the measured units, and each
+  variant maps the fitted centers through its model and matches them to the
+  reference lines with its own ``match_mode``;
+- the Neon peak fits go through ``spectrafitcache``, so a group's Neon peaks are
+  fitted by its first variant only. The first variants (and the sample fits)
+  run before the others for that reason; without a configured cache a
+  temporary one is used for the sweep.
+
+Variants run in a process pool, one variant per task, and are scored in the
+calling process.
+"""
+import dataclasses
+import logging
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+import pandas as pd
+from ramanchada2.protocols.calibration.xcalibration import fit_peaks, match_peaks
+from ramanchada2.spectrum import Spectrum
+
+import spectrafitcache
+from spectracalibrate import calibrate_group
+
+
+logger = logging.getLogger(__name__)
+
+# certified peak positions (cm-1), as in calibration_verify
+REFERENCE_PEAKS = {
+    "PST": {620.9: 16, 795.8: 10, 1001.4: 100, 1031.8: 27, 1155.3: 13, 1450.5: 8,
+            1583.1: 12, 1602.3: 28, 2852.4: 9, 2904.5: 13},
+    "CAL": {155.21: 1, 281.26: 1, 711.95: 1, 1085.91: 1, 1435.22: 1, 1748.91: 1},
+}
+SAMPLE_RANGE = (300, 3*1024 + 300)
+
+
+def variants(match_modes, interpolators, fit_ne_peaks=(True,)):
+    """``(fit_ne_peaks, match_mode, interpolator)`` combinations, fitted Neon peaks first."""
+    return list(product(sorted(set(fit_ne_peaks), reverse=True), match_modes, interpolators))
+
+
+def prepare_sample(spe, units):
+    """Sample spectrum as calibration_verify prepares it: trimmed, pedestal and baseline removed."""
+    if units == "cm-1":
+        spe = spe.trim_axes(method='x-axis', boundaries=SAMPLE_RANGE)
+    spe.y = spe.y - np.min(spe.y)
+    return spe.subtract_baseline_rc1_snip(niter=40)
+
+
+def fit_sample_peaks(samples):
+    """``{role: (positions dict, units)}`` of the fitted peaks of each sample spectrum."""
+    peaks = {}
+    for role, (spe, units) in samples.items():
+        try:
+            _, pos_dict = fit_peaks(prepare_sample(spe, units), {}, {}, profile="Gaussian", should_fit=True)
+            peaks[role] = (pos_dict, units)
+        except Exception as err:
+            logger.warning(f"{role}: {err}")
+    return peaks
+
+
+def calibrate_positions(calmodel, pos_dict, units):
+    """Peak positions mapped through ``calmodel``; positions it cannot map are dropped."""
+    calibrated = {}
+    for pos, amp in pos_dict.items():
+        spe = Spectrum(x=np.array([float(pos)]), y=np.array([1.0]))
+        x = float(calmodel.apply_calibration_x(spe, spe_units=units).x[0])
+        if np.isfinite(x):
+            calibrated[x] = amp
+    return calibrated
+
+
+def sample_errors(calmodel, pos_dict, units, ref, match_mode):
+    """Calibrated minus reference position (cm-1) of the matched sample peaks."""
+    calibrated = calibrate_positions(calmodel, pos_dict, units)
+    x, x_ref, _, _, _ = match_peaks(calibrated, ref, spe_units="cm-1", match_method=match_mode,
+                                    auto_reduce_degree=True)
+    return np.asarray(x, dtype=float) - np.asarray(x_ref, dtype=float)
+
+
+def neon_anchors(calmodel):
+    """``(matched, inliers)`` Neon peaks of the model's X calibration component."""
+    df = calmodel.components[0].matched_peaks
+    if df is None:
+        return 0, 0
+    inliers = int(df["inlier_mask"].astype(bool).sum()) if "inlier_mask" in df else len(df)
+    return len(df), inliers
+
+
+def calibrate_variant(group):
+    """``calibrate_group`` of one variant; returns ``(row, calmodel)``."""
+    row = {"laser_wl": group.laser_wl, "optical_path": group.optical_path,
+           "fit_ne_peaks": group.fit_neon_peaks, "match_mode": group.match_mode,
+           "interpolator": group.interpolator}
+    t0 = time.perf_counter()
+    result = calibrate_group(group)
+    row["t_calibrate_s"] = time.perf_counter() - t0
+    row["stage"] = result.stage
+    row["error"] = result.errors[-1].strip().splitlines()[-1] if result.errors else None
+    return row, (result.calmodel if result.stage == "si" else None)
+
+
+def score_variant(row, calmodel, sample_peaks):
+    """Add the Neon anchors and the PST/CAL errors of ``calmodel`` to ``row``."""
+    if calmodel is None:
+        return row
+    row["ne_matched"], row["ne_inliers"] = neon_anchors(calmodel)
+    row["si_zero_nm"] = float(calmodel.components[1].model)
+    for role, (pos_dict, units) in sample_peaks.items():
+        try:
+            err = sample_errors(calmodel, pos_dict, units, REFERENCE_PEAKS[role], row["match_mode"])
+            err = err[np.isfinite(err)]
+        except Exception:
+            logger.debug(traceback.format_exc())
+            err = np.array([])
+        row[f"{role.lower()}_n"] = len(err)
+        row[f"{role.lower()}_rmse"] = float(np.sqrt(np.mean(err ** 2))) if len(err) else np.nan
+    return row
+
+
+def _work(task):
+    kind, arg = task
+    t0 = time.perf_counter()
+    if kind == "samples":
+        return fit_sample_peaks(arg), time.perf_counter() - t0
+    return calibrate_variant(arg)
+
+
+def _run(jobs_by_group, pool):
+    # the first variant of each group fits its Neon peaks (into the fit cache)
+    # while the samples are fitted; the other variants then read them back
+    first = [(g, ("samples", {role: sample})) for g, (_, samples) in enumerate(jobs_by_group)
+             for role, sample in samples.items()]
+    first += [(g, ("variant", jobs[0])) for g, (jobs, _) in enumerate(jobs_by_group)]
+    sample_peaks = [{} for _ in jobs_by_group]
+    t_samples = [0.0] * len(jobs_by_group)
+    firsts = []
+    for (g, (kind, _)), out in zip(first, _map(pool, _work, [task for _, task in first])):
+        if kind == "samples":
+            sample_peaks[g].update(out[0])
+            t_samples[g] += out[1]
+        else:
+            firsts.append((g, out))
+    rows = []
+    for g, (row, calmodel) in firsts:
+        row["t_samples_s"] = t_samples[g]
+        rows.append(score_variant(row, calmodel, sample_peaks[g]))
+    rest = [(g, job) for g, (jobs, _) in enumerate(jobs_by_group) for job in jobs[1:]]
+    for (g, _), (row, calmodel) in zip(rest, _map(pool, _work, [("variant", job) for _, job in rest])):
+        rows.append(score_variant(row, calmodel, sample_peaks[g]))
+    return rows
+
+
+def _map(pool, fn, tasks):
+    return map(fn, tasks) if pool is None else pool.map(fn, tasks)
+
+
+def run_sweep(groups, samples, variant_list, workers=1):
+    """Results table of every variant in ``variant_list`` of every group.
+
+    ``groups`` are ``spectracalibrate.GroupJob`` templates (the variant fields are
+    replaced, models are not saved), ``samples`` map ``"PST"``/``"CAL"`` to the
+    group's ``(spectrum, units)``.
+    """
+    jobs_by_group = [
+        ([dataclasses.replace(group, fit_neon_peaks=fit, match_mode=match_mode,
+                              interpolator=interpolator, calmodels=None)
+          for fit, match_mode, interpolator in variant_list], group_samples)
+        for group, group_samples in zip(groups, samples)]
+    if not jobs_by_group or not variant_list:
+        return pd.DataFrame()
+
+    with tempfile.TemporaryDirectory(prefix="fitcache") as tmp:
+        cache_path = spectrafitcache.get_settings()["path"]
+        if cache_path is None:
+            cache_path = tmp
+            spectrafitcache.configure(tmp)
+        try:
+            if workers is None or workers <= 1:
+                rows = _run(jobs_by_group, None)
+            else:
+                with ProcessPoolExecutor(max_workers=workers, initializer=spectrafitcache.configure,
+                                         initargs=(cache_path,)) as pool:
+                    rows = _run(jobs_by_group, pool)
+        finally:
+            if cache_path == tmp:
+                spectrafitcache.configure(None)
+    columns = ["laser_wl", "optical_path", "fit_ne_peaks", "match_mode", "interpolator"]
+    return pd.DataFrame(rows).sort_values(columns, kind="stable", ignore_index=True)
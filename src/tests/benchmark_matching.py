@@ -0,0 +1,200 @@
+"""Time and accuracy of the peak matchers on synthetic Neon-like peak lists.
+
+For each size (10 to 2000 reference lines) a reference line list and a measured
+peak list are generated: the measured peaks are the reference lines under a
+smooth non-linear stretch plus an offset, with position noise, dropped lines
+and weak spurious peaks. Every matcher is timed (best of ``--repeat``) and
+scored against the known pairs:
+
+- the ``match_method`` values of ``xcalibration.match_peaks`` (assignment,
+  monotonic, dynamicp, argmin2d, cluster), with their inlier filters;
+- the local ``matchpeaks`` aligners, also in banded and lean
+  (``return_diagnostics=False``) mode.
+
+precision = correct pairs / returned pairs, recall = correct pairs / measured
+peaks that have a reference line. Results are written to ``<out>.json`` and
+``<out>.csv``. With a baseline file (``--update-baseline`` writes one) the run
+fails if a matcher is slower than ``--slowdown`` x its baseline time (and more
+than ``--min-delta`` s slower) or loses more than ``--accuracy-drop`` precision
+or recall. A matcher is skipped for the larger sizes once it exceeds
+``--max-seconds``.
+
+Run from ``src``:  python tests/benchmark_matching.py [--sizes 10 100 1000] [--repeat 3]
+"""
+import argparse
+import json
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+from ramanchada2.protocols.calibration.xcalibration import match_peaks
+
+import matchpeaks
+
+SIZES = (10, 25, 50, 100, 250, 500, 1000, 2000)
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_matching_baseline.json")
+
+
+def synthetic_neon(n_ref, seed=0, dropout=0.15, spurious=0.1):
+    """Reference lines ``{nm: intensity}``, measured peaks ``{position: intensity}`` and the true pairs.
+
+    Distortions scale with the median line spacing, so every size is equally hard.
+    """
+    rng = np.random.default_rng(seed)
+    ref = np.sort(rng.uniform(540, 720, n_ref))
+    ref_int = rng.lognormal(0, 1, n_ref)
+    step = np.median(np.diff(ref)) if n_ref > 1 else 1.0
+    u = (ref - ref.mean()) / (ref.max() - ref.min() + 1e-12)
+    # offset, linear and quadratic stretch, noise
+    measured = ref + step * (0.3 + 0.4 * u + 0.8 * u**2) + rng.normal(0, 0.05 * step, n_ref)
+    keep = rng.random(n_ref) > dropout
+    keep[np.argmax(ref_int)] = True
+    meas_int = ref_int * rng.uniform(0.7, 1.3, n_ref)
+    n_spurious = max(1, int(spurious * n_ref))
+    extra = rng.uniform(measured.min(), measured.max(), n_spurious)
+    extra_int = rng.uniform(0.01, 0.2, n_spurious) * np.median(ref_int)
+    spe = dict(zip(np.concatenate([measured[keep], extra]), np.concatenate([meas_int[keep], extra_int])))
+    truth = dict(zip(measured[keep], ref[keep]))
+    return dict(zip(ref, ref_int)), dict(sorted(spe.items())), truth
+
+
+def xcalibration_matcher(method):
+    def run(spe, ref):
+        x_spe, x_ref, _, _, _ = match_peaks(spe, ref, spe_units="nm", match_method=method)
+        return x_spe, x_ref
+    return run
+
+
+def matchpeaks_matcher(name, **kwargs):
+    aligner = getattr(matchpeaks, f"match_peaks_{name}")
+
+    def run(spe, ref):
+        out = aligner(np.array(list(spe)), np.array(list(ref)),
+                      measured_intensities=np.array(list(spe.values())), **kwargs)
+        return out[0], out[1]
+    return run
+
+
+def matchers():
+    """Name and ``run(spe_dict, ref_dict) -> (x_spe, x_ref)`` of every matcher."""
+    out = {method: xcalibration_matcher(method)
+           for method in ("assignment", "monotonic", "dynamicp", "argmin2d", "cluster")}
+    out["mp_1to1_skip"] = matchpeaks_matcher("1to1_skip")
+    out["mp_position_intensity"] = matchpeaks_matcher("position_intensity")
+    out["mp_auto_k"] = matchpeaks_matcher("auto_k")
+    out["mp_ready"] = matchpeaks_matcher("ready")
+    out["mp_ready_banded"] = matchpeaks_matcher("ready", banded=True)
+    out["mp_ready_lean"] = matchpeaks_matcher("ready", return_diagnostics=False)
+    return out
+
+
+def score(x_spe, x_ref, truth):
+    """``(precision, recall)`` of the returned pairs against the true pairs."""
+    correct = sum(1 for s, r in zip(np.asarray(x_spe, dtype=float), np.asarray(x_ref, dtype=float))
+                  if truth.get(s) == r)
+    precision = correct / len(x_spe) if len(x_spe) else 0.0
+    return precision, correct / len(truth)
+
+
+def run_benchmark(sizes=SIZES, repeat=3, seed=0, max_seconds=30.0, only=None):
+    rows = []
+    skipped = set()
+    print(f"{'Matcher':<24} | {'Lines':>5} | {'Time [s]':>9} | {'Prec':>5} | {'Recall':>6} | Details")
+    print("-" * 80)
+    for size in sizes:
+        ref, spe, truth = synthetic_neon(size, seed=seed + size)
+        for name, run in matchers().items():
+            if only and name not in only:
+                continue
+            row = {"matcher": name, "size": size, "peaks": len(spe)}
+            if name in skipped:
+                print(f"{name:<24} | {size:>5} | {'-':>9} | {'-':>5} | {'-':>6} | skipped (over {max_seconds} s)")
+                rows.append({**row, "status": "skipped"})
+                continue
+            try:
+                times = []
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    x_spe, x_ref = run(spe, ref)
+                    times.append(time.perf_counter() - t0)
+                    if times[-1] > max_seconds:
+                        break
+                precision, recall = score(x_spe, x_ref, truth)
+                row.update(status="ok", time_s=min(times), precision=precision, recall=recall,
+                           matched=len(x_spe))
+                print(f"{name:<24} | {size:>5} | {row['time_s']:>9.4f} | {precision:>5.2f} | {recall:>6.2f} | "
+                      f"N={len(x_spe)}")
+                if min(times) > max_seconds:
+                    skipped.add(name)
+            except Exception as err:
+                row.update(status="error", error=str(err))
+                print(f"{name:<24} | {size:>5} | {'ERR':>9} | {'-':>5} | {'-':>6} | {err}")
+            rows.append(row)
+    return rows
+
+
+def compare(rows, baseline, slowdown=1.5, min_delta=0.01, accuracy_drop=0.02):
+    """Regressions of ``rows`` against the baseline rows, as messages."""
+    reference = {(r["matcher"], r["size"]): r for r in baseline}
+    problems = []
+    for row in rows:
+        base = reference.get((row["matcher"], row["size"]))
+        if base is None or base.get("status") != "ok":
+            continue
+        label = f"{row['matcher']} @ {row['size']}"
+        if row.get("status") != "ok":
+            problems.append(f"{label}: {row.get('status')} {row.get('error', '')}".strip())
+            continue
+        if row["time_s"] > slowdown * base["time_s"] and row["time_s"] - base["time_s"] > min_delta:
+            problems.append(f"{label}: {row['time_s']:.4f} s, baseline {base['time_s']:.4f} s")
+        for metric in ("precision", "recall"):
+            if row[metric] < base[metric] - accuracy_drop:
+                problems.append(f"{label}: {metric} {row[metric]:.3f}, baseline {base[metric]:.3f}")
+    return problems
+
+
+def write_results(rows, out):
+    if os.path.dirname(out):
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(f"{out}.json", "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=1)
+    pd.DataFrame(rows).to_csv(f"{out}.csv", index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--matchers", nargs="+", default=None, help="only these matchers")
+    parser.add_argument("--max-seconds", type=float, default=30.0)
+    parser.add_argument("--out", default="benchmark_matching", help="results prefix (.json and .csv)")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="write the results as the baseline")
+    parser.add_argument("--slowdown", type=float, default=1.5)
+    parser.add_argument("--min-delta", type=float, default=0.01)
+    parser.add_argument("--accuracy-drop", type=float, default=0.02)
+    args = parser.parse_args()
+
+    rows = run_benchmark(args.sizes, args.repeat, args.seed, args.max_seconds, args.matchers)
+    write_results(rows, args.out)
+    print(f"\nresults: {args.out}.json, {args.out}.csv")
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=1)
+        print(f"baseline written: {args.baseline}")
+    elif os.path.isfile(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = compare(rows, json.load(f), args.slowdown, args.min_delta, args.accuracy_drop)
+        if problems:
+            print("\nREGRESSIONS against " + args.baseline)
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}")
+    else:
+        print(f"no baseline at {args.baseline} (write one with --update-baseline)")
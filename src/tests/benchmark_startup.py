@@ -0,0 +1,84 @@
+"""Import (startup) time of the pipeline tasks.
+
+Every task of pipeline.yaml runs in a fresh kernel, so the module-level imports of
+its script are paid once per task. For each task this runs the script's
+module-level imports in a fresh interpreter and reports the wall time and the
+slowest top-level modules (from ``python -X importtime``).
+
+Run from ``src``:  python tests/benchmark_startup.py [--repeat 3] [--top 5]
+"""
+import argparse
+import ast
+import os.path
+import re
+import subprocess
+import sys
+import time
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def task_sources(pipeline=os.path.join(SRC, "pipeline.yaml")):
+    """Task scripts of the pipeline, in order of first appearance."""
+    with open(pipeline, "r", encoding="utf-8") as f:
+        sources = re.findall(r"^\s*-?\s*source:\s*(\S+\.py)\s*$", f.read(), flags=re.M)
+    return list(dict.fromkeys(sources))
+
+
+def module_imports(script):
+    """Source of the module-level import statements of ``script``."""
+    with open(script, "r", encoding="utf-8") as f:
+        source = f.read()
+    tree = ast.parse(source)
+    return "\n".join(ast.get_source_segment(source, node) for node in tree.body
+                     if isinstance(node, (ast.Import, ast.ImportFrom)))
+
+
+def time_imports(code, cwd=SRC):
+    """Wall time of ``code`` in a fresh interpreter and the cumulative time (s) per top-level module."""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=cwd, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    modules = {}
+    for line in result.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        match = re.match(r"import time:\s+\d+\s*\|\s*(\d+)\s*\|( *)(\S+)", line)
+        if match and len(match.group(2)) == 1:
+            modules[match.group(3)] = int(match.group(1)) / 1e6
+    return wall, modules
+
+
+def run_benchmark(repeat=3, top=5):
+    baseline, startup_modules = time_imports("pass")
+    print(f"interpreter startup: {baseline:.2f} s")
+    print(f"{'Task':<30} | {'Wall [s]':>8} | Slowest imports [s]")
+    print("-" * 100)
+    rows = []
+    for source in task_sources():
+        code = module_imports(os.path.join(SRC, source))
+        try:
+            runs = [time_imports(code) for _ in range(repeat)]
+        except RuntimeError as err:
+            print(f"{source:<30} | {'-':>8} | ERROR {err}")
+            continue
+        wall, modules = min(runs, key=lambda run: run[0])
+        # modules imported by the interpreter itself are not the task's
+        slowest = sorted(((m, t) for m, t in modules.items() if m not in startup_modules),
+                         key=lambda item: -item[1])[:top]
+        print(f"{source:<30} | {wall:>8.2f} | " + ", ".join(f"{m} {t:.2f}" for m, t in slowest))
+        rows.append((source, wall))
+    if rows:
+        print("-" * 100)
+        print(f"{'total':<30} | {sum(wall for _, wall in rows):>8.2f} |")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per task, the fastest is reported")
+    parser.add_argument("--top", type=int, default=5, help="slowest modules listed per task")
+    args = parser.parse_args()
+    run_benchmark(repeat=args.repeat, top=args.top)
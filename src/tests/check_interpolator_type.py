@@ -15,9 +15,9 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import ramanchada2.misc.constants as rc2const
 from ramanchada2.protocols.calibration.calibration_model import CalibrationModel
-import pandas as pd
 
 from utils import load_config, get_config_findkw, get_config_units
+from spectrastore import read_spectraframe
 from calib_paths import config_root, config_output, config_templates
 
 KEY = "P6_0901"
@@ -26,8 +26,8 @@ KEY = "P6_0901"
 def get_neon_op1():
     import glob
     hits = glob.glob(os.path.join(config_output(), KEY, "spectraframe_load*.h5"))
-    df = pd.read_hdf(hits[0], key="templates_read")
-    df = df.loc[df["background"] == "BACKGROUND_SUBTRACTED"]
+    df = read_spectraframe(hits[0], key="templates_read",
+                           background="BACKGROUND_SUBTRACTED")
     grp = df[(df["optical_path"] == "OP1") & (df["sample"] == "Neon")]
     hdr = grp.loc[grp["overexposed"] == "HDR_MERGE"]
     spe = (hdr if not hdr.empty else grp)["spectrum"].iloc[0]
@@ -26,6 +26,7 @@ from ramanchada2.protocols.calibration.calibration_model import CalibrationModel
 from ramanchada2.spectrum import Spectrum
 
 from utils import load_config, get_config_findkw, get_config_units
+from spectrastore import read_spectraframe
 from calib_paths import load_env, config_root, config_output, config_templates
 
 _ENV = load_env()
@@ -42,7 +43,7 @@ SI_REF = 520.45
 
 def load_df(key):
     h5 = glob.glob(os.path.join(config_output(), key, "spectraframe_load*.h5"))[0]
-    return pd.read_hdf(h5, key="templates_read")
+    return read_spectraframe(h5, key="templates_read")
 
 
 def build_model(op_data, laser, cfg, key, ne_units, si_units,
@@ -0,0 +1,705 @@
+"""Check the array DP engine of matchpeaks against the cell-by-cell loops it replaced.
+
+The reference implementations below are the loop versions of the aligners; the
+engine must return identical pairs, DP tables and paths, on random peak lists
+with and without intensities, ties (integer positions) and dropouts/spurious
+peaks. The banded and return_diagnostics=False modes are checked against the
+default one, and match_peaks_batch against the single-spectrum aligners. Also
+prints the speed-up per size, time and memory of the banded mode, the speed-up
+of the batch and the memory saved without diagnostics.
+
+Usage:
+    uv run python tests/validate_matchpeaks_dp.py
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import matchpeaks
+
+
+def loop_1to1_skip(measured_pixels, ref_wavelengths,
+                    measured_intensities=None, ref_intensities=None,
+                    gap_penalty=None, k=0.75, tolerance=0.3,
+                    alpha=1.0, beta=1.0):
+    """
+    One-to-one monotonic alignment with optional skipping.
+
+    Match cost = Euclidean distance in (position, intensity) space:
+        sqrt( (Δpos)^2 + (Δint)^2 )
+
+    Intensity normalization is automatically handled.
+    Strength parameters:
+        alpha : scales match cost
+        beta  : inflates skip penalties for strong peaks
+    """
+
+    mp = np.array(measured_pixels, dtype=float)
+    rw = np.array(ref_wavelengths, dtype=float)
+
+    n, m = len(mp), len(rw)
+
+    # ---- position normalization ----
+    mp_norm = (mp - mp.min()) / (mp.max() - mp.min()) if n > 1 else np.zeros_like(mp)
+    rw_norm = (rw - rw.min()) / (rw.max() - rw.min()) if m > 1 else np.zeros_like(rw)
+
+    # ---- intensity normalization ----
+    mi_norm = None
+    ri_norm = None
+    if measured_intensities is not None:
+        mi_norm = np.array(measured_intensities, dtype=float)
+        mi_norm = mi_norm / (mi_norm.max() + 1e-12)
+    if ref_intensities is not None:
+        ri_norm = np.array(ref_intensities, dtype=float)
+        ri_norm = ri_norm / (ri_norm.max() + 1e-12)
+
+    # ---- default gap penalty ----
+    if gap_penalty is None:
+        gap_penalty = k * np.median(np.abs(np.diff(rw_norm))) if m > 1 else k
+
+    # ---- DP table ----
+    DP = np.full((n+1, m+1), np.inf)
+    DP[0,0] = 0.0
+
+    # ========================= DP LOOP =========================
+    for i in range(n+1):
+        for j in range(m+1):
+
+            # ----- skip measured -----
+            if i > 0:
+                gp = gap_penalty
+                if mi_norm is not None:
+                    gp *= (1 + beta * mi_norm[i-1])
+                DP[i,j] = min(DP[i,j], DP[i-1,j] + gp)
+
+            # ----- skip reference -----
+            if j > 0:
+                gp = gap_penalty
+                if ri_norm is not None:
+                    gp *= (1 + beta * ri_norm[j-1])
+                DP[i,j] = min(DP[i,j], DP[i,j-1] + gp)
+
+            # ----- match (i,j) -----
+            if i > 0 and j > 0:
+
+                # Δ position
+                dp = mp_norm[i-1] - rw_norm[j-1]
+
+                # Δ intensity if available
+                if mi_norm is not None and ri_norm is not None:
+                    di = mi_norm[i-1] - ri_norm[j-1]
+                else:
+                    # fallback to position-only metric
+                    di = 0.0
+
+                # Euclidean cost
+                cost = np.sqrt(dp*dp + di*di)
+
+                # hard tolerance on position mismatches
+                if abs(dp) > tolerance:
+                    cost = 1.0
+
+                # scale match cost
+                cost *= 1.0 / (1 + alpha)
+
+                DP[i,j] = min(DP[i,j], DP[i-1,j-1] + cost)
+
+    # ========================= BACKTRACK =========================
+    i, j = n, m
+    pairs = []
+    path = []
+
+    while i > 0 or j > 0:
+
+        # attempt match
+        if i > 0 and j > 0:
+            dp = mp_norm[i-1] - rw_norm[j-1]
+
+            if mi_norm is not None and ri_norm is not None:
+                di = mi_norm[i-1] - ri_norm[j-1]
+            else:
+                di = 0.0
+
+            cost = np.sqrt(dp*dp + di*di)
+            if abs(dp) > tolerance:
+                cost = 1.0
+            cost *= 1.0 / (1 + alpha)
+
+            if DP[i,j] == DP[i-1,j-1] + cost:
+                pairs.append((mp[i-1], rw[j-1]))
+                path.append((i,j))
+                i -= 1
+                j -= 1
+                continue
+
+        # skip measured
+        if i > 0:
+            gp = gap_penalty
+            if mi_norm is not None:
+                gp *= (1 + beta * mi_norm[i-1])
+            if DP[i,j] == DP[i-1,j] + gp:
+                i -= 1
+                continue
+
+        # skip reference
+        if j > 0:
+            gp = gap_penalty
+            if ri_norm is not None:
+                gp *= (1 + beta * ri_norm[j-1])
+            if DP[i,j] == DP[i,j-1] + gp:
+                j -= 1
+                continue
+
+    path.append((0,0))
+    path = path[::-1]
+    pairs.reverse()
+
+    mp_out, rw_out = zip(*pairs) if pairs else ([], [])
+
+    return np.array(mp_out), np.array(rw_out), pairs, DP, path
+
+
+def loop_position_intensity(measured_pixels, ref_wavelengths,
+                            measured_intensities=None,
+                            k=1.0, alpha=1.0, tolerance=None):
+    """
+    Match measured peaks to reference peaks:
+    - Match cost based on position, slightly favoring strong measured peaks
+    - Skip cost depends only on measured intensity
+    """
+    mp = np.array(measured_pixels, dtype=float)
+    rw = np.array(ref_wavelengths, dtype=float)
+    n, m = len(mp), len(rw)
+
+    # normalize measured intensity
+    if measured_intensities is not None:
+        mp_i = np.array(measured_intensities, dtype=float)
+        mp_i = mp_i / (mp_i.max() + 1e-12)
+    else:
+        mp_i = np.ones(n)
+
+    DP = np.full((n+1, m+1), np.inf)
+    DP[0,0] = 0.0
+
+    # Fill DP table
+    for i in range(n+1):
+        for j in range(m+1):
+            # Skip measured
+            if i > 0:
+                DP[i,j] = min(DP[i,j], DP[i-1,j] + k * mp_i[i-1])
+            # Skip reference
+            if j > 0:
+                DP[i,j] = min(DP[i,j], DP[i,j-1])
+            # Match
+            if i > 0 and j > 0:
+                pos_diff = abs(mp[i-1] - rw[j-1])
+                if tolerance is None or pos_diff <= tolerance:
+                    cost = pos_diff / (1 + alpha * mp_i[i-1])
+                else:
+                    cost = np.inf
+                DP[i,j] = min(DP[i,j], DP[i-1,j-1] + cost)
+
+    # Backtrack
+    i, j = n, m
+    pairs = []
+    path = [(i,j)]
+    while i > 0 or j > 0:
+        if i > 0 and j > 0:
+            pos_diff = abs(mp[i-1] - rw[j-1])
+            if tolerance is None or pos_diff <= tolerance:
+                cost = pos_diff / (1 + alpha * mp_i[i-1])
+            else:
+                cost = np.inf
+            if DP[i,j] == DP[i-1,j-1] + cost:
+                pairs.append((mp[i-1], rw[j-1]))
+                i -= 1
+                j -= 1
+                path.append((i,j))
+                continue
+        if i > 0 and DP[i,j] == DP[i-1,j] + k * mp_i[i-1]:
+            i -= 1
+            path.append((i,j))
+            continue
+        if j > 0 and DP[i,j] == DP[i,j-1]:
+            j -= 1
+            path.append((i,j))
+            continue
+
+    pairs.reverse()
+    path = path[::-1]
+    mp_out, rw_out = zip(*pairs) if pairs else ([], [])
+    return np.array(mp_out), np.array(rw_out), pairs, DP, path
+
+
+def loop_auto_k(measured_pixels, ref_wavelengths,
+                  measured_intensities=None,
+                  alpha=1.0, tolerance=None):
+    """
+    Monotonic one-to-one peak alignment with:
+    - Match cost based on normalized position, slightly favoring strong measured peaks
+    - Skip cost depends only on measured intensity
+    - Automatic skip weight k
+    - Proper tolerance handling
+    """
+    mp = np.array(measured_pixels, dtype=float)
+    rw = np.array(ref_wavelengths, dtype=float)
+    n, m = len(mp), len(rw)
+
+    # Normalize positions to [0,1]
+    mp_p = (mp - mp.min()) / (mp.max() - mp.min()) if n > 1 else np.zeros_like(mp)
+    rw_p = (rw - rw.min()) / (rw.max() - rw.min()) if m > 1 else np.zeros_like(rw)
+
+    # Normalize measured intensity
+    if measured_intensities is not None:
+        mp_i = np.array(measured_intensities, dtype=float)
+        mp_i = mp_i / (mp_i.max() + 1e-12)
+    else:
+        mp_i = np.ones(n)
+
+    # Automatic skip weight based on typical normalized step
+    if m > 1:
+        delta_pos = np.median(np.diff(np.sort(rw_p)))
+    else:
+        delta_pos = 1.0
+    k = delta_pos / 0.5
+
+    # Large cost for out-of-tolerance matches
+    large_penalty = 10 * delta_pos
+
+    # DP table
+    DP = np.full((n+1, m+1), np.inf)
+    DP[0,0] = 0.0
+
+    # Fill DP table
+    for i in range(n+1):
+        for j in range(m+1):
+            # Skip measured
+            if i > 0:
+                DP[i,j] = min(DP[i,j], DP[i-1,j] + k * mp_i[i-1])
+            # Skip reference (free)
+            if j > 0:
+                DP[i,j] = min(DP[i,j], DP[i,j-1])
+            # Match
+            if i > 0 and j > 0:
+                pos_diff = abs(mp_p[i-1] - rw_p[j-1])
+                if tolerance is None or pos_diff <= tolerance:
+                    cost = pos_diff / (1 + alpha * mp_i[i-1])
+                else:
+                    cost = large_penalty
+                DP[i,j] = min(DP[i,j], DP[i-1,j-1] + cost)
+
+    # Backtrack
+    i, j = n, m
+    pairs = []
+    path = [(i,j)]
+    while i > 0 or j > 0:
+        if i > 0 and j > 0:
+            pos_diff = abs(mp_p[i-1] - rw_p[j-1])
+            if tolerance is None or pos_diff <= tolerance:
+                cost = pos_diff / (1 + alpha * mp_i[i-1])
+            else:
+                cost = large_penalty
+            if DP[i,j] == DP[i-1,j-1] + cost:
+                pairs.append((mp[i-1], rw[j-1]))
+                i -= 1
+                j -= 1
+                path.append((i,j))
+                continue
+        if i > 0 and DP[i,j] == DP[i-1,j] + k * mp_i[i-1]:
+            i -= 1
+            path.append((i,j))
+            continue
+        if j > 0 and DP[i,j] == DP[i,j-1]:
+            j -= 1
+            path.append((i,j))
+            continue
+
+    pairs.reverse()
+    path = path[::-1]
+    mp_out, rw_out = zip(*pairs) if pairs else ([], [])
+    return np.array(mp_out), np.array(rw_out), pairs, DP, path, k
+
+
+def loop_ready(measured_pixels, ref_wavelengths,
+               measured_intensities=None,
+               alpha=1.0, gamma=2.0,
+               skip_baseline=0.02, tolerance=None,
+               normalize=False):
+    """
+    Monotonic one-to-one peak alignment using dynamic programming.
+    """
+    mp = np.array(measured_pixels, dtype=float)
+    rw = np.array(ref_wavelengths, dtype=float)
+    n, m = len(mp), len(rw)
+
+    # Normalize positions to [0,1]
+    if normalize:
+        mp_p = (mp - mp.min()) / (mp.max() - mp.min()) if n > 1 else np.zeros_like(mp)
+        rw_p = (rw - rw.min()) / (rw.max() - rw.min()) if m > 1 else np.zeros_like(rw)
+    else:
+        mp_p = mp
+        rw_p = rw
+    # Normalize measured intensity
+    if measured_intensities is not None:
+        mp_i = np.array(measured_intensities, dtype=float)
+        mp_i = mp_i / (mp_i.max() + 1e-12)
+    else:
+        mp_i = np.ones(n)
+
+    # Automatic skip weight based on reference median step
+    if m > 1:
+        delta_pos = np.median(np.diff(np.sort(rw_p)))
+    else:
+        delta_pos = 1.0
+    k = delta_pos / 0.5
+
+    # Set default tolerance if not provided
+    if tolerance is None and m > 1:
+        tolerance = delta_pos
+
+    # Large penalty for out-of-tolerance matches
+    large_penalty = 10 * delta_pos
+
+    # DP table
+    DP = np.full((n+1, m+1), np.inf)
+    DP[0,0] = 0.0
+
+    # Fill DP table
+    for i in range(n+1):
+        for j in range(m+1):
+            # Skip measured
+            if i > 0:
+                DP[i,j] = min(DP[i,j], DP[i-1,j] + k * mp_i[i-1] + skip_baseline)
+            # Skip reference (free)
+            if j > 0:
+                DP[i,j] = min(DP[i,j], DP[i,j-1])
+            # Match
+            if i > 0 and j > 0:
+                pos_diff = abs(mp_p[i-1] - rw_p[j-1])
+                if tolerance is None or pos_diff <= tolerance:
+                    cost = pos_diff / (1 + alpha * mp_i[i-1])**gamma
+                else:
+                    cost = large_penalty
+                DP[i,j] = min(DP[i,j], DP[i-1,j-1] + cost)
+
+    # Backtrack to get matched pairs
+    i, j = n, m
+    pairs = []
+    path = [(i,j)]
+    while i > 0 or j > 0:
+        if i > 0 and j > 0:
+            pos_diff = abs(mp_p[i-1] - rw_p[j-1])
+            if tolerance is None or pos_diff <= tolerance:
+                cost = pos_diff / (1 + alpha * mp_i[i-1])**gamma
+            else:
+                cost = large_penalty
+            if DP[i,j] == DP[i-1,j-1] + cost:
+                pairs.append((mp[i-1], rw[j-1]))
+                i -= 1
+                j -= 1
+                path.append((i,j))
+                continue
+        if i > 0 and DP[i,j] == DP[i-1,j] + k * mp_i[i-1] + skip_baseline:
+            i -= 1
+            path.append((i,j))
+            continue
+        if j > 0 and DP[i,j] == DP[i,j-1]:
+            j -= 1
+            path.append((i,j))
+            continue
+
+    pairs.reverse()
+    path = path[::-1]
+    mp_out, rw_out = zip(*pairs) if pairs else ([], [])
+    return np.array(mp_out), np.array(rw_out), pairs, DP, path, k
+
+
+def random_case(rng, n_ref, integer=False):
+    """Reference lines, and measured peaks: stretched, shifted, some dropped, some spurious."""
+    ref = np.sort(rng.uniform(500, 700, n_ref))
+    if integer:
+        ref = np.unique(np.round(ref))
+    keep = rng.random(len(ref)) > 0.15
+    measured = ref[keep] * rng.uniform(0.98, 1.02) + rng.normal(0, 0.3, keep.sum()) + rng.uniform(-5, 5)
+    spurious = rng.uniform(measured.min(), measured.max(), max(1, len(ref) // 10))
+    measured = np.sort(np.concatenate([measured, spurious]))
+    if integer:
+        measured = np.unique(np.round(measured))
+    return measured, ref, rng.random(len(measured)), rng.random(len(ref))
+
+
+def same(a, b):
+    """Outputs are identical: arrays bit for bit (nan/inf included), lists element by element."""
+    if len(a) != len(b):
+        return False
+    for x, y in zip(a, b):
+        if isinstance(x, np.ndarray) or isinstance(y, np.ndarray):
+            x, y = np.asarray(x), np.asarray(y)
+            if x.shape != y.shape:
+                return False
+            if not np.array_equal(x, y, equal_nan=True):
+                return False
+        elif x != y:
+            return False
+    return True
+
+
+CASES = {
+    "match_peaks_1to1_skip": (loop_1to1_skip, [
+        lambda mp, rw, mi, ri: ((mp, rw), {}),
+        lambda mp, rw, mi, ri: ((mp, rw), dict(measured_intensities=mi, ref_intensities=ri)),
+        lambda mp, rw, mi, ri: ((mp, rw), dict(measured_intensities=mi, tolerance=0.05, beta=2.0)),
+        lambda mp, rw, mi, ri: ((mp, rw), dict(ref_intensities=ri, gap_penalty=0.1, alpha=0.5)),
+    ]),
+    "match_peaks_position_intensity": (loop_position_intensity, [
+        lambda mp, rw, mi, ri: ((mp, rw), {}),
+        lambda mp, rw, mi, ri: ((mp, rw), dict(measured_intensities=mi, tolerance=3.0)),
+        lambda mp, rw, mi, ri: ((mp, rw), dict(measured_intensities=mi, k=0.2, alpha=0.5, tolerance=8.0)),
+    ]),
+    "match_peaks_auto_k": (loop_auto_k, [
+        lambda mp, rw, mi, ri: ((mp, rw), {}),
+        lambda mp, rw, mi, ri: ((mp, rw), dict(measured_intensities=mi, tolerance=0.02)),
+    ]),
+    "match_peaks_ready": (loop_ready, [
+        lambda mp, rw, mi, ri: ((mp, rw), {}),
+        lambda mp, rw, mi, ri: ((mp, rw), dict(measured_intensities=mi, tolerance=3.0)),
+        lambda mp, rw, mi, ri: ((mp, rw), dict(measured_intensities=mi, normalize=True, gamma=1.0)),
+    ]),
+}
+
+# banded runs of the aligners, with the tolerance the band is built from
+BANDED = {
+    "match_peaks_1to1_skip": dict(tolerance=0.02),
+    "match_peaks_position_intensity": dict(tolerance=3.0),
+    "match_peaks_auto_k": dict(tolerance=0.02),
+    "match_peaks_ready": dict(tolerance=3.0),
+}
+
+
+def check(seed=0, repeat=40):
+    rng = np.random.default_rng(seed)
+    failures = 0
+    for name, (loop, variants) in CASES.items():
+        fast = getattr(matchpeaks, name)
+        for r in range(repeat):
+            mp, rw, mi, ri = random_case(rng, int(rng.integers(2, 60)), integer=r % 3 == 0)
+            for make in variants:
+                args, kwargs = make(mp, rw, mi, ri)
+                if not same(loop(*args, **kwargs), fast(*args, **kwargs)):
+                    failures += 1
+                    print(f"MISMATCH {name} case {r} {sorted(kwargs)}")
+        print(f"{name:32s} {repeat * len(variants)} cases checked")
+    return failures
+
+
+def check_banded(seed=2, repeat=40):
+    """Banded against dense pairs.
+
+    Only position_intensity must agree always (out-of-tolerance matches cost inf
+    there); the others may use penalized out-of-tolerance matches in dense mode,
+    which the band excludes, so their differences are only counted.
+    """
+    rng = np.random.default_rng(seed)
+    failures = 0
+    for name, kwargs in BANDED.items():
+        fn = getattr(matchpeaks, name)
+        differ = 0
+        for r in range(repeat):
+            mp, rw, mi, _ = random_case(rng, int(rng.integers(2, 200)), integer=r % 3 == 0)
+            dense = fn(mp, rw, measured_intensities=mi, **kwargs)
+            banded = fn(mp, rw, measured_intensities=mi, banded=True, **kwargs)
+            if dense[2] != banded[2]:
+                differ += 1
+            end = banded[3][len(mp), len(rw)]
+            if name == "match_peaks_position_intensity" and (dense[2] != banded[2] or end != dense[3][-1, -1]):
+                failures += 1
+                print(f"MISMATCH banded {name} case {r}")
+        print(f"{name:32s} banded: {differ} of {repeat} pair lists differ from dense")
+    try:
+        matchpeaks.match_peaks_position_intensity([2, 1], [1, 2], tolerance=1, banded=True)
+        failures += 1
+        print("unsorted positions accepted by the banded mode")
+    except ValueError:
+        pass
+    return failures
+
+
+def check_ties(seed=8, repeat=200):
+    """ready on integer positions and intensities, where skip and match costs tie.
+
+    The skip of a measured peak adds k * intensity, then skip_baseline; summing
+    the two first changes the last bits and so which of two tied paths wins.
+    """
+    failures = 0
+    mp = [5, 10, 12, 14, 20, 22, 25, 27, 28, 29, 29, 33, 37, 38]
+    rw = [8, 13, 15, 34]
+    mi = [1, 2, 1, 1, 3, 1, 4, 2, 3, 3, 4, 2, 2, 4]
+    if list(loop_ready(mp, rw, measured_intensities=mi)[0]) != [10, 14, 20, 38]:
+        failures += 1
+        print("ties: the loop no longer matches 10, 14, 20, 38")
+    cases = [(mp, rw, mi)]
+    rng = np.random.default_rng(seed)
+    for _ in range(repeat):
+        n = int(rng.integers(2, 16))
+        cases.append((np.sort(rng.integers(0, 40, n)), np.sort(rng.integers(0, 40, int(rng.integers(2, 6)))),
+                      rng.integers(1, 5, n)))
+    for r, (mp, rw, mi) in enumerate(cases):
+        expected = loop_ready(mp, rw, measured_intensities=mi)
+        lean = matchpeaks.match_peaks_ready(mp, rw, measured_intensities=mi, return_diagnostics=False)
+        batch = matchpeaks.match_peaks_batch([mp, mp[:-1]], rw, [mi, mi[:-1]], method="ready")
+        if not (same(expected, matchpeaks.match_peaks_ready(mp, rw, measured_intensities=mi))
+                and same(expected[:3], lean[:3]) and same(expected, batch[0])):
+            failures += 1
+            print(f"MISMATCH ties match_peaks_ready case {r}")
+    print(f"{'match_peaks_ready':32s} {len(cases)} tie cases checked")
+    return failures
+
+
+def check_empty():
+    """No measured or no reference peaks: the loops' empty results, single and batch."""
+    failures = 0
+    ref = np.array([500.0, 600.0])
+    for name, (loop, _) in CASES.items():
+        fn = getattr(matchpeaks, name)
+        method = name[len("match_peaks_"):]
+        for mp, rw in ((np.array([]), ref), (ref + 1, np.array([])), (np.array([]), np.array([]))):
+            expected = loop(mp, rw)
+            lean = fn(mp, rw, return_diagnostics=False)
+            batch = matchpeaks.match_peaks_batch([mp, ref + 1, mp], rw, method=method)
+            alone = matchpeaks.match_peaks_batch([mp], rw, method=method)
+            if not (same(expected, fn(mp, rw)) and same(expected[:3], lean[:3])
+                    and all(same(expected, result) for result in (batch[0], batch[2], alone[0]))):
+                failures += 1
+                print(f"MISMATCH empty {name} {len(mp)}x{len(rw)}")
+        print(f"{name:32s} empty inputs checked")
+    return failures
+
+
+def check_lean(seed=6, repeat=20):
+    """return_diagnostics=False: same pairs (and k), no DP and path."""
+    rng = np.random.default_rng(seed)
+    failures = 0
+    for name, (_, variants) in CASES.items():
+        fn = getattr(matchpeaks, name)
+        for r in range(repeat):
+            mp, rw, mi, ri = random_case(rng, int(rng.integers(2, 80)), integer=r % 3 == 0)
+            for make in variants:
+                args, kwargs = make(mp, rw, mi, ri)
+                full = fn(*args, **kwargs)
+                lean = fn(*args, return_diagnostics=False, **kwargs)
+                if full[2] != lean[2] or lean[3] is not None or lean[4] is not None or full[5:] != lean[5:]:
+                    failures += 1
+                    print(f"MISMATCH lean {name} case {r} {sorted(kwargs)}")
+        print(f"{name:32s} {repeat * len(variants)} lean cases checked")
+    return failures
+
+
+def check_batch(seed=4, repeat=10, spectra=8):
+    """match_peaks_batch against the single-spectrum aligners, spectra of different lengths."""
+    rng = np.random.default_rng(seed)
+    failures = 0
+    for name, (_, variants) in CASES.items():
+        fn = getattr(matchpeaks, name)
+        method = name[len("match_peaks_"):]
+        for r in range(repeat):
+            rw = random_case(rng, int(rng.integers(2, 60)))[1]
+            cases = [random_case(rng, len(rw)) for _ in range(spectra)]
+            for make in variants:
+                kwargs = make(cases[0][0], rw, cases[0][2], cases[0][3])[1]
+                if "measured_intensities" in kwargs:
+                    kwargs.pop("measured_intensities")
+                    mis = [mi for _, _, mi, _ in cases]
+                else:
+                    mis = None
+                batch = matchpeaks.match_peaks_batch([mp for mp, _, _, _ in cases], rw, mis,
+                                                     method=method, **kwargs)
+                for b, (mp, _, mi, _) in enumerate(cases):
+                    single = fn(mp, rw, measured_intensities=None if mis is None else mi, **kwargs)
+                    if not same(single, batch[b]):
+                        failures += 1
+                        print(f"MISMATCH batch {name} case {r} spectrum {b} {sorted(kwargs)}")
+        print(f"{name:32s} {repeat * len(variants)} batches of {spectra} checked")
+    return failures
+
+
+def timing(sizes=(50, 200, 500), seed=1):
+    rng = np.random.default_rng(seed)
+    print(f"\n{'aligner':32s} {'n x m':>11s} {'loop s':>9s} {'array s':>9s} {'speed-up':>9s}")
+    for name, (loop, _) in CASES.items():
+        fast = getattr(matchpeaks, name)
+        for size in sizes:
+            mp, rw, mi, _ = random_case(rng, size)
+            t0 = time.perf_counter()
+            loop(mp, rw, measured_intensities=mi)
+            t_loop = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            fast(mp, rw, measured_intensities=mi)
+            t_fast = time.perf_counter() - t0
+            print(f"{name:32s} {len(mp):>5d}x{len(rw):<5d} {t_loop:9.3f} {t_fast:9.4f} {t_loop / t_fast:8.0f}x")
+
+
+def timing_banded(sizes=(500, 2000, 5000), seed=3):
+    rng = np.random.default_rng(seed)
+    print(f"\n{'aligner':32s} {'n x m':>11s} {'dense s':>9s} {'banded s':>9s} {'dense MB':>9s} {'band MB':>9s}")
+    for name, kwargs in BANDED.items():
+        fn = getattr(matchpeaks, name)
+        for size in sizes:
+            mp, rw, mi, _ = random_case(rng, size)
+            mp, rw = mp * 10, rw * 10
+            kw = dict(kwargs, tolerance=kwargs["tolerance"] * (1 if kwargs["tolerance"] < 1 else 10))
+            t0 = time.perf_counter()
+            dense = fn(mp, rw, measured_intensities=mi, **kw)
+            t_dense = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            banded = fn(mp, rw, measured_intensities=mi, banded=True, **kw)
+            t_banded = time.perf_counter() - t0
+            print(f"{name:32s} {len(mp):>5d}x{len(rw):<5d} {t_dense:9.3f} {t_banded:9.3f} "
+                  f"{dense[3].nbytes / 1e6:9.1f} {banded[3].data.nbytes / 1e6:9.2f}")
+
+
+def memory_lean(size=3000, seed=7):
+    """Peak allocation of match_peaks_ready with and without diagnostics."""
+    rng = np.random.default_rng(seed)
+    mp, rw, mi, _ = random_case(rng, size)
+    print(f"\n{'diagnostics':>12s} {'n x m':>11s} {'time s':>9s} {'peak MB':>9s}")
+    for diagnostics in (True, False):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        matchpeaks.match_peaks_ready(mp, rw, measured_intensities=mi, return_diagnostics=diagnostics)
+        elapsed = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{str(diagnostics):>12s} {len(mp):>5d}x{len(rw):<5d} {elapsed:9.3f} {peak / 1e6:9.1f}")
+
+
+def timing_batch(spectra=(8, 32), size=60, seed=5):
+    """Neon-sized lists: one batch call against a loop over the spectra."""
+    rng = np.random.default_rng(seed)
+    rw = random_case(rng, size)[1]
+    print(f"\n{'spectra':>8s} {'n x m':>11s} {'loop s':>9s} {'batch s':>9s} {'speed-up':>9s}")
+    for count in spectra:
+        cases = [random_case(rng, size) for _ in range(count)]
+        mps, mis = [c[0] for c in cases], [c[2] for c in cases]
+        t0 = time.perf_counter()
+        for mp, mi in zip(mps, mis):
+            matchpeaks.match_peaks_ready(mp, rw, measured_intensities=mi)
+        t_loop = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        matchpeaks.match_peaks_batch(mps, rw, mis, method="ready")
+        t_batch = time.perf_counter() - t0
+        print(f"{count:8d} {max(map(len, mps)):>5d}x{len(rw):<5d} {t_loop:9.3f} {t_batch:9.4f} {t_loop / t_batch:8.1f}x")
+
+
+if __name__ == "__main__":
+    failures = check() + check_ties() + check_empty() + check_banded() + check_lean() + check_batch()
+    timing()
+    timing_banded()
+    timing_batch()
+    memory_lean()
+    if failures:
+        sys.exit(f"{failures} mismatches")
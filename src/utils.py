@@ -1,17 +1,13 @@
 import pandas as pd
 import os.path
 import json
-from ramanchada2.spectrum import Spectrum
-import matplotlib.pyplot as plt 
 import numpy as np
-from sklearn.cluster import SpectralBiclustering
-from IPython.display import display, Markdown, HTML
 import re
-from ramanchada2.protocols.calibration.calibration_model import CalibrationModel
-from ramanchada2.protocols.calibration.ycalibration import (
-    YCalibrationComponent, YCalibrationCertificate, CertificatesDict)
 import logging
 import sys
+# matplotlib, sklearn, IPython and the ramanchada2 calibration modules are
+# imported by the functions using them: every task imports this module, most
+# need only a few of them (see tests/benchmark_startup.py)
 
 
 logger = logging.getLogger(__name__)
@@ -31,12 +27,20 @@ def get_enabled(key, _config):
 
 
 def load_spectrum_df(row):
+    from spectracache import load_spectrum
+    from spectracontainer import read_member, split_member
     fname = row["file_name"]
+    if split_member(fname) is not None:
+        # "<container.h5>::<key>", a spectrum in a container (see spectracontainer)
+        spe = read_member(fname)
+        if spe is None:
+            logger.warning(f"⚠️ Spectrum not found: {fname}")
+        return spe
     if not os.path.isfile(fname):
         logger.warning(f"⚠️ File not found: {fname}")
         return None        
     else:
-        return Spectrum.from_local_file(fname)
+        return load_spectrum(fname)
 
 
 def build_path(row, base_path, subfolders={}):
@@ -47,38 +51,76 @@ def build_path(row, base_path, subfolders={}):
         return os.path.join(base_path, subfolder, row['file_name'])
 
 
-def read_template(_path_excel, path_spectra="", subfolders={}, cleanup=False):
-    FRONT_SHEET_NAME = "Front sheet"
-    FILES_SHEET_NAME = "Files sheet"
+TEMPLATE_FRONT_SHEET_NAME = "Front sheet"
+TEMPLATE_FILES_SHEET_NAME = "Files sheet"
+TEMPLATE_FILES_SHEET_COLUMNS = "sample,measurement,file_name,background,overexposed,optical_path,laser_power_percent,laser_power_mW,integration_time_ms,humidity,temperature,date,time"
+TEMPLATE_FRONT_SHEET_COLUMNS = "optical_path,instrument_make,instrument_model,laser_wl,max_laser_power_mW,spectral_range,collection_optics,slit_size,grating,pin_hole_size,collection_fibre_diameter,notes"
+# bump when parse_template changes its output, so that cached templates are parsed again
+TEMPLATE_CACHE_VERSION = "1"
 
-    FILES_SHEET_COLUMNS = "sample,measurement,file_name,background,overexposed,optical_path,laser_power_percent,laser_power_mW,integration_time_ms,humidity,temperature,date,time"
-    FRONT_SHEET_COLUMNS = "optical_path,instrument_make,instrument_model,laser_wl,max_laser_power_mW,spectral_range,collection_optics,slit_size,grating,pin_hole_size,collection_fibre_diameter,notes"
-    df = pd.read_excel(_path_excel, sheet_name=FILES_SHEET_NAME)
-    _FILES_SHEET_COLUMNS = FILES_SHEET_COLUMNS.split(",")
+
+def parse_template(_path_excel):
+    # one open of the workbook, one parse per sheet
+    with pd.ExcelFile(_path_excel) as xls:
+        df = xls.parse(TEMPLATE_FILES_SHEET_NAME)
+        front = xls.parse(TEMPLATE_FRONT_SHEET_NAME, header=None)
+    # provider in B1, investigation in H1, the optical paths table from row 5 (header) on
+    provider = front.iloc[0, 1]
+    investigation = front.iloc[0, 7]
+    df_meta = front.iloc[5:].reset_index(drop=True).infer_objects()
+
+    _FILES_SHEET_COLUMNS = TEMPLATE_FILES_SHEET_COLUMNS.split(",")
     if len(_FILES_SHEET_COLUMNS) == len(df.columns):
         df.columns = _FILES_SHEET_COLUMNS  # Rename all columns
     else:
         df.columns = _FILES_SHEET_COLUMNS + df.columns[len(_FILES_SHEET_COLUMNS):].tolist()
         # Rename only the first few columns
     df['file_name'] = df['file_name'].str.strip()
-    #df['file_name'] = df['file_name'].apply(lambda f: os.path.join(path_spectra,f))
-    df['file_name'] = df.apply(
-        lambda row: build_path(row, path_spectra, subfolders),
-        axis=1
-    )
 
-    df_meta = pd.read_excel(_path_excel, sheet_name=FRONT_SHEET_NAME, skiprows=4)
     # print("meta", df_meta.columns)
-    df_meta.columns = FRONT_SHEET_COLUMNS.split(",")
+    df_meta.columns = TEMPLATE_FRONT_SHEET_COLUMNS.split(",")
     df_merged = pd.merge(df, df_meta, on='optical_path', how='left')
-
-    # Open the Excel file and read specific cells directly
-    with pd.ExcelFile(_path_excel) as xls:
-        provider = xls.parse(FRONT_SHEET_NAME, usecols="B", nrows=1, header=None).iloc[0, 0]
-        investigation = xls.parse(FRONT_SHEET_NAME, usecols="H", nrows=1, header=None).iloc[0, 0]
     df_merged["provider"] = provider
     df_merged["investigation"] = investigation
+    return df_merged
+
 
+def parse_template_cached(_path_excel, cache_dir=None):
+    """parse_template, cached as parquet in cache_dir under the hash of the workbook.
+
+    Templates that cannot be stored as parquet (pyarrow missing, mixed-type columns)
+    are parsed each time.
+    """
+    if cache_dir is None:
+        return parse_template(_path_excel)
+    from spectracache import file_hash
+    digest = file_hash(_path_excel)
+    cached = os.path.join(cache_dir, f"{digest}.v{TEMPLATE_CACHE_VERSION}.parquet")
+    if os.path.isfile(cached):
+        try:
+            return pd.read_parquet(cached)
+        except Exception as err:
+            logger.warning(f"Ignoring unreadable template cache {cached}: {err}")
+    df_merged = parse_template(_path_excel)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f"{cached}.{os.getpid()}.tmp"
+    try:
+        df_merged.to_parquet(tmp, index=False)
+        os.replace(tmp, cached)
+    except Exception as err:
+        logger.info(f"Template {_path_excel} not cached: {err}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return df_merged
+
+
+def read_template(_path_excel, path_spectra="", subfolders={}, cleanup=False, cache_dir=None):
+    df_merged = parse_template_cached(_path_excel, cache_dir=cache_dir)
+    #df['file_name'] = df['file_name'].apply(lambda f: os.path.join(path_spectra,f))
+    df_merged['file_name'] = df_merged.apply(
+        lambda row: build_path(row, path_spectra, subfolders),
+        axis=1
+    )
     return metadata_cleanup(df_merged) if cleanup else df_merged
 
 
@@ -116,6 +158,38 @@ def get_config_findkw(_config, key, tag="si"):
 def get_config_fitkw(_config, key, tag="ne"):
     return _config.get("templates", {}).get(key, {}).get("fit_kw", {}).get(tag, {'profile': 'Gaussian', 'vary_baseline': False})
 
+
+def get_config_processing(_config, name, default=None):
+    return _config.get("processing", {}).get(name, default)
+
+
+def get_config_workers(_config, key=None):
+    # per template "workers" overrides the global "processing" setting
+    workers = get_config_processing(_config, "workers", 1)
+    return _config.get("templates", {}).get(key, {}).get("workers", workers)
+
+
+def get_config_exports(_config):
+    # optional metadata exports of spectraframe_load, e.g. ["parquet", "xlsx"]
+    return get_config_processing(_config, "exports", [])
+
+
+def get_config_hdr_samples(_config, key):
+    # samples to HDR merge; None merges every sample measured with several integration times
+    return _config.get("templates", {}).get(key, {}).get("hdr", {}).get("samples", None)
+
+
+def get_config_template_cache(_config, config_root):
+    # folder of the parsed templates cache, relative to config_root; None disables it
+    path = get_config_processing(_config, "template_cache")
+    return None if path is None else os.path.join(config_root, path)
+
+
+def get_config_fit_cache(_config, config_root):
+    # folder of the peak fits cache (see spectrafitcache), relative to config_root; None disables it
+    path = get_config_processing(_config, "fit_cache")
+    return None if path is None else os.path.join(config_root, path)
+
 def find_peaks(spe_test, profile="Gaussian", find_kw=None, vary_baseline=False):
     if find_kw is None:
         find_kw = {"wlen": 200, "width": 1, "sharpening" : None}
@@ -131,6 +205,7 @@ def find_peaks(spe_test, profile="Gaussian", find_kw=None, vary_baseline=False):
 
 
 def plot_si_peak(spe_sil, spe_sil_calibrated, fitres= None, ax=None):
+    import matplotlib.pyplot as plt
     if ax is None:
         fig, ax1 = plt.subplots(1, 1, figsize=(15, 3))
     else:
@@ -154,7 +229,8 @@ def plot_si_peak(spe_sil, spe_sil_calibrated, fitres= None, ax=None):
 
 
 def plot_biclustering(pairwise_distances, identifiers, title='original',ax=None):
-    
+    import matplotlib.pyplot as plt
+    from sklearn.cluster import SpectralBiclustering
     # Perform biclustering
     model = SpectralBiclustering(n_clusters=(3, 3), method='log', random_state=0)
     model.fit(pairwise_distances)
@@ -185,8 +261,13 @@ def to_camel_case(s: str) -> str:
     return parts[0].lower() + ''.join(word.capitalize() for word in parts[1:])
 
 
+def _display_html(html):
+    from IPython.display import display, HTML
+    display(HTML(html))
+
+
 def toc_heading(title, h="h3"):
-    display(HTML(f"<{h}>{title}</{h}>"))
+    _display_html(f"<{h}>{title}</{h}>")
 
 
 def toc(keys, title=None):
@@ -196,29 +277,29 @@ def toc(keys, title=None):
     for index, _entry in enumerate(keys):
         toc += f'<a href="#{_entry}">{index+1}. {_entry}</a><br/>'
     toc += ""
-    display(HTML(f'<div id="top">{toc}</div>'))
+    _display_html(f'<div id="top">{toc}</div>')
 
 
 def toc_anchor(index, key):
-    display(HTML(f'<h2 id="{key}">{index+1}. {key}</h2>'))
+    _display_html(f'<h2 id="{key}">{index+1}. {key}</h2>')
 
 
 def toc_entry(key, data, relpath = None):
     if key is None:
-        display(HTML(f"<p>{data}</p>"))
+        _display_html(f"<p>{data}</p>")
     else:
         val = data.get(key, '')
         if relpath is not None:
             val = os.path.relpath(val, relpath)
-        display(HTML(f"<p><b>{key.capitalize()}:</b> {val}</p>"))
+        _display_html(f"<p><b>{key.capitalize()}:</b> {val}</p>")
 
 
 def toc_link(link, data=None, target='blank', label=None):
     _link = f"<a href='{link}' target='{target}'>{link if data is None else data}</a>"
     if label is None:
-        display(HTML(_link))
+        _display_html(_link)
     else:        
-        display(HTML(f"<p><b>{label.capitalize()}:</b> {_link}</p>"))        
+        _display_html(f"<p><b>{label.capitalize()}:</b> {_link}</p>")        
 
 
 def parse_numeric_value(v):
@@ -248,7 +329,7 @@ def toc_collapsible(summary="expand", content=""):
     {content}
     </details>
     """
-    display(HTML(html))
+    _display_html(html)
 
 
 superscripts = str.maketrans("0123456789-", "⁰¹²³⁴⁵⁶⁷⁸⁹⁻")
@@ -278,6 +359,7 @@ def plot_spectra_heatmaps(y_original, y_calibrated, wavelength, ids, tag):
         ids (list or np.ndarray): List of identifiers for each spectrum.
         tag (str): Title tag for the figure.
     """
+    import matplotlib.pyplot as plt
     n_spectra = y_original.shape[0]
     vmin = min(y_original.min(), y_calibrated.min())
     vmax = max(y_original.max(), y_calibrated.max())
@@ -346,6 +428,7 @@ def plot_spectra_heatmaps(y_original, y_calibrated, wavelength, ids, tag):
 
 
 def plot_spectra_heatmaps1(y_original, y_calibrated, wavelength, ids, tag):
+    import matplotlib.pyplot as plt
     n_spectra = y_original.shape[0]
     vmin = min(y_original.min(), y_calibrated.min())
     vmax = max(y_original.max(), y_calibrated.max())
@@ -397,6 +480,7 @@ def plot_spectra_heatmaps1(y_original, y_calibrated, wavelength, ids, tag):
 
 
 def load_calibration_model(laser_wl, optical_path, calmodel_path):
+    from ramanchada2.protocols.calibration.calibration_model import CalibrationModel
     logger.info("load_calibration_model")
     pkl_files = [file for file in os.listdir(calmodel_path) if file.endswith(".pkl")]
     for modelfile in pkl_files:
@@ -408,6 +492,7 @@ def load_calibration_model(laser_wl, optical_path, calmodel_path):
 
 
 def create_ycal(spe_srm, xcalmodel=None, cert_srm=None, window_length=0):
+    from ramanchada2.protocols.calibration.ycalibration import YCalibrationComponent
     if cert_srm is None:
         return None, spe_srm
     srm = spe_srm.trim_axes(method="x-axis", boundaries=cert_srm.raman_shift)
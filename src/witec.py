@@ -0,0 +1,433 @@
+"""Conversion of WITec ASCII exports to ramanchada2 ``.cha`` files.
+
+A WITec export is a pair of files::
+
+    ZZZ--Spectrum--YYY--Spec.Data 2.txt    spectrum ([Data] section)
+    ZZZ--Spectrum--YYY--Information.txt    metadata
+
+``convert_witec_folder`` converts all exports below a folder, optionally with a
+process pool. An export whose ``.cha`` is up to date is skipped: with
+``check="mtime"`` the ``.cha`` has to be newer than both source files, with
+``check="hash"`` the content hash of the sources has to match the one recorded
+in ``witec_convert.manifest.json`` (in the root folder) when it was written.
+
+With ``container`` all spectra of the folder go to a single HDF5 file instead
+(see ``spectracontainer``), which also holds the mtime and hash of the sources.
+"""
+import io
+import json
+import logging
+import os
+import os.path
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from ramanchada2.spectrum import Spectrum
+
+from spectracache import file_hash
+from spectracontainer import SpectraContainer, member_path
+
+
+logger = logging.getLogger(__name__)
+
+DATA_PATTERN = "*--Spec.Data 2.txt"
+MANIFEST_NAME = "witec_convert.manifest.json"
+CHECKS = ("mtime", "hash")
+
+
+def parse_witec_metadata(info_file):
+    """
+    Parse WITec Information.txt file into a dictionary.
+    """
+
+    metadata = {}
+
+    text = Path(info_file).read_text(
+        encoding="utf-8",
+        errors="ignore"
+    )
+
+    for line in text.splitlines():
+
+        if ":" in line:
+            key, value = line.split(":", 1)
+
+            key = key.strip()
+            value = value.strip()
+
+            # try numeric conversion
+            try:
+                value_num = float(value)
+                metadata[key] = value_num
+            except ValueError:
+                metadata[key] = value
+
+    return metadata, text
+
+
+def get_spectral_center(metadata, text):
+    """
+    Get Raman shift center offset.
+    """
+
+    # already provided
+    for key in metadata:
+        if "Spectral Center" in key:
+            return float(metadata[key])
+
+    # fallback: calculate from wavelengths
+    laser = None
+    center = None
+
+    for key, value in metadata.items():
+
+        if "Excitation Wavelength" in key:
+            laser = float(value)
+
+        if "Center Wavelength" in key:
+            center = float(value)
+
+    if laser and center:
+
+        return (
+            1 / laser -
+            1 / center
+        ) * 1e7
+
+    raise ValueError(
+        "No Raman calibration information found"
+    )
+
+
+def info_path(data_file):
+    """
+    ZZZ--Spectrum--YYY--Spec.Data 2.txt -> ZZZ--Spectrum--YYY--Information.txt
+    """
+    data_file = Path(data_file)
+    return data_file.parent / data_file.name.replace(
+        "--Spec.Data 2.txt",
+        "--Information.txt"
+    )
+
+
+def find_info_file(data_file):
+    """
+    Match:
+    ZZZ--Spectrum--YYY--Spec.Data 2.txt
+    ->
+    ZZZ--Spectrum--YYY--Information.txt
+    """
+
+    info_file = info_path(data_file)
+
+    if not info_file.exists():
+        raise FileNotFoundError(
+            f"Missing information file:\n{info_file}"
+        )
+
+    return info_file
+
+
+def cha_path(data_file):
+    return Path(data_file).with_suffix(".cha")
+
+
+def _parse_witec_lines(lines):
+    """Line by line parse of the data block: rows whose first two fields are not numbers are skipped."""
+    x = []
+    y = []
+
+    for line in lines:
+
+        parts = line.split()
+
+        if len(parts) >= 2:
+
+            try:
+                x.append(float(parts[0]))
+                y.append(float(parts[1]))
+
+            except ValueError:
+                pass
+
+    return np.asarray(x), np.asarray(y)
+
+
+def read_witec_spectrum(data_file):
+    """
+    Read WITec ASCII spectrum export.
+
+    Only the header is read line by line, up to the two lines following
+    ``[Data]``; the numeric block is parsed by ``np.loadtxt``. Blocks with
+    rows it cannot parse (text, single values) fall back to the line parser,
+    which skips them.
+    """
+
+    with open(data_file, "r", encoding="utf-8", errors="ignore") as f:
+
+        line = f.readline()
+        while line and line.strip() != "[Data]":
+            line = f.readline()
+
+        if not line:
+            raise ValueError(
+                f"No [Data] section in {data_file}"
+            )
+
+        # column headers
+        f.readline()
+        f.readline()
+        block = f.read()
+
+    if not block.strip():
+        return np.asarray([]), np.asarray([])
+
+    try:
+        data = np.loadtxt(io.StringIO(block), usecols=(0, 1), ndmin=2, comments=None)
+    except ValueError:
+        return _parse_witec_lines(block.splitlines())
+
+    return data[:, 0].copy(), data[:, 1].copy()
+
+
+def read_witec_export(data_file):
+    """Spectrum of a WITec export, with the metadata of its Information file."""
+
+    data_file = Path(data_file)
+
+    # matching metadata file
+    info_file = find_info_file(data_file)
+
+    # read spectrum
+    x_relative, y = read_witec_spectrum(data_file)
+    # read all metadata
+    metadata, raw_metadata = parse_witec_metadata(info_file)
+
+    # WITec exports "rel. 1/cm" already as calibrated Raman shift
+    # (instrument software applied the grating calibration before export),
+    # so the exported axis is used directly. "Spectral Center" is the Raman
+    # shift at the CCD center pixel - informational only, not an offset.
+    try:
+        spectral_center = get_spectral_center(metadata, raw_metadata)
+    except ValueError:
+        spectral_center = None
+
+    x = x_relative
+
+    # create ramanchada2 Spectrum
+    return Spectrum(
+        x=x,
+        y=y,
+        metadata={
+            "Source file":
+                str(data_file),
+
+            "Information file":
+                str(info_file),
+
+            "Original axis":
+                "rel. 1/cm (calibrated Raman shift)",
+
+            "Converted axis":
+                "Raman shift 1/cm",
+
+            "Spectral Center cm-1":
+                spectral_center,
+            }
+    )
+
+
+def convert_witec_to_cha(data_file):
+    """Convert one export to ``<data file>.cha``; returns ``(output, spectrum)``."""
+
+    spectrum = read_witec_export(data_file)
+    output = cha_path(data_file)
+    # write next to the target and rename, an interrupted run leaves no partial .cha
+    tmp = output.with_name(f"{output.name}.{os.getpid()}.tmp")
+    try:
+        spectrum.write_cha(str(tmp), dataset="/raw")
+        os.replace(tmp, output)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+    return str(output), spectrum
+
+
+def source_hash(data_file):
+    """Content hash of an export (data and Information file)."""
+    return file_hash(str(data_file)) + file_hash(str(find_info_file(data_file)))
+
+
+def source_mtime_ns(data_file):
+    """Latest modification time of an export (data and Information file)."""
+    info_file = info_path(data_file)
+    sources = [data_file, info_file] if info_file.exists() else [data_file]
+    return max(Path(f).stat().st_mtime_ns for f in sources)
+
+
+def is_up_to_date(data_file, check="mtime", written_ns=None, recorded=None):
+    """True if the output of ``data_file`` was written from the current sources.
+
+    ``written_ns`` is the mtime of the output (``None`` if there is none) and
+    ``recorded`` the source hash stored with it (``check="hash"``).
+    """
+    if written_ns is None:
+        return False
+    if check == "hash":
+        return bool(recorded) and recorded == source_hash(data_file)
+    return written_ns >= source_mtime_ns(data_file)
+
+
+def _meta_dump(spe):
+    try:
+        return spe.meta.serialize()
+    except Exception as err:
+        logger.debug(f"spectrum metadata not serialized: {err}")
+        return {}
+
+
+def _convert(data_file, check="mtime", bundle=False):
+    """``(output, source hash or None, error)``; errors are returned, not raised.
+
+    With ``bundle`` the output is ``(x, y, metadata, source mtime)`` for the
+    container, which is written by the parent process.
+    """
+    try:
+        digest = source_hash(data_file) if check == "hash" else None
+        if bundle:
+            mtime_ns = source_mtime_ns(data_file)
+            spe = read_witec_export(data_file)
+            return (spe.x, spe.y, _meta_dump(spe), mtime_ns), digest, None
+        output, _ = convert_witec_to_cha(data_file)
+        return output, digest, None
+    except Exception as err:
+        return None, None, str(err)
+
+
+def _read_manifest(path):
+    if not path.exists():
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as err:
+        logger.warning(f"Ignoring unreadable manifest {path}: {err}")
+        return {}
+
+
+def _write_manifest(path, manifest):
+    tmp = path.with_name(f"{path.name}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def convert_witec_folder(root_folder, workers=1, check="mtime", force=False, chunksize=4, container=None):
+    """
+    Recursively convert all WITec:
+
+    ZZZ--Spectrum--YYY--Spec.Data 2.txt
+
+    files into ramanchada2 .cha files.
+
+    The matching:
+
+    ZZZ--Spectrum--YYY--Information.txt
+
+    file is used for metadata and Raman calibration.
+
+    Args:
+        root_folder (str): folder searched recursively.
+        workers (int): number of worker processes; ``<= 1`` converts in-process.
+        check (str): ``"mtime"`` or ``"hash"``, how up to date outputs are detected.
+        force (bool): convert all exports, even if up to date.
+        chunksize (int): number of exports handed to a worker at once.
+        container (str): write all spectra to this HDF5 container (relative to
+            ``root_folder``) instead of one ``.cha`` per export, see ``spectracontainer``.
+
+    Returns:
+        pd.DataFrame: one row per export with ``data_file``, ``output``,
+        ``status`` (``converted``, ``skipped`` or ``failed``) and ``error``.
+        Outputs in a container are ``<container>::<key>`` references.
+    """
+    if check not in CHECKS:
+        raise ValueError(f"check should be one of {CHECKS}, got {check!r}")
+    root_folder = Path(root_folder)
+    bundle = container is not None
+    manifest_file = root_folder / MANIFEST_NAME
+    manifest = _read_manifest(manifest_file) if check == "hash" and not bundle else {}
+    store = SpectraContainer(str(root_folder / container), mode="a") if bundle else None
+
+    def key_of(data_file):
+        # manifest and container are keyed by paths relative to the root folder
+        return Path(data_file).relative_to(root_folder).as_posix()
+
+    def output_of(data_file):
+        if bundle:
+            return member_path(store.path, key_of(data_file))
+        return str(cha_path(data_file))
+
+    def written(data_file):
+        if bundle:
+            stamp = store.stamp(key_of(data_file))
+            return (None, None) if stamp is None else (stamp["mtime_ns"], stamp["hash"])
+        output = cha_path(data_file)
+        if not output.exists():
+            return None, None
+        return output.stat().st_mtime_ns, manifest.get(key_of(data_file))
+
+    try:
+        data_files = sorted(str(f) for f in root_folder.rglob(DATA_PATTERN))
+        rows = {}
+        todo = []
+        for data_file in data_files:
+            try:
+                written_ns, recorded = written(data_file)
+                skip = not force and is_up_to_date(data_file, check=check,
+                                                   written_ns=written_ns, recorded=recorded)
+            except Exception as err:
+                rows[data_file] = (None, "failed", str(err))
+                continue
+            if skip:
+                rows[data_file] = (output_of(data_file), "skipped", None)
+            else:
+                todo.append(data_file)
+
+        if workers is None or workers <= 1 or len(todo) < 2:
+            results = (_convert(data_file, check, bundle) for data_file in todo)
+            pool = None
+        else:
+            pool = ProcessPoolExecutor(max_workers=min(workers, len(todo)))
+            n = len(todo)
+            results = pool.map(_convert, todo, [check] * n, [bundle] * n, chunksize=chunksize)
+
+        try:
+            # results are consumed as they come, a container holds one spectrum at a time
+            for data_file, (output, digest, err) in zip(todo, results):
+                if err is not None:
+                    logger.warning(f"FAILED: {data_file}: {err}")
+                    rows[data_file] = (None, "failed", err)
+                    manifest.pop(key_of(data_file), None)
+                    continue
+                if bundle:
+                    x, y, metadata, mtime_ns = output
+                    store.write(key_of(data_file), x, y, metadata=metadata,
+                                mtime_ns=mtime_ns, hash=digest or "")
+                    output = output_of(data_file)
+                elif digest is not None:
+                    manifest[key_of(data_file)] = digest
+                rows[data_file] = (output, "converted", None)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+    finally:
+        if store is not None:
+            store.close()
+
+    if check == "hash" and not bundle:
+        _write_manifest(manifest_file, manifest)
+
+    return pd.DataFrame([(data_file, *rows[data_file]) for data_file in data_files],
+                        columns=["data_file", "output", "status", "error"])